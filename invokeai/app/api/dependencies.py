@@ -1,5 +1,6 @@
 # Copyright (c) 2022 Kyle Schouviller (https://github.com/kyle0654)
 
+import threading
 from logging import Logger
 from invokeai.app.services.board_image_record_storage import (
     SqliteBoardImageRecordStorage,
@@ -13,14 +14,20 @@ from invokeai.app.services.boards import BoardService, BoardServiceDependencies
 from invokeai.app.services.config import InvokeAIAppConfig
 from invokeai.app.services.image_record_storage import SqliteImageRecordStorage
 from invokeai.app.services.images import ImageService, ImageServiceDependencies
+from invokeai.app.services.intermediate_image_storage import (
+    MemoryIntermediateImageStorage,
+    ScratchIntermediateImageStorage,
+)
 from invokeai.app.services.resource_name import SimpleNameService
 from invokeai.app.services.urls import LocalUrlService
+from invokeai.app.util.image_encoding import ImageEncoder
 from invokeai.backend.util.logging import InvokeAILogger
 from invokeai.version.invokeai_version import __version__
 
 from ..services.default_graphs import create_system_graphs
 from ..services.latent_storage import DiskLatentsStorage, ForwardCacheLatentsStorage
-from ..services.graph import GraphExecutionState, LibraryGraph
+from ..services.graph import LibraryGraph
+from ..services.graph_execution_storage import SqliteGraphExecutionStateStorage
 from ..services.image_file_storage import DiskImageFileStorage
 from ..services.invocation_queue import MemoryInvocationQueue
 from ..services.invocation_services import InvocationServices
@@ -28,6 +35,7 @@ from ..services.invoker import Invoker
 from ..services.processor import DefaultInvocationProcessor
 from ..services.sqlite import SqliteItemStorage
 from ..services.model_manager_service import ModelManagerService
+from ..services.model_jobs import ModelJobService
 from ..services.invocation_stats import InvocationStatsService
 from .events import FastAPIEventService
 
@@ -51,6 +59,15 @@ def check_internet() -> bool:
 logger = InvokeAILogger.getLogger()
 
 
+def backfill_image_search_index(image_record_storage: SqliteImageRecordStorage, logger: Logger) -> None:
+    try:
+        indexed = image_record_storage.backfill_search_index()
+        if indexed > 0:
+            logger.info(f"Added {indexed} images to the image search index")
+    except Exception as e:
+        logger.error(f"Failed to build the image search index: {e}")
+
+
 class ApiDependencies:
     """Contains and initializes all dependencies for the API"""
 
@@ -71,16 +88,29 @@ class ApiDependencies:
         db_path.parent.mkdir(parents=True, exist_ok=True)
         db_location = str(db_path)
 
-        graph_execution_manager = SqliteItemStorage[GraphExecutionState](
-            filename=db_location, table_name="graph_executions"
-        )
+        graph_execution_manager = SqliteGraphExecutionStateStorage(filename=db_location, table_name="graph_executions")
 
         urls = LocalUrlService()
         image_record_storage = SqliteImageRecordStorage(db_location)
-        image_file_storage = DiskImageFileStorage(f"{output_folder}/images")
+        image_file_storage = DiskImageFileStorage(
+            f"{output_folder}/images",
+            max_cache_bytes=int(config.image_cache_size * 2**30),
+            encoder=ImageEncoder(config.image_format, config.png_compress_level),
+            intermediate_encoder=ImageEncoder(
+                config.intermediate_format, config.png_compress_level, config.intermediate_quality
+            ),
+        )
         names = SimpleNameService()
         latents = ForwardCacheLatentsStorage(DiskLatentsStorage(f"{output_folder}/latents"))
 
+        intermediate_images = None
+        if config.intermediate_storage == "memory":
+            intermediate_images = MemoryIntermediateImageStorage(retention=config.intermediate_retention)
+        elif config.intermediate_storage == "scratch":
+            intermediate_images = ScratchIntermediateImageStorage(
+                f"{output_folder}/scratch", retention=config.intermediate_retention
+            )
+
         board_record_storage = SqliteBoardRecordStorage(db_location)
         board_image_record_storage = SqliteBoardImageRecordStorage(db_location)
 
@@ -113,11 +143,14 @@ class ApiDependencies:
                 logger=logger,
                 names=names,
                 graph_execution_manager=graph_execution_manager,
+                events=events,
+                intermediate_images=intermediate_images,
             )
         )
 
         services = InvocationServices(
             model_manager=ModelManagerService(config, logger),
+            model_jobs=ModelJobService(max_jobs=config.max_model_jobs),
             events=events,
             latents=latents,
             images=images,
@@ -134,6 +167,17 @@ class ApiDependencies:
 
         create_system_graphs(services.graph_library)
 
+        # Index images saved before the search index existed, without delaying startup
+        threading.Thread(
+            target=backfill_image_search_index,
+            args=(image_record_storage, logger),
+            name="image-search-backfill",
+            daemon=True,
+        ).start()
+
+        if config.compile_mode != "none" and config.compile_warmup:
+            services.model_manager.warmup_compiled_models(config.compile_warmup)
+
         ApiDependencies.invoker = Invoker(services)
 
     @staticmethod
@@ -5,7 +5,11 @@ from fastapi.routing import APIRouter
 from pydantic import BaseModel, Field
 
 from invokeai.app.services.board_record_storage import BoardChanges
-from invokeai.app.services.image_record_storage import OffsetPaginatedResults
+from invokeai.app.services.image_record_storage import (
+    CursorPaginatedResults,
+    InvalidCursorException,
+    OffsetPaginatedResults,
+)
 from invokeai.app.services.models.board_record import BoardDTO
 
 from ..dependencies import ApiDependencies
@@ -41,6 +45,25 @@ async def create_board(
         raise HTTPException(status_code=500, detail="Failed to create board")
 
 
+# Declared before /{board_id} so that it isn't matched as a board id
+@boards_router.get(
+    "/cursor",
+    operation_id="list_boards_by_cursor",
+    response_model=CursorPaginatedResults[BoardDTO],
+)
+async def list_boards_by_cursor(
+    cursor: Optional[str] = Query(
+        default=None, description="The next_cursor of the previous page. Omit to get the first page."
+    ),
+    limit: int = Query(default=10, gt=0, description="The number of boards per page"),
+) -> CursorPaginatedResults[BoardDTO]:
+    """Gets a page of boards, using keyset pagination"""
+    try:
+        return ApiDependencies.invoker.services.boards.get_many_by_cursor(cursor, limit)
+    except InvalidCursorException:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
 @boards_router.get("/{board_id}", operation_id="get_board", response_model=BoardDTO)
 async def get_board(
     board_id: str = Path(description="The id of board to get"),
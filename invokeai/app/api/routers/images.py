@@ -1,20 +1,31 @@
+import base64
 import io
+import os
+import threading
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
 from typing import Optional
 
 from PIL import Image
 from fastapi import Body, HTTPException, Path, Query, Request, Response, UploadFile
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import FileResponse
 from fastapi.routing import APIRouter
 from pydantic import BaseModel, Field
 
 from invokeai.app.invocations.metadata import ImageMetadata
 from invokeai.app.models.image import ImageCategory, ResourceOrigin
-from invokeai.app.services.image_record_storage import OffsetPaginatedResults
+from invokeai.app.services.image_record_storage import (
+    CursorPaginatedResults,
+    InvalidCursorException,
+    OffsetPaginatedResults,
+)
 from invokeai.app.services.models.image_record import (
     ImageDTO,
     ImageRecordChanges,
     ImageUrlsDTO,
 )
+from invokeai.app.util.image_encoding import get_media_type
 from ..dependencies import ApiDependencies
 
 images_router = APIRouter(prefix="/v1/images", tags=["images"])
@@ -22,6 +33,7 @@ images_router = APIRouter(prefix="/v1/images", tags=["images"])
 
 # images are immutable; set a high max-age
 IMAGE_MAX_AGE = 31536000
+MAX_THUMBNAILS_PER_REQUEST = 200
 
 
 @images_router.post(
@@ -151,6 +163,127 @@ async def get_image_metadata(
         raise HTTPException(status_code=404)
 
 
+class ThumbnailBytesCache:
+    """
+    A thread-safe LRU of encoded thumbnail files, bounded by the total number of bytes held.
+
+    Entries are keyed by path, modification time and size, so a replaced or deleted file is never served
+    from the cache: requests must `stat` the file first, which they do anyway to build the ETag.
+    """
+
+    def __init__(self, max_bytes: int):
+        self._max_bytes = max_bytes
+        self._size = 0
+        self._entries: OrderedDict[tuple[str, int, int], bytes] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path: str, stat: os.stat_result) -> bytes:
+        key = (path, stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+                return data
+
+        with open(path, "rb") as f:
+            data = f.read()
+
+        if len(data) <= self._max_bytes:
+            with self._lock:
+                if key not in self._entries:
+                    self._entries[key] = data
+                    self._size += len(data)
+                    while self._size > self._max_bytes:
+                        _, evicted = self._entries.popitem(last=False)
+                        self._size -= len(evicted)
+        return data
+
+
+_thumbnail_cache: Optional[ThumbnailBytesCache] = None
+
+
+def get_thumbnail_cache() -> ThumbnailBytesCache:
+    """Gets the thumbnail cache, sized by the `thumbnail_cache_size` setting."""
+    global _thumbnail_cache
+    if _thumbnail_cache is None:
+        config = ApiDependencies.invoker.services.configuration
+        _thumbnail_cache = ThumbnailBytesCache(int(config.thumbnail_cache_size * 2**30))
+    return _thumbnail_cache
+
+
+def is_valid_image_name(image_name: str) -> bool:
+    """Whether an image name is a plain file name, which can't reach outside of the image folders."""
+    return (
+        image_name not in ("", ".", "..")
+        and "/" not in image_name
+        and "\\" not in image_name
+        and "\0" not in image_name
+    )
+
+
+def read_range(path: str, start: int, end: int) -> bytes:
+    """Reads the bytes of a file from `start` to `end`, inclusive."""
+    with open(path, "rb") as f:
+        f.seek(start)
+        return f.read(end - start + 1)
+
+
+def get_validators(stat: os.stat_result) -> dict[str, str]:
+    """Gets the ETag and Last-Modified headers for a file. Image files are never modified in place."""
+    return {
+        "ETag": f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"',
+        "Last-Modified": formatdate(stat.st_mtime, usegmt=True),
+    }
+
+
+def is_not_modified(request: Request, validators: dict[str, str]) -> bool:
+    """Whether the client's cached copy is still valid, per `If-None-Match` or `If-Modified-Since`."""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        etags = [etag.strip().removeprefix("W/") for etag in if_none_match.split(",")]
+        return "*" in etags or validators["ETag"] in etags
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is not None:
+        try:
+            return parsedate_to_datetime(validators["Last-Modified"]) <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def parse_range(request: Request, validators: dict[str, str], size: int) -> Optional[tuple[int, int]]:
+    """
+    Gets the inclusive byte range requested by a single-range `Range` header, or None to send the whole file.
+    Raises a 416 HTTPException if the range can't be satisfied.
+    """
+    range_header = request.headers.get("range")
+    if range_header is None or not range_header.startswith("bytes="):
+        return None
+    # a stale If-Range means the client's partial copy is out of date; send everything
+    if_range = request.headers.get("if-range")
+    if if_range is not None and if_range not in (validators["ETag"], validators["Last-Modified"]):
+        return None
+
+    ranges = range_header[len("bytes=") :].split(",")
+    if len(ranges) != 1:
+        return None
+    start_str, _, end_str = ranges[0].strip().partition("-")
+    try:
+        if start_str == "":
+            # suffix range, e.g. "bytes=-500" for the last 500 bytes
+            start, end = max(size - int(end_str), 0), size - 1
+        else:
+            start = int(start_str)
+            end = min(int(end_str), size - 1) if end_str else size - 1
+    except ValueError:
+        return None
+
+    if start > end or start >= size:
+        raise HTTPException(status_code=416, headers={"Content-Range": f"bytes */{size}"})
+    return start, end
+
+
 @images_router.api_route(
     "/i/{image_name}/full",
     methods=["GET", "HEAD"],
@@ -159,32 +292,54 @@ async def get_image_metadata(
     responses={
         200: {
             "description": "Return the full-resolution image",
-            "content": {"image/png": {}},
+            "content": {"image/png": {}, "image/webp": {}, "image/jpeg": {}, "image/avif": {}},
         },
+        206: {"description": "Return the requested range of the full-resolution image"},
+        304: {"description": "The image has not been modified"},
         404: {"description": "Image not found"},
+        416: {"description": "The requested range is not satisfiable"},
     },
 )
 async def get_image_full(
+    request: Request,
     image_name: str = Path(description="The name of full-resolution image file to get"),
-) -> FileResponse:
+) -> Response:
     """Gets a full-resolution image file"""
 
+    if not is_valid_image_name(image_name):
+        raise HTTPException(status_code=404)
     try:
         path = ApiDependencies.invoker.services.images.get_path(image_name)
+        stat = await run_in_threadpool(os.stat, path)
+    except Exception:
+        raise HTTPException(status_code=404)
 
-        if not ApiDependencies.invoker.services.images.validate_path(path):
-            raise HTTPException(status_code=404)
-
-        response = FileResponse(
+    headers = {
+        **get_validators(stat),
+        "Cache-Control": f"max-age={IMAGE_MAX_AGE}",
+        "Accept-Ranges": "bytes",
+    }
+    if is_not_modified(request, headers):
+        return Response(status_code=304, headers=headers)
+
+    byte_range = parse_range(request, headers, stat.st_size)
+    if byte_range is None:
+        return FileResponse(
             path,
-            media_type="image/png",
+            media_type=get_media_type(image_name),
             filename=image_name,
             content_disposition_type="inline",
+            headers=headers,
+            stat_result=stat,
         )
-        response.headers["Cache-Control"] = f"max-age={IMAGE_MAX_AGE}"
-        return response
+
+    start, end = byte_range
+    try:
+        content = await run_in_threadpool(read_range, path, start, end)
     except Exception:
         raise HTTPException(status_code=404)
+    headers["Content-Range"] = f"bytes {start}-{end}/{stat.st_size}"
+    return Response(content=content, status_code=206, media_type=get_media_type(image_name), headers=headers)
 
 
 @images_router.get(
@@ -196,24 +351,69 @@ async def get_image_full(
             "description": "Return the image thumbnail",
             "content": {"image/webp": {}},
         },
+        304: {"description": "The thumbnail has not been modified"},
         404: {"description": "Image not found"},
     },
 )
 async def get_image_thumbnail(
+    request: Request,
     image_name: str = Path(description="The name of thumbnail image file to get"),
-) -> FileResponse:
+) -> Response:
     """Gets a thumbnail image file"""
 
+    if not is_valid_image_name(image_name):
+        raise HTTPException(status_code=404)
     try:
         path = ApiDependencies.invoker.services.images.get_path(image_name, thumbnail=True)
-        if not ApiDependencies.invoker.services.images.validate_path(path):
-            raise HTTPException(status_code=404)
+        stat = await run_in_threadpool(os.stat, path)
+    except Exception:
+        raise HTTPException(status_code=404)
 
-        response = FileResponse(path, media_type="image/webp", content_disposition_type="inline")
-        response.headers["Cache-Control"] = f"max-age={IMAGE_MAX_AGE}"
-        return response
+    headers = {**get_validators(stat), "Cache-Control": f"max-age={IMAGE_MAX_AGE}"}
+    if is_not_modified(request, headers):
+        return Response(status_code=304, headers=headers)
+
+    try:
+        content = await run_in_threadpool(get_thumbnail_cache().get, path, stat)
     except Exception:
         raise HTTPException(status_code=404)
+    return Response(content=content, media_type="image/webp", headers=headers)
+
+
+class ThumbnailsResult(BaseModel):
+    thumbnails: dict[str, str] = Field(description="The thumbnails, as data URLs, keyed by image name")
+    missing_image_names: list[str] = Field(description="The image names for which there is no thumbnail")
+
+
+@images_router.post("/thumbnails", operation_id="get_image_thumbnails", response_model=ThumbnailsResult)
+async def get_image_thumbnails(
+    image_names: list[str] = Body(
+        description="The names of the images whose thumbnails to get",
+        embed=True,
+        max_items=MAX_THUMBNAILS_PER_REQUEST,
+    ),
+) -> ThumbnailsResult:
+    """Gets many thumbnails in one request, e.g. to fill a page of the gallery"""
+
+    images = ApiDependencies.invoker.services.images
+    thumbnail_cache = get_thumbnail_cache()
+
+    def read_thumbnails() -> ThumbnailsResult:
+        thumbnails: dict[str, str] = dict()
+        missing_image_names: list[str] = []
+        for image_name in image_names:
+            if not is_valid_image_name(image_name):
+                missing_image_names.append(image_name)
+                continue
+            try:
+                path = images.get_path(image_name, thumbnail=True)
+                content = thumbnail_cache.get(path, os.stat(path))
+                thumbnails[image_name] = f"data:image/webp;base64,{base64.b64encode(content).decode('ascii')}"
+            except Exception:
+                missing_image_names.append(image_name)
+        return ThumbnailsResult(thumbnails=thumbnails, missing_image_names=missing_image_names)
+
+    return await run_in_threadpool(read_thumbnails)
 
 
 @images_router.get(
@@ -268,6 +468,55 @@ async def list_image_dtos(
     return image_dtos
 
 
+@images_router.get(
+    "/cursor",
+    operation_id="list_image_dtos_by_cursor",
+    response_model=CursorPaginatedResults[ImageDTO],
+)
+async def list_image_dtos_by_cursor(
+    image_origin: Optional[ResourceOrigin] = Query(default=None, description="The origin of images to list."),
+    categories: Optional[list[ImageCategory]] = Query(default=None, description="The categories of image to include."),
+    is_intermediate: Optional[bool] = Query(default=None, description="Whether to list intermediate images."),
+    board_id: Optional[str] = Query(
+        default=None,
+        description="The board id to filter by. Use 'none' to find images without a board.",
+    ),
+    cursor: Optional[str] = Query(
+        default=None, description="The next_cursor of the previous page. Omit to get the first page."
+    ),
+    limit: int = Query(default=10, gt=0, description="The number of images per page"),
+) -> CursorPaginatedResults[ImageDTO]:
+    """Gets a page of image DTOs, using keyset pagination"""
+
+    try:
+        return ApiDependencies.invoker.services.images.get_many_by_cursor(
+            cursor,
+            limit,
+            image_origin,
+            categories,
+            is_intermediate,
+            board_id,
+        )
+    except InvalidCursorException:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+@images_router.get(
+    "/search",
+    operation_id="search_image_dtos",
+    response_model=OffsetPaginatedResults[ImageDTO],
+)
+async def search_image_dtos(
+    query: str = Query(description="Words to search for in the prompts, model names and settings of images."),
+    is_intermediate: Optional[bool] = Query(default=None, description="Whether to search intermediate images."),
+    offset: int = Query(default=0, ge=0, description="The page offset"),
+    limit: int = Query(default=10, ge=1, description="The number of images per page"),
+) -> OffsetPaginatedResults[ImageDTO]:
+    """Searches image DTOs by their metadata, best matches first"""
+
+    return ApiDependencies.invoker.services.images.search(query, offset, limit, is_intermediate)
+
+
 class DeleteImagesFromListResult(BaseModel):
     deleted_images: list[str]
 
@@ -277,13 +526,8 @@ async def delete_images_from_list(
     image_names: list[str] = Body(description="The list of names of images to delete", embed=True),
 ) -> DeleteImagesFromListResult:
     try:
-        deleted_images: list[str] = []
-        for image_name in image_names:
-            try:
-                ApiDependencies.invoker.services.images.delete(image_name)
-                deleted_images.append(image_name)
-            except Exception:
-                pass
+        # records are deleted in one transaction; the files are removed in the background
+        deleted_images = ApiDependencies.invoker.services.images.delete_many(image_names)
         return DeleteImagesFromListResult(deleted_images=deleted_images)
     except Exception:
         raise HTTPException(status_code=500, detail="Failed to delete images")
@@ -298,13 +542,9 @@ async def star_images_in_list(
     image_names: list[str] = Body(description="The list of names of images to star", embed=True),
 ) -> ImagesUpdatedFromListResult:
     try:
-        updated_image_names: list[str] = []
-        for image_name in image_names:
-            try:
-                ApiDependencies.invoker.services.images.update(image_name, changes=ImageRecordChanges(starred=True))
-                updated_image_names.append(image_name)
-            except Exception:
-                pass
+        updated_image_names = ApiDependencies.invoker.services.images.update_many(
+            image_names, changes=ImageRecordChanges(starred=True)
+        )
         return ImagesUpdatedFromListResult(updated_image_names=updated_image_names)
     except Exception:
         raise HTTPException(status_code=500, detail="Failed to star images")
@@ -315,13 +555,9 @@ async def unstar_images_in_list(
     image_names: list[str] = Body(description="The list of names of images to unstar", embed=True),
 ) -> ImagesUpdatedFromListResult:
     try:
-        updated_image_names: list[str] = []
-        for image_name in image_names:
-            try:
-                ApiDependencies.invoker.services.images.update(image_name, changes=ImageRecordChanges(starred=False))
-                updated_image_names.append(image_name)
-            except Exception:
-                pass
+        updated_image_names = ApiDependencies.invoker.services.images.update_many(
+            image_names, changes=ImageRecordChanges(starred=False)
+        )
         return ImagesUpdatedFromListResult(updated_image_names=updated_image_names)
     except Exception:
         raise HTTPException(status_code=500, detail="Failed to unstar images")
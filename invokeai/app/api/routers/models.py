@@ -1,6 +1,7 @@
 # Copyright (c) 2023 Kyle Schouviller (https://github.com/kyle0654), 2023 Kent Keirsey (https://github.com/hipsterusername), 2023 Lincoln D. Stein
 
 
+import asyncio
 import pathlib
 from typing import Literal, List, Optional, Union
 
@@ -17,6 +18,9 @@ from invokeai.backend.model_management.models import (
     InvalidModelException,
 )
 from invokeai.backend.model_management import MergeInterpolationMethod
+from invokeai.backend.model_management.convert_cache import ConvertCacheEntry
+
+from invokeai.app.services.model_jobs import ModelJob, ModelJobCancelled
 
 from ..dependencies import ApiDependencies
 
@@ -33,6 +37,20 @@ class ModelsList(BaseModel):
     models: list[Union[tuple(OPENAPI_MODEL_CONFIGS)]]
 
 
+async def _wait_for_job(job: ModelJob) -> dict:
+    """Waits for a model job without blocking the event loop, and returns its result."""
+    future = ApiDependencies.invoker.services.model_jobs.get_future(job.id)
+    try:
+        # a client that goes away doesn't cancel the job
+        return await asyncio.shield(asyncio.wrap_future(future))
+    except ModelJobCancelled:
+        raise HTTPException(status_code=409, detail=f"Model job {job.id} was cancelled")
+    except asyncio.CancelledError:
+        if not future.cancelled():
+            raise
+        raise HTTPException(status_code=409, detail=f"Model job {job.id} was cancelled")
+
+
 @models_router.get(
     "/",
     operation_id="list_models",
@@ -138,7 +156,9 @@ async def update_model(
         404: {"description": "The model could not be found"},
         415: {"description": "Unrecognized file/folder format"},
         424: {"description": "The model appeared to import successfully, but could not be found in the model manager"},
-        409: {"description": "There is already a model corresponding to this path or repo_id"},
+        409: {
+            "description": "There is already a model corresponding to this path or repo_id, or the import was cancelled"
+        },
     },
     status_code=201,
     response_model=ImportModelResponse,
@@ -151,24 +171,15 @@ async def import_model(
 ) -> ImportModelResponse:
     """Add a model using its local path, repo_id, or remote URL. Model characteristics will be probed and configured automatically"""
 
-    items_to_import = {location}
     prediction_types = {x.value: x for x in SchedulerPredictionType}
     logger = ApiDependencies.invoker.services.logger
 
     try:
-        installed_models = ApiDependencies.invoker.services.model_manager.heuristic_import(
-            items_to_import=items_to_import, prediction_type_helper=lambda x: prediction_types.get(prediction_type)
-        )
-        info = installed_models.get(location)
-
-        if not info:
-            logger.error("Import failed")
-            raise HTTPException(status_code=415)
-
-        logger.info(f"Successfully imported {location}, got {info}")
-        model_raw = ApiDependencies.invoker.services.model_manager.list_model(
-            model_name=info.name, base_model=info.base_model, model_type=info.model_type
+        job = ApiDependencies.invoker.services.model_jobs.submit_install(
+            location, prediction_type=prediction_types.get(prediction_type)
         )
+        model_raw = await _wait_for_job(job)
+        logger.info(f"Successfully imported {location}")
         return parse_obj_as(ImportModelResponse, model_raw)
 
     except ModelNotFoundException as e:
@@ -251,6 +262,7 @@ async def delete_model(
         200: {"description": "Model converted successfully"},
         400: {"description": "Bad request"},
         404: {"description": "Model not found"},
+        409: {"description": "The job was cancelled"},
     },
     status_code=200,
     response_model=ConvertModelResponse,
@@ -268,15 +280,13 @@ async def convert_model(
     try:
         logger.info(f"Converting model: {model_name}")
         dest = pathlib.Path(convert_dest_directory) if convert_dest_directory else None
-        ApiDependencies.invoker.services.model_manager.convert_model(
+        job = ApiDependencies.invoker.services.model_jobs.submit_convert(
             model_name,
             base_model=base_model,
             model_type=model_type,
             convert_dest_directory=dest,
         )
-        model_raw = ApiDependencies.invoker.services.model_manager.list_model(
-            model_name, base_model=base_model, model_type=model_type
-        )
+        model_raw = await _wait_for_job(job)
         response = parse_obj_as(ConvertModelResponse, model_raw)
     except ModelNotFoundException as e:
         raise HTTPException(status_code=404, detail=f"Model '{model_name}' not found: {str(e)}")
@@ -335,6 +345,38 @@ async def sync_to_config() -> bool:
     return True
 
 
+@models_router.get(
+    "/convert_cache",
+    operation_id="list_convert_cache",
+    responses={
+        200: {"description": "The converted models were listed successfully"},
+    },
+    status_code=200,
+    response_model=List[ConvertCacheEntry],
+)
+async def list_convert_cache() -> List[ConvertCacheEntry]:
+    """List the models converted or mapped in models/.cache, most recently used first."""
+    return ApiDependencies.invoker.services.model_manager.list_convert_cache()
+
+
+@models_router.delete(
+    "/convert_cache",
+    operation_id="prune_convert_cache",
+    responses={
+        200: {"description": "The conversion cache was pruned successfully"},
+    },
+    status_code=200,
+    response_model=List[ConvertCacheEntry],
+)
+async def prune_convert_cache(
+    max_size: Optional[float] = Query(
+        default=None, ge=0, description="Size (GB) to prune the cache to. Defaults to the configured convert_cache_size"
+    ),
+) -> List[ConvertCacheEntry]:
+    """Delete the least recently used converted models until models/.cache fits in max_size GB, and return them."""
+    return ApiDependencies.invoker.services.model_manager.prune_convert_cache(max_size)
+
+
 @models_router.put(
     "/merge/{base_model}",
     operation_id="merge_models",
@@ -342,6 +384,7 @@ async def sync_to_config() -> bool:
         200: {"description": "Model converted successfully"},
         400: {"description": "Incompatible models"},
         404: {"description": "One or more models not found"},
+        409: {"description": "The job was cancelled"},
     },
     status_code=200,
     response_model=MergeModelResponse,
@@ -365,7 +408,7 @@ async def merge_models(
     try:
         logger.info(f"Merging models: {model_names} into {merge_dest_directory or '<MODELS>'}/{merged_model_name}")
         dest = pathlib.Path(merge_dest_directory) if merge_dest_directory else None
-        result = ApiDependencies.invoker.services.model_manager.merge_models(
+        job = ApiDependencies.invoker.services.model_jobs.submit_merge(
             model_names,
             base_model,
             merged_model_name=merged_model_name or "+".join(model_names),
@@ -374,14 +417,150 @@ async def merge_models(
             force=force,
             merge_dest_directory=dest,
         )
-        model_raw = ApiDependencies.invoker.services.model_manager.list_model(
-            result.name,
-            base_model=base_model,
-            model_type=ModelType.Main,
-        )
+        model_raw = await _wait_for_job(job)
         response = parse_obj_as(ConvertModelResponse, model_raw)
     except ModelNotFoundException:
         raise HTTPException(status_code=404, detail=f"One or more of the models '{model_names}' not found")
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     return response
+
+
+@models_router.post(
+    "/jobs/import",
+    operation_id="submit_import_model_job",
+    responses={
+        202: {"description": "The import was queued"},
+    },
+    status_code=202,
+    response_model=ModelJob,
+)
+async def submit_import_model_job(
+    location: str = Body(description="A model path, repo_id or URL to import"),
+    prediction_type: Optional[Literal["v_prediction", "epsilon", "sample"]] = Body(
+        description="Prediction type for SDv2 checkpoint files", default="v_prediction"
+    ),
+) -> ModelJob:
+    """Queue the import of a model using its local path, repo_id, or remote URL. Its progress is reported with model events"""
+    prediction_types = {x.value: x for x in SchedulerPredictionType}
+    return ApiDependencies.invoker.services.model_jobs.submit_install(
+        location, prediction_type=prediction_types.get(prediction_type)
+    )
+
+
+@models_router.post(
+    "/jobs/convert/{base_model}/{model_type}/{model_name}",
+    operation_id="submit_convert_model_job",
+    responses={
+        202: {"description": "The conversion was queued"},
+    },
+    status_code=202,
+    response_model=ModelJob,
+)
+async def submit_convert_model_job(
+    base_model: BaseModelType = Path(description="Base model"),
+    model_type: ModelType = Path(description="The type of model"),
+    model_name: str = Path(description="model name"),
+    convert_dest_directory: Optional[str] = Query(
+        default=None, description="Save the converted model to the designated directory"
+    ),
+) -> ModelJob:
+    """Queue the conversion of a checkpoint model into a diffusers model"""
+    dest = pathlib.Path(convert_dest_directory) if convert_dest_directory else None
+    return ApiDependencies.invoker.services.model_jobs.submit_convert(
+        model_name, base_model=base_model, model_type=model_type, convert_dest_directory=dest
+    )
+
+
+@models_router.post(
+    "/jobs/merge/{base_model}",
+    operation_id="submit_merge_models_job",
+    responses={
+        202: {"description": "The merge was queued"},
+    },
+    status_code=202,
+    response_model=ModelJob,
+)
+async def submit_merge_models_job(
+    base_model: BaseModelType = Path(description="Base model"),
+    model_names: List[str] = Body(description="model name", min_items=2, max_items=3),
+    merged_model_name: Optional[str] = Body(description="Name of destination model"),
+    alpha: Optional[float] = Body(description="Alpha weighting strength to apply to 2d and 3d models", default=0.5),
+    interp: Optional[MergeInterpolationMethod] = Body(description="Interpolation method"),
+    force: Optional[bool] = Body(
+        description="Force merging of models created with different versions of diffusers", default=False
+    ),
+    merge_dest_directory: Optional[str] = Body(
+        description="Save the merged model to the designated directory (with 'merged_model_name' appended)",
+        default=None,
+    ),
+) -> ModelJob:
+    """Queue the merge of two or three diffusers models"""
+    dest = pathlib.Path(merge_dest_directory) if merge_dest_directory else None
+    return ApiDependencies.invoker.services.model_jobs.submit_merge(
+        model_names,
+        base_model,
+        merged_model_name=merged_model_name or "+".join(model_names),
+        alpha=alpha,
+        interp=interp,
+        force=force,
+        merge_dest_directory=dest,
+    )
+
+
+@models_router.get(
+    "/jobs",
+    operation_id="list_model_jobs",
+    responses={
+        200: {"description": "The model jobs were listed successfully"},
+    },
+    status_code=200,
+    response_model=List[ModelJob],
+)
+async def list_model_jobs() -> List[ModelJob]:
+    """List the queued, running and recently finished model jobs, oldest first"""
+    return ApiDependencies.invoker.services.model_jobs.list_jobs()
+
+
+@models_router.get(
+    "/jobs/{job_id}",
+    operation_id="get_model_job",
+    responses={
+        200: {"description": "The model job was found"},
+        404: {"description": "The model job could not be found"},
+    },
+    status_code=200,
+    response_model=ModelJob,
+)
+async def get_model_job(
+    job_id: str = Path(description="The ID of the job"),
+) -> ModelJob:
+    """Get the status of a model job"""
+    job = ApiDependencies.invoker.services.model_jobs.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Model job {job_id} not found")
+    return job
+
+
+@models_router.delete(
+    "/jobs/{job_id}",
+    operation_id="cancel_model_job",
+    responses={
+        200: {"description": "The model job was cancelled"},
+        404: {"description": "The model job could not be found"},
+    },
+    status_code=200,
+    response_model=ModelJob,
+)
+async def cancel_model_job(
+    job_id: str = Path(description="The ID of the job"),
+) -> ModelJob:
+    """
+    Cancel a model job. Queued jobs and downloads of single files stop right away. A diffusers model downloaded
+    from a repo_id stops once its download completes, before it is saved; conversions and merges that have
+    started run to completion
+    """
+    job = ApiDependencies.invoker.services.model_jobs.cancel_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Model job {job_id} not found")
+    return job
@@ -17,6 +17,8 @@ class SocketIO:
         self.__sio.on("unsubscribe", handler=self._handle_unsub)
 
         local_handler.register(event_name=EventServiceBase.session_event, _func=self._handle_session_event)
+        local_handler.register(event_name=EventServiceBase.images_event, _func=self._handle_images_event)
+        local_handler.register(event_name=EventServiceBase.model_event, _func=self._handle_model_event)
 
     async def _handle_session_event(self, event: Event):
         await self.__sio.emit(
@@ -25,6 +27,20 @@ class SocketIO:
             room=event[1]["data"]["graph_execution_state_id"],
         )
 
+    async def _handle_images_event(self, event: Event):
+        # not tied to a session; every client shows the same gallery
+        await self.__sio.emit(
+            event=event[1]["event"],
+            data=event[1]["data"],
+        )
+
+    async def _handle_model_event(self, event: Event):
+        # model jobs aren't tied to a session either
+        await self.__sio.emit(
+            event=event[1]["event"],
+            data=event[1]["data"],
+        )
+
     async def _handle_sub(self, sid, data, *args, **kwargs):
         if "session" in data:
             self.__sio.enter_room(sid, data["session"])
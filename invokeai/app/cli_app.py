@@ -27,8 +27,13 @@ from invokeai.app.services.board_record_storage import SqliteBoardRecordStorage
 from invokeai.app.services.boards import BoardService, BoardServiceDependencies
 from invokeai.app.services.image_record_storage import SqliteImageRecordStorage
 from invokeai.app.services.images import ImageService, ImageServiceDependencies
+from invokeai.app.services.intermediate_image_storage import (
+    MemoryIntermediateImageStorage,
+    ScratchIntermediateImageStorage,
+)
 from invokeai.app.services.resource_name import SimpleNameService
 from invokeai.app.services.urls import LocalUrlService
+from invokeai.app.util.image_encoding import ImageEncoder
 from invokeai.app.services.invocation_stats import InvocationStatsService
 from .services.default_graphs import default_text_to_image_graph_id, create_system_graphs
 from .services.latent_storage import DiskLatentsStorage, ForwardCacheLatentsStorage
@@ -45,11 +50,13 @@ from .services.graph import (
     LibraryGraph,
     are_connection_types_compatible,
 )
+from .services.graph_execution_storage import SqliteGraphExecutionStateStorage
 from .services.image_file_storage import DiskImageFileStorage
 from .services.invocation_queue import MemoryInvocationQueue
 from .services.invocation_services import InvocationServices
 from .services.invoker import Invoker
 from .services.model_manager_service import ModelManagerService
+from .services.model_jobs import ModelJobService
 from .services.processor import DefaultInvocationProcessor
 from .services.sqlite import SqliteItemStorage
 
@@ -254,15 +261,28 @@ def invoke_cli():
 
     logger.info(f'InvokeAI database location is "{db_location}"')
 
-    graph_execution_manager = SqliteItemStorage[GraphExecutionState](
-        filename=db_location, table_name="graph_executions"
-    )
+    graph_execution_manager = SqliteGraphExecutionStateStorage(filename=db_location, table_name="graph_executions")
 
     urls = LocalUrlService()
     image_record_storage = SqliteImageRecordStorage(db_location)
-    image_file_storage = DiskImageFileStorage(f"{output_folder}/images")
+    image_file_storage = DiskImageFileStorage(
+        f"{output_folder}/images",
+        max_cache_bytes=int(config.image_cache_size * 2**30),
+        encoder=ImageEncoder(config.image_format, config.png_compress_level),
+        intermediate_encoder=ImageEncoder(
+            config.intermediate_format, config.png_compress_level, config.intermediate_quality
+        ),
+    )
     names = SimpleNameService()
 
+    intermediate_images = None
+    if config.intermediate_storage == "memory":
+        intermediate_images = MemoryIntermediateImageStorage(retention=config.intermediate_retention)
+    elif config.intermediate_storage == "scratch":
+        intermediate_images = ScratchIntermediateImageStorage(
+            f"{output_folder}/scratch", retention=config.intermediate_retention
+        )
+
     board_record_storage = SqliteBoardRecordStorage(db_location)
     board_image_record_storage = SqliteBoardImageRecordStorage(db_location)
 
@@ -295,11 +315,14 @@ def invoke_cli():
             logger=logger,
             names=names,
             graph_execution_manager=graph_execution_manager,
+            events=events,
+            intermediate_images=intermediate_images,
         )
     )
 
     services = InvocationServices(
         model_manager=model_manager,
+        model_jobs=ModelJobService(max_jobs=config.max_model_jobs),
         events=events,
         latents=ForwardCacheLatentsStorage(DiskLatentsStorage(f"{output_folder}/latents")),
         images=images,
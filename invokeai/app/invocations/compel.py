@@ -1,6 +1,9 @@
+import os
 import re
+import threading
+from collections import OrderedDict
 from dataclasses import dataclass
-from typing import List, Union
+from typing import Any, List, Optional, Tuple, Union
 
 import torch
 from compel import Compel, ReturnedEmbeddingsType
@@ -38,6 +41,91 @@ class ConditioningFieldData:
     # unconditioned: Optional[torch.Tensor]
 
 
+class PromptEmbeddingCache:
+    """
+    LRU cache of text encoder outputs, so that a prompt that is encoded
+    again with the same text encoder, LoRAs, embeddings and clip skip
+    doesn't load or run any model. Entries hold CPU tensors only, so
+    prompts with cross-attention control, whose arguments hold text
+    encoder outputs on the execution device, are not cached. The cache
+    is cleared whenever the model manager changes or uncaches a model.
+    """
+
+    def __init__(self):
+        self._entries: OrderedDict[tuple, Any] = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation: Optional[int] = None
+
+    def sync(self, generation: int):
+        """Clears the cache if the models have changed since it was last synced."""
+        with self._lock:
+            if generation != self._generation:
+                self._entries.clear()
+                self._generation = generation
+
+    def get(self, key: tuple) -> Optional[Any]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key: tuple, value: Any, max_size: int):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+prompt_embedding_cache = PromptEmbeddingCache()
+
+
+def _prompt_cache_key(context: InvocationContext, clip_field: ClipField, prompt: str, *extra) -> Tuple:
+    """Everything that determines the text encoder output for `prompt`."""
+    model_manager = context.services.model_manager
+    prompt_embedding_cache.sync(model_manager.models_generation())
+
+    def model_key(info) -> Tuple:
+        return (info.model_name, info.base_model, info.model_type, info.submodel)
+
+    def file_stamp(model_name: str, base_model, model_type: ModelType) -> Optional[Tuple]:
+        # LoRA and embedding files may be replaced in place, without the model manager knowing
+        info = model_manager.model_info(model_name, base_model, model_type)
+        try:
+            stat = os.stat(context.services.configuration.models_path / info["path"])
+        except (TypeError, KeyError, OSError):
+            return None
+        return (stat.st_size, stat.st_mtime_ns)
+
+    # only the embeddings that will actually be found change the result
+    base_model = clip_field.text_encoder.base_model
+    embeddings = sorted(
+        {
+            trigger[1:-1]
+            for trigger in re.findall(r"<[a-zA-Z0-9., _-]+>", prompt)
+            if model_manager.model_exists(trigger[1:-1], base_model, ModelType.TextualInversion)
+        }
+    )
+    loras = sorted(
+        (model_key(lora), lora.weight, file_stamp(lora.model_name, lora.base_model, lora.model_type))
+        for lora in clip_field.loras
+    )
+    return (
+        prompt,
+        model_key(clip_field.tokenizer),
+        model_key(clip_field.text_encoder),
+        tuple(loras),
+        tuple((name, file_stamp(name, base_model, ModelType.TextualInversion)) for name in embeddings),
+        clip_field.skipped_layers,
+        *extra,
+    )
+
+
 # class ConditioningAlgo(str, Enum):
 #    Compose = "compose"
 #    ComposeEx = "compose_ex"
@@ -61,6 +149,35 @@ class CompelInvocation(BaseInvocation):
 
     @torch.no_grad()
     def invoke(self, context: InvocationContext) -> ConditioningOutput:
+        cache_size = context.services.configuration.prompt_cache_size
+        cache_key = _prompt_cache_key(context, self.clip, self.prompt) if cache_size else None
+        cached = prompt_embedding_cache.get(cache_key) if cache_key else None
+        if cached is not None:
+            c, ec = cached
+        else:
+            c, ec = self._encode(context)
+            if cache_key and ec.cross_attention_control_args is None:
+                prompt_embedding_cache.put(cache_key, (c, ec), cache_size)
+
+        conditioning_data = ConditioningFieldData(
+            conditionings=[
+                BasicConditioningInfo(
+                    embeds=c,
+                    extra_conditioning=ec,
+                )
+            ]
+        )
+
+        conditioning_name = f"{context.graph_execution_state_id}_{self.id}_conditioning"
+        context.services.latents.save(conditioning_name, conditioning_data)
+
+        return ConditioningOutput(
+            conditioning=ConditioningField(
+                conditioning_name=conditioning_name,
+            ),
+        )
+
+    def _encode(self, context: InvocationContext):
         tokenizer_info = context.services.model_manager.get_model(
             **self.clip.tokenizer.dict(),
             context=context,
@@ -128,29 +245,36 @@ class CompelInvocation(BaseInvocation):
                 cross_attention_control_args=options.get("cross_attention_control", None),
             )
 
-        c = c.detach().to("cpu")
-
-        conditioning_data = ConditioningFieldData(
-            conditionings=[
-                BasicConditioningInfo(
-                    embeds=c,
-                    extra_conditioning=ec,
-                )
-            ]
-        )
+        return c.detach().to("cpu"), ec
 
-        conditioning_name = f"{context.graph_execution_state_id}_{self.id}_conditioning"
-        context.services.latents.save(conditioning_name, conditioning_data)
 
-        return ConditioningOutput(
-            conditioning=ConditioningField(
-                conditioning_name=conditioning_name,
-            ),
+class SDXLPromptInvocationBase:
+    def run_clip_compel(
+        self,
+        context: InvocationContext,
+        clip_field: ClipField,
+        prompt: str,
+        get_pooled: bool,
+        lora_prefix: str,
+        zero_on_empty: bool,
+    ):
+        cache_size = context.services.configuration.prompt_cache_size
+        cache_key = (
+            _prompt_cache_key(context, clip_field, prompt, get_pooled, lora_prefix, zero_on_empty)
+            if cache_size
+            else None
         )
+        cached = prompt_embedding_cache.get(cache_key) if cache_key else None
+        if cached is not None:
+            return cached
 
+        result = self._run_clip_compel(context, clip_field, prompt, get_pooled, lora_prefix, zero_on_empty)
+        ec = result[2]
+        if cache_key and (ec is None or ec.cross_attention_control_args is None):
+            prompt_embedding_cache.put(cache_key, result, cache_size)
+        return result
 
-class SDXLPromptInvocationBase:
-    def run_clip_compel(
+    def _run_clip_compel(
         self,
         context: InvocationContext,
         clip_field: ClipField,
@@ -7,7 +7,6 @@ import einops
 import numpy as np
 import torch
 import torchvision.transforms as T
-from diffusers.image_processor import VaeImageProcessor
 from diffusers.models.attention_processor import (
     AttnProcessor2_0,
     LoRAAttnProcessor2_0,
@@ -16,6 +15,7 @@ from diffusers.models.attention_processor import (
 )
 from diffusers.schedulers import DPMSolverSDEScheduler
 from diffusers.schedulers import SchedulerMixin as Scheduler
+from PIL import Image
 from pydantic import validator
 from torchvision.transforms.functional import resize as tv_resize
 
@@ -41,10 +41,12 @@ from ...backend.stable_diffusion.diffusers_pipeline import (
     ConditioningData,
     ControlNetData,
     StableDiffusionGeneratorPipeline,
+    TiledDenoiseSettings,
     image_resized_to_grid_as_tensor,
 )
 from ...backend.stable_diffusion.diffusion.shared_invokeai_diffusion import PostprocessingSettings
 from ...backend.stable_diffusion.schedulers import SCHEDULER_MAP
+from ...backend.stable_diffusion.vae_tiling import vae_decode, vae_encode
 from ...backend.util.devices import choose_precision, choose_torch_device
 from ..models.image import ImageCategory, ResourceOrigin
 from .baseinvocation import (
@@ -437,6 +439,10 @@ class DenoiseLatentsInvocation(BaseInvocation):
 
         return 1 - mask, masked_latents
 
+    def get_tiled_denoise(self) -> Optional[TiledDenoiseSettings]:
+        """Settings for denoising in latent windows, or None to denoise the whole latent at once"""
+        return None
+
     @torch.no_grad()
     def invoke(self, context: InvocationContext) -> LatentsOutput:
         with SilenceWarnings():  # this quenches NSFW nag from diffusers
@@ -536,6 +542,7 @@ class DenoiseLatentsInvocation(BaseInvocation):
                     conditioning_data=conditioning_data,
                     control_data=control_data,  # list[ControlNetData]
                     callback=step_callback,
+                    tiled_denoise=self.get_tiled_denoise(),
                 )
 
             # https://discuss.huggingface.co/t/memory-usage-by-later-pipeline-stages/23699
@@ -547,6 +554,34 @@ class DenoiseLatentsInvocation(BaseInvocation):
         return build_latents_output(latents_name=name, latents=result_latents, seed=seed)
 
 
+@invocation(
+    "tiled_denoise_latents",
+    title="Tiled Denoise Latents",
+    tags=["latents", "denoise", "tiled", "upscale", "multidiffusion", "img2img", "i2i", "l2l"],
+    category="latents",
+    version="1.0.0",
+)
+class TiledDenoiseLatentsInvocation(DenoiseLatentsInvocation):
+    """Denoises latents in overlapping tiles, blending the tiles' noise predictions at every step"""
+
+    tile_size: int = InputField(
+        default=1024, ge=64, multiple_of=8, description="Size of each square tile, in pixels (px)"
+    )
+    tile_overlap: int = InputField(
+        default=256, ge=0, multiple_of=8, description="Overlap between neighbouring tiles, in pixels (px)"
+    )
+    tile_batch_size: int = InputField(
+        default=2, ge=1, description="Number of tiles to denoise together in a single UNet evaluation"
+    )
+
+    def get_tiled_denoise(self) -> Optional[TiledDenoiseSettings]:
+        return TiledDenoiseSettings(
+            tile_size=self.tile_size // 8,
+            overlap=self.tile_overlap // 8,
+            batch_size=self.tile_batch_size,
+        )
+
+
 @invocation(
     "l2i", title="Latents to Image", tags=["latents", "image", "vae", "l2i"], category="latents", version="1.0.0"
 )
@@ -605,23 +640,18 @@ class LatentsToImageInvocation(BaseInvocation):
                 vae.to(dtype=torch.float16)
                 latents = latents.half()
 
-            if self.tiled or context.services.configuration.tiled_decode:
-                vae.enable_tiling()
-            else:
-                vae.disable_tiling()
-
-            # clear memory as vae decode can request a lot
-            torch.cuda.empty_cache()
+            configuration = context.services.configuration
+            tiled = self.tiled or configuration.force_tiled_decode or configuration.tiled_decode
+            if not tiled:
+                # clear memory as an untiled vae decode can request a lot
+                torch.cuda.empty_cache()
 
             with torch.inference_mode():
                 # copied from diffusers pipeline
                 latents = latents / vae.config.scaling_factor
-                image = vae.decode(latents, return_dict=False)[0]
-                image = (image / 2 + 0.5).clamp(0, 1)  # denormalize
-                # we always cast to float32 as this does not cause significant overhead and is compatible with bfloat16
-                np_image = image.cpu().permute(0, 2, 3, 1).float().numpy()
-
-                image = VaeImageProcessor.numpy_to_pil(np_image)[0]
+                # decoded straight to uint8, tile by tile when tiled
+                np_image = vae_decode(vae, latents, tiled=tiled)
+                image = Image.fromarray(np_image[0])
 
         torch.cuda.empty_cache()
 
@@ -771,16 +801,11 @@ class ImageToLatentsInvocation(BaseInvocation):
                 vae.to(dtype=torch.float16)
                 # latents = latents.half()
 
-            if tiled:
-                vae.enable_tiling()
-            else:
-                vae.disable_tiling()
-
             # non_noised_latents_from_image
             image_tensor = image_tensor.to(device=vae.device, dtype=vae.dtype)
             with torch.inference_mode():
-                image_tensor_dist = vae.encode(image_tensor).latent_dist
-                latents = image_tensor_dist.sample().to(dtype=vae.dtype)  # FIXME: uses torch.randn. make reproducible!
+                # FIXME: uses torch.randn. make reproducible!
+                latents = vae_encode(vae, image_tensor, tiled=tiled).to(dtype=vae.dtype)
 
             latents = vae.config.scaling_factor * latents
             latents = latents.to(dtype=orig_dtype)
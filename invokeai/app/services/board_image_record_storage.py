@@ -54,6 +54,18 @@ class BoardImageRecordStorageBase(ABC):
         """Gets the number of images for a board."""
         pass
 
+    @abstractmethod
+    def get_cover_images_and_counts(
+        self,
+        board_ids: Optional[list[str]] = None,
+    ) -> dict[str, tuple[Optional[str], int]]:
+        """
+        Gets the most recent image name and the number of images of many boards at once,
+        keyed by board id. All boards are included if `board_ids` is None. Boards without
+        images are omitted.
+        """
+        pass
+
 
 class SqliteBoardImageRecordStorage(BoardImageRecordStorageBase):
     _filename: str
@@ -267,3 +279,48 @@ class SqliteBoardImageRecordStorage(BoardImageRecordStorageBase):
             raise e
         finally:
             self._lock.release()
+
+    def get_cover_images_and_counts(
+        self,
+        board_ids: Optional[list[str]] = None,
+    ) -> dict[str, tuple[Optional[str], int]]:
+        if board_ids is not None and len(board_ids) == 0:
+            return {}
+
+        query_conditions = ""
+        query_params: list[str] = []
+        if board_ids is not None:
+            placeholders = ",".join("?" * len(board_ids))
+            query_conditions = f"WHERE board_images.board_id IN ( {placeholders} )"
+            query_params = board_ids
+
+        try:
+            self._lock.acquire()
+            # One pass over the boards' images: the count per board, and the newest image per board
+            self._cursor.execute(
+                f"""--sql
+                SELECT board_id, image_name, image_count
+                FROM (
+                    SELECT
+                        board_images.board_id,
+                        board_images.image_name,
+                        COUNT(*) OVER (PARTITION BY board_images.board_id) AS image_count,
+                        ROW_NUMBER() OVER (
+                            PARTITION BY board_images.board_id ORDER BY images.created_at DESC
+                        ) AS position
+                    FROM board_images
+                    JOIN images ON images.image_name = board_images.image_name
+                    {query_conditions}
+                )
+                WHERE position = 1;
+                """,
+                query_params,
+            )
+            result = cast(list[sqlite3.Row], self._cursor.fetchall())
+        except sqlite3.Error as e:
+            self._conn.rollback()
+            raise e
+        finally:
+            self._lock.release()
+
+        return {r["board_id"]: (r["image_name"], r["image_count"]) for r in result}
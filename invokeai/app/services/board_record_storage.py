@@ -4,7 +4,12 @@ from abc import ABC, abstractmethod
 from typing import Optional, Union, cast
 
 import sqlite3
-from invokeai.app.services.image_record_storage import OffsetPaginatedResults
+from invokeai.app.services.image_record_storage import (
+    CursorPaginatedResults,
+    OffsetPaginatedResults,
+    decode_cursor,
+    encode_cursor,
+)
 from invokeai.app.services.models.board_record import (
     BoardRecord,
     deserialize_board_record,
@@ -80,6 +85,15 @@ class BoardRecordStorageBase(ABC):
         """Gets many board records."""
         pass
 
+    @abstractmethod
+    def get_many_by_cursor(
+        self,
+        cursor: Optional[str] = None,
+        limit: int = 10,
+    ) -> CursorPaginatedResults[BoardRecord]:
+        """Gets the page of board records after `cursor`, or the first page if no cursor is given."""
+        pass
+
     @abstractmethod
     def get_all(
         self,
@@ -138,6 +152,13 @@ class SqliteBoardRecordStorage(BoardRecordStorageBase):
             """
         )
 
+        # Matches the board list sort order, for keyset pagination
+        self._cursor.execute(
+            """--sql
+            CREATE INDEX IF NOT EXISTS idx_boards_created_at_board_id ON boards (created_at DESC, board_id DESC);
+            """
+        )
+
         # Add trigger for `updated_at`.
         self._cursor.execute(
             """--sql
@@ -269,7 +290,7 @@ class SqliteBoardRecordStorage(BoardRecordStorageBase):
                 """--sql
                 SELECT *
                 FROM boards
-                ORDER BY created_at DESC
+                ORDER BY created_at DESC, board_id DESC
                 LIMIT ? OFFSET ?;
                 """,
                 (limit, offset),
@@ -297,6 +318,47 @@ class SqliteBoardRecordStorage(BoardRecordStorageBase):
         finally:
             self._lock.release()
 
+    def get_many_by_cursor(
+        self,
+        cursor: Optional[str] = None,
+        limit: int = 10,
+    ) -> CursorPaginatedResults[BoardRecord]:
+        # The cursor is the (created_at, board_id) sort key of the last board of the previous page
+        query_conditions = ""
+        query_params: list = []
+        if cursor is not None:
+            query_conditions = "WHERE (created_at, board_id) < (?, ?)"
+            query_params.extend(decode_cursor(cursor, 2))
+        # Fetch one extra row to know whether there is a next page
+        query_params.append(limit + 1)
+
+        try:
+            self._lock.acquire()
+            self._cursor.execute(
+                f"""--sql
+                SELECT *
+                FROM boards
+                {query_conditions}
+                ORDER BY created_at DESC, board_id DESC
+                LIMIT ?;
+                """,
+                query_params,
+            )
+            result = cast(list[sqlite3.Row], self._cursor.fetchall())
+        except sqlite3.Error as e:
+            self._conn.rollback()
+            raise e
+        finally:
+            self._lock.release()
+
+        next_cursor = None
+        if len(result) > limit:
+            result = result[:limit]
+            next_cursor = encode_cursor([result[-1]["created_at"], result[-1]["board_id"]])
+
+        boards = list(map(lambda r: deserialize_board_record(dict(r)), result))
+        return CursorPaginatedResults[BoardRecord](items=boards, limit=limit, next_cursor=next_cursor)
+
     def get_all(
         self,
     ) -> list[BoardRecord]:
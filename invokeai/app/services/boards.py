@@ -1,6 +1,7 @@
 from abc import ABC, abstractmethod
 
 from logging import Logger
+from typing import Optional
 from invokeai.app.services.board_image_record_storage import BoardImageRecordStorageBase
 from invokeai.app.services.board_images import board_record_to_dto
 
@@ -9,10 +10,11 @@ from invokeai.app.services.board_record_storage import (
     BoardRecordStorageBase,
 )
 from invokeai.app.services.image_record_storage import (
+    CursorPaginatedResults,
     ImageRecordStorageBase,
     OffsetPaginatedResults,
 )
-from invokeai.app.services.models.board_record import BoardDTO
+from invokeai.app.services.models.board_record import BoardDTO, BoardRecord
 from invokeai.app.services.urls import UrlServiceBase
 
 
@@ -61,6 +63,15 @@ class BoardServiceABC(ABC):
         """Gets many boards."""
         pass
 
+    @abstractmethod
+    def get_many_by_cursor(
+        self,
+        cursor: Optional[str] = None,
+        limit: int = 10,
+    ) -> CursorPaginatedResults[BoardDTO]:
+        """Gets the page of boards after `cursor`, or the first page if no cursor is given."""
+        pass
+
     @abstractmethod
     def get_all(
         self,
@@ -136,30 +147,25 @@ class BoardService(BoardServiceABC):
 
     def get_many(self, offset: int = 0, limit: int = 10) -> OffsetPaginatedResults[BoardDTO]:
         board_records = self._services.board_records.get_many(offset, limit)
-        board_dtos = []
-        for r in board_records.items:
-            cover_image = self._services.image_records.get_most_recent_image_for_board(r.board_id)
-            if cover_image:
-                cover_image_name = cover_image.image_name
-            else:
-                cover_image_name = None
-
-            image_count = self._services.board_image_records.get_image_count_for_board(r.board_id)
-            board_dtos.append(board_record_to_dto(r, cover_image_name, image_count))
-
+        board_dtos = self._to_dtos(board_records.items)
         return OffsetPaginatedResults[BoardDTO](items=board_dtos, offset=offset, limit=limit, total=len(board_dtos))
 
+    def get_many_by_cursor(self, cursor: Optional[str] = None, limit: int = 10) -> CursorPaginatedResults[BoardDTO]:
+        board_records = self._services.board_records.get_many_by_cursor(cursor, limit)
+        board_dtos = self._to_dtos(board_records.items)
+        return CursorPaginatedResults[BoardDTO](items=board_dtos, limit=limit, next_cursor=board_records.next_cursor)
+
     def get_all(self) -> list[BoardDTO]:
         board_records = self._services.board_records.get_all()
+        return self._to_dtos(board_records, all_boards=True)
+
+    def _to_dtos(self, board_records: list[BoardRecord], all_boards: bool = False) -> list[BoardDTO]:
+        """Builds the DTOs of many boards with a single query for their cover images and image counts."""
+        summaries = self._services.board_image_records.get_cover_images_and_counts(
+            None if all_boards else [r.board_id for r in board_records]
+        )
         board_dtos = []
         for r in board_records:
-            cover_image = self._services.image_records.get_most_recent_image_for_board(r.board_id)
-            if cover_image:
-                cover_image_name = cover_image.image_name
-            else:
-                cover_image_name = None
-
-            image_count = self._services.board_image_records.get_image_count_for_board(r.board_id)
+            cover_image_name, image_count = summaries.get(r.board_id, (None, 0))
             board_dtos.append(board_record_to_dto(r, cover_image_name, image_count))
-
         return board_dtos
@@ -19,6 +19,7 @@ InvokeAI:
     - '*'
     allow_headers:
     - '*'
+    max_model_jobs: 1
   Features:
     esrgan: true
     internet_available: true
@@ -36,6 +37,7 @@ InvokeAI:
     db_dir: databases
     outdir: /home/lstein/invokeai-main/outputs
     use_memory_db: false
+    spill_dir: null
   Logging:
     log_handlers:
     - console
@@ -45,6 +47,22 @@ InvokeAI:
     ram: 13.5
     vram: 0.25
     lazy_offload: true
+    storage_precision: same
+    sequential_offload: false
+    pinned_cache_size: 4.0
+    spill_cache_size: 0.0
+    prompt_cache_size: 256
+    image_cache_size: 0.5
+    convert_checkpoints: true
+    convert_cache_size: 10.0
+  Images:
+    image_format: png
+    png_compress_level: 6
+    intermediate_format: png
+    intermediate_quality: 90
+    intermediate_storage: disk
+    intermediate_retention: 60.0
+    thumbnail_cache_size: 0.0625
   Device:
     device: auto
     precision: auto
@@ -53,6 +71,14 @@ InvokeAI:
     attention_type: xformers
     attention_slice_size: auto
     force_tiled_decode: false
+    vae_tile_size: 0
+    vae_tile_overlap: 64
+    guidance_interval_start: 0.0
+    guidance_interval_end: 1.0
+    uncond_reuse_stride: 1
+    compile_mode: none
+    compile_max_graphs: 8
+    compile_warmup: []
 
 The default name of the configuration file is `invokeai.yaml`, located
 in INVOKEAI_ROOT. You can replace supersede this by providing any
@@ -207,6 +233,7 @@ class InvokeAIAppConfig(InvokeAISettings):
     allow_credentials   : bool = Field(default=True, description="Allow CORS credentials", category='Web Server')
     allow_methods       : List[str] = Field(default=["*"], description="Methods allowed for CORS", category='Web Server')
     allow_headers       : List[str] = Field(default=["*"], description="Headers allowed for CORS", category='Web Server')
+    max_model_jobs      : int = Field(default=1, ge=1, description="Maximum number of model installs, conversions and merges to run at once", category='Web Server')
 
     # FEATURES
     esrgan              : bool = Field(default=True, description="Enable/disable upscaling code", category='Features')
@@ -228,6 +255,7 @@ class InvokeAIAppConfig(InvokeAISettings):
     outdir              : Path = Field(default='outputs', description='Default folder for output images', category='Paths')
     use_memory_db       : bool = Field(default=False, description='Use in-memory database for storing image metadata', category='Paths')
     from_file           : Path = Field(default=None, description='Take command input from the indicated file (command-line client only)', category='Paths')
+    spill_dir           : Path = Field(default=None, description='Path to a directory on a fast local disk to spill models cleared from the RAM cache to. Defaults to models/.spill', category='Paths')
 
     # LOGGING
     log_handlers        : List[str] = Field(default=["console"], description='Log handler. Valid options are "console", "file=<path>", "syslog=path|address:host:port", "http=<url>"', category="Logging")
@@ -243,6 +271,23 @@ class InvokeAIAppConfig(InvokeAISettings):
     ram                 : Union[float, Literal["auto"]] = Field(default=6.0, gt=0, description="Maximum memory amount used by model cache for rapid switching (floating point number or 'auto')", category="Model Cache", )
     vram                : Union[float, Literal["auto"]] = Field(default=0.25, ge=0, description="Amount of VRAM reserved for model storage (floating point number or 'auto')", category="Model Cache", )
     lazy_offload        : bool = Field(default=True, description="Keep models in VRAM until their space is needed", category="Model Cache", )
+    storage_precision   : Literal["same", "int8", "fp8"] = Field(default="same", description="Precision of the weights of models moved off the GPU into the RAM cache. int8 and fp8 keep about twice as many fp16 models in the same space, at a small loss of precision; fp8 requires torch 2.1", category="Model Cache", )
+    sequential_offload  : bool = Field(default=False, description="Run models that don't fit in VRAM by streaming their layers onto the GPU as they are needed, keeping the most used layers in VRAM. CUDA only", category="Model Cache", )
+    pinned_cache_size   : float = Field(default=4.0, ge=0, description="Maximum memory (GB) of the RAM cache kept in pinned memory, so that models are copied to and from the GPU asynchronously and at full bus speed. 0 disables pinning. CUDA only", category="Model Cache", )
+    spill_cache_size    : float = Field(default=0.0, ge=0, description="Maximum disk space (GB) of the models cleared from the RAM cache and spilled to spill_dir, so that reloading them only reads their weights back. 0 disables spilling", category="Model Cache", )
+    prompt_cache_size   : int = Field(default=256, ge=0, description="Number of prompt embeddings to keep in memory so that repeated prompts skip the text encoder. 0 disables the cache", category="Model Cache", )
+    image_cache_size    : float = Field(default=0.5, ge=0, description="Maximum memory (GB) of decoded images kept in memory, so that images used by several nodes are only read and decoded once. 0 disables the cache", category="Model Cache", )
+    convert_checkpoints : bool = Field(default=True, description="Convert checkpoint models to diffusers folders in models/.cache on first use. If false, .safetensors checkpoints are loaded directly, and only a map of their weights is cached", category="Model Cache", )
+    convert_cache_size  : float = Field(default=10.0, ge=0, description="Maximum disk space (GB) used by models converted or mapped in models/.cache. The least recently used ones are deleted to stay under it", category="Model Cache", )
+
+    # IMAGES
+    image_format        : Literal["png", "webp"] = Field(default="png", description="Lossless format of saved images", category="Images", )
+    png_compress_level  : int = Field(default=6, ge=0, le=9, description="Compression level of saved PNG images (or encoder effort of lossless WEBP images), from 0 (fastest) to 9 (smallest)", category="Images", )
+    intermediate_format : Literal["png", "webp", "jpeg", "avif", "raw"] = Field(default="png", description='Format of intermediate images. "jpeg" and "avif" are lossy; "raw" is uncompressed PNG', category="Images", )
+    intermediate_quality: int = Field(default=90, ge=1, le=100, description="Quality of intermediate images saved in a lossy format", category="Images", )
+    intermediate_storage: Literal["disk", "memory", "scratch"] = Field(default="disk", description='Where intermediate images are kept during a session. "memory" and "scratch" (uncompressed files in outputs/scratch) skip the image record, file and thumbnail until the image is requested outside of the session', category="Images", )
+    intermediate_retention: float = Field(default=60.0, ge=0, description='Seconds to keep the unused intermediate images of a finished session, when intermediate_storage is "memory" or "scratch"', category="Images", )
+    thumbnail_cache_size: float = Field(default=0.0625, ge=0, description="Maximum memory (GB) of encoded thumbnails kept in memory by the web server, so that gallery pages are served without reading the files again. 0 disables the cache", category="Images", )
 
     # DEVICE
     device              : Literal[tuple(["auto", "cpu", "cuda", "cuda:1", "mps"])] = Field(default="auto", description="Generation device", category="Device", )
@@ -253,6 +298,14 @@ class InvokeAIAppConfig(InvokeAISettings):
     attention_type      : Literal[tuple(["auto", "normal", "xformers", "sliced", "torch-sdp"])] = Field(default="auto", description="Attention type", category="Generation", )
     attention_slice_size: Literal[tuple(["auto", "balanced", "max", 1, 2, 3, 4, 5, 6, 7, 8])] = Field(default="auto", description='Slice size, valid when attention_type=="sliced"', category="Generation", )
     force_tiled_decode: bool = Field(default=False, description="Whether to enable tiled VAE decode (reduces memory consumption with some performance penalty)", category="Generation",)
+    vae_tile_size       : int = Field(default=0, ge=0, description="Tile size in pixels for tiled VAE encode/decode. 0 picks the largest tile that fits in free memory", category="Generation", )
+    vae_tile_overlap    : int = Field(default=64, ge=0, description="Overlap in pixels between neighbouring tiles in tiled VAE encode/decode", category="Generation", )
+    guidance_interval_start: float = Field(default=0.0, ge=0, le=1, description="Fraction of the denoising steps at which classifier-free guidance starts. Before it only the conditioned UNet branch is evaluated", category="Generation", )
+    guidance_interval_end: float = Field(default=1.0, ge=0, le=1, description="Fraction of the denoising steps at which classifier-free guidance stops. After it only the conditioned UNet branch is evaluated", category="Generation", )
+    uncond_reuse_stride : int = Field(default=1, ge=1, description="Evaluate the unconditioned UNet branch only every N guided steps, reusing its last prediction in between", category="Generation", )
+    compile_mode        : Literal["none", "compile", "trace"] = Field(default="none", description='Run the UNet, VAE decoder and ControlNets through graphs specialised per input shape. "compile" uses torch.compile, "trace" uses torch.jit.trace', category="Generation", )
+    compile_max_graphs  : int = Field(default=8, ge=1, description="Maximum number of compiled graphs kept per model", category="Generation", )
+    compile_warmup      : List[str] = Field(default=[], description='Graphs to build at startup when compile_mode is enabled, as "<base model>/<model name>:<width>x<height>", e.g. "sd-1/stable-diffusion-v1-5:512x512"', category="Generation", )
 
     # DEPRECATED FIELDS - STILL HERE IN ORDER TO OBTAN VALUES FROM PRE-3.1 CONFIG FILES
     always_use_cpu      : bool = Field(default=False, description="If true, use the CPU for rendering even if a GPU is available.", category='Memory/Performance')
@@ -379,6 +432,13 @@ class InvokeAIAppConfig(InvokeAISettings):
         """
         return self._resolve(self.autoconvert_dir) if self.autoconvert_dir else None
 
+    @property
+    def spill_path(self) -> Path:
+        """
+        Path to the directory that models cleared from the RAM cache are spilled to.
+        """
+        return self._resolve(self.spill_dir) if self.spill_dir else self.models_path / ".spill"
+
     # the following methods support legacy calls leftover from the Globals era
     @property
     def full_precision(self) -> bool:
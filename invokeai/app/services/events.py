@@ -13,6 +13,8 @@ from invokeai.app.services.model_manager_service import (
 
 class EventServiceBase:
     session_event: str = "session_event"
+    images_event: str = "images_event"
+    model_event: str = "model_event"
 
     """Basic event bus, to have an empty stand-in when not needed"""
 
@@ -26,6 +28,20 @@ class EventServiceBase:
             payload=dict(event=event_name, data=payload),
         )
 
+    def __emit_images_event(self, event_name: str, payload: dict) -> None:
+        payload["timestamp"] = get_timestamp()
+        self.dispatch(
+            event_name=EventServiceBase.images_event,
+            payload=dict(event=event_name, data=payload),
+        )
+
+    def __emit_model_event(self, event_name: str, payload: dict) -> None:
+        payload["timestamp"] = get_timestamp()
+        self.dispatch(
+            event_name=EventServiceBase.model_event,
+            payload=dict(event=event_name, data=payload),
+        )
+
     # Define events here for every event in the system.
     # This will make them easier to integrate until we find a schema generator.
     def emit_generator_progress(
@@ -187,3 +203,39 @@ class EventServiceBase:
                 error=error,
             ),
         )
+
+    def emit_image_deletion_progress(
+        self,
+        operation: str,
+        deleted: int,
+        total: int,
+    ) -> None:
+        """Emitted while the files of a bulk image deletion are being removed"""
+        self.__emit_images_event(
+            event_name="image_deletion_progress",
+            payload=dict(
+                operation=operation,
+                deleted=deleted,
+                total=total,
+            ),
+        )
+
+    def emit_model_job_started(self, job: dict) -> None:
+        """Emitted when a model install, conversion or merge job starts running"""
+        self.__emit_model_event(event_name="model_job_started", payload=dict(job=job))
+
+    def emit_model_job_progress(self, job: dict) -> None:
+        """Emitted while a model job downloads its files"""
+        self.__emit_model_event(event_name="model_job_progress", payload=dict(job=job))
+
+    def emit_model_job_completed(self, job: dict) -> None:
+        """Emitted when a model job has completed"""
+        self.__emit_model_event(event_name="model_job_completed", payload=dict(job=job))
+
+    def emit_model_job_error(self, job: dict) -> None:
+        """Emitted when a model job has failed"""
+        self.__emit_model_event(event_name="model_job_error", payload=dict(job=job))
+
+    def emit_model_job_cancelled(self, job: dict) -> None:
+        """Emitted when a model job has been cancelled"""
+        self.__emit_model_event(event_name="model_job_cancelled", payload=dict(job=job))
@@ -0,0 +1,269 @@
+import hashlib
+import json
+from collections import OrderedDict
+from typing import Optional
+
+from .graph import GraphExecutionState
+from .item_storage import PaginatedResults
+from .sqlite import SqliteItemStorage
+
+# The parts of a session that are stored in their own rows, instead of in the session's row
+HEAD_EXCLUDE = {
+    "execution_graph": {"nodes": True},
+    "results": True,
+    "errors": True,
+    "executed": True,
+    "executed_history": True,
+}
+
+# Number of sessions for which the hashes of the stored parts are kept in memory
+PERSISTED_CACHE_SIZE = 16
+
+
+def _hash(value: str) -> bytes:
+    return hashlib.sha1(value.encode()).digest()
+
+
+class SqliteGraphExecutionStateStorage(SqliteItemStorage[GraphExecutionState]):
+    """
+    Stores graph execution states, writing only what changed since the last write.
+
+    The session's row holds the source graph, the execution graph's edges and the node mappings. Each
+    execution node, result, error, executed node id and history entry is a row of `{table_name}_parts`.
+    `set()` compares the session with the hashes of what is already stored and only writes the parts that
+    changed, so completing a node writes that node's result and its state transitions rather than the
+    whole session. Sessions are materialized in full on read.
+
+    Sessions stored whole by earlier versions are read as-is, and split the next time they are written.
+    """
+
+    _parts_table_name: str
+    _persisted: OrderedDict[str, dict[tuple[str, str], bytes]]
+
+    def __init__(self, filename: str, table_name: str = "graph_executions"):
+        self._parts_table_name = f"{table_name}_parts"
+        self._persisted = OrderedDict()
+        super().__init__(filename, table_name, "id")
+
+    def _create_table(self):
+        super()._create_table()
+        try:
+            self._lock.acquire()
+            self._cursor.execute(
+                f"""--sql
+                CREATE TABLE IF NOT EXISTS {self._parts_table_name} (
+                    session_id TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    PRIMARY KEY (session_id, kind, key)
+                );
+                """
+            )
+            self._conn.commit()
+        finally:
+            self._lock.release()
+
+    def _parse_item(self, item: str) -> GraphExecutionState:
+        return GraphExecutionState.parse_raw(item)
+
+    def set(self, item: GraphExecutionState):
+        head = item.json(exclude=HEAD_EXCLUDE)
+        try:
+            self._lock.acquire()
+            persisted = self._get_persisted(item.id)
+            hashes: dict[tuple[str, str], bytes] = dict()
+            changes: list[tuple[str, str, str, str]] = []
+
+            def add(kind: str, key: str, value: str) -> None:
+                value_hash = _hash(value)
+                hashes[(kind, key)] = value_hash
+                if persisted.get((kind, key)) != value_hash:
+                    changes.append((item.id, kind, key, value))
+
+            def keep(kind: str, key: str) -> None:
+                hashes[(kind, key)] = persisted[(kind, key)]
+
+            for node_id, node in item.execution_graph.nodes.items():
+                # a node's inputs are set when it is prepared; once stored as executed, it can't change
+                if ("executed", node_id) in persisted and ("node", node_id) in persisted:
+                    keep("node", node_id)
+                else:
+                    add("node", node_id, node.json())
+            for node_id, output in item.results.items():
+                # results are never modified once set
+                if ("result", node_id) in persisted:
+                    keep("result", node_id)
+                else:
+                    add("result", node_id, output.json())
+            for node_id, error in item.errors.items():
+                add("error", node_id, error)
+            for node_id in item.executed:
+                add("executed", node_id, "")
+            for index, node_id in enumerate(item.executed_history):
+                add("history", str(index), node_id)
+
+            removed = [
+                (item.id, kind, key) for (kind, key) in persisted if kind != "head" and (kind, key) not in hashes
+            ]
+
+            head_hash = _hash(head)
+            hashes[("head", "")] = head_hash
+            if persisted.get(("head", "")) != head_hash:
+                self._cursor.execute(f"""INSERT OR REPLACE INTO {self._table_name} (item) VALUES (?);""", (head,))
+            if changes:
+                self._cursor.executemany(
+                    f"""--sql
+                    INSERT OR REPLACE INTO {self._parts_table_name} (session_id, kind, key, value)
+                    VALUES (?, ?, ?, ?);
+                    """,
+                    changes,
+                )
+            if removed:
+                self._cursor.executemany(
+                    f"""DELETE FROM {self._parts_table_name} WHERE session_id = ? AND kind = ? AND key = ?;""",
+                    removed,
+                )
+            self._conn.commit()
+            self._set_persisted(item.id, hashes)
+        except Exception:
+            self._conn.rollback()
+            # the stored state is unknown; read it back on the next write
+            self._persisted.pop(item.id, None)
+            raise
+        finally:
+            self._lock.release()
+        self._on_changed(item)
+
+    def get(self, id: str) -> Optional[GraphExecutionState]:
+        raw = self.get_raw(id)
+        if raw is None:
+            return None
+        return self._parse_item(raw)
+
+    def get_raw(self, id: str) -> Optional[str]:
+        try:
+            self._lock.acquire()
+            materialized = self._materialize(str(id))
+        finally:
+            self._lock.release()
+
+        if materialized is None:
+            return None
+        return json.dumps(materialized)
+
+    def delete(self, id: str):
+        try:
+            self._lock.acquire()
+            self._cursor.execute(f"""DELETE FROM {self._table_name} WHERE id = ?;""", (str(id),))
+            self._cursor.execute(f"""DELETE FROM {self._parts_table_name} WHERE session_id = ?;""", (str(id),))
+            self._conn.commit()
+            self._persisted.pop(str(id), None)
+        finally:
+            self._lock.release()
+        self._on_deleted(id)
+
+    def list(self, page: int = 0, per_page: int = 10) -> PaginatedResults[GraphExecutionState]:
+        try:
+            self._lock.acquire()
+            self._cursor.execute(
+                f"""SELECT id FROM {self._table_name} LIMIT ? OFFSET ?;""",
+                (per_page, page * per_page),
+            )
+            ids = [r[0] for r in self._cursor.fetchall()]
+            items = [GraphExecutionState.parse_obj(self._materialize(id)) for id in ids]
+
+            self._cursor.execute(f"""SELECT count(*) FROM {self._table_name};""")
+            count = self._cursor.fetchone()[0]
+        finally:
+            self._lock.release()
+
+        pageCount = int(count / per_page) + 1
+
+        return PaginatedResults[GraphExecutionState](
+            items=items, page=page, pages=pageCount, per_page=per_page, total=count
+        )
+
+    def search(self, query: str, page: int = 0, per_page: int = 10) -> PaginatedResults[GraphExecutionState]:
+        condition = f"""--sql
+            item LIKE ? OR id IN (SELECT session_id FROM {self._parts_table_name} WHERE value LIKE ?)
+        """
+        try:
+            self._lock.acquire()
+            self._cursor.execute(
+                f"""SELECT id FROM {self._table_name} WHERE {condition} LIMIT ? OFFSET ?;""",
+                (f"%{query}%", f"%{query}%", per_page, page * per_page),
+            )
+            ids = [r[0] for r in self._cursor.fetchall()]
+            items = [GraphExecutionState.parse_obj(self._materialize(id)) for id in ids]
+
+            self._cursor.execute(
+                f"""SELECT count(*) FROM {self._table_name} WHERE {condition};""",
+                (f"%{query}%", f"%{query}%"),
+            )
+            count = self._cursor.fetchone()[0]
+        finally:
+            self._lock.release()
+
+        pageCount = int(count / per_page) + 1
+
+        return PaginatedResults[GraphExecutionState](
+            items=items, page=page, pages=pageCount, per_page=per_page, total=count
+        )
+
+    def _materialize(self, id: str) -> Optional[dict]:
+        """Assembles a session from its row and its parts. Must be called with the lock held."""
+        self._cursor.execute(f"""SELECT item FROM {self._table_name} WHERE id = ?;""", (id,))
+        result = self._cursor.fetchone()
+        if not result:
+            return None
+        session = json.loads(result[0])
+
+        self._cursor.execute(
+            f"""SELECT kind, key, value FROM {self._parts_table_name} WHERE session_id = ?;""",
+            (id,),
+        )
+        nodes = session["execution_graph"].setdefault("nodes", {})
+        results = session.setdefault("results", {})
+        errors = session.setdefault("errors", {})
+        executed = session.setdefault("executed", [])
+        history = []
+        for kind, key, value in self._cursor.fetchall():
+            if kind == "node":
+                nodes[key] = json.loads(value)
+            elif kind == "result":
+                results[key] = json.loads(value)
+            elif kind == "error":
+                errors[key] = value
+            elif kind == "executed":
+                executed.append(key)
+            elif kind == "history":
+                history.append((int(key), value))
+        session.setdefault("executed_history", []).extend(node_id for _, node_id in sorted(history))
+        return session
+
+    def _get_persisted(self, id: str) -> dict[tuple[str, str], bytes]:
+        """Gets the hashes of the stored parts of a session. Must be called with the lock held."""
+        persisted = self._persisted.get(id)
+        if persisted is not None:
+            self._persisted.move_to_end(id)
+            return persisted
+
+        persisted = dict()
+        self._cursor.execute(f"""SELECT item FROM {self._table_name} WHERE id = ?;""", (id,))
+        result = self._cursor.fetchone()
+        if result:
+            persisted[("head", "")] = _hash(result[0])
+            self._cursor.execute(
+                f"""SELECT kind, key, value FROM {self._parts_table_name} WHERE session_id = ?;""",
+                (id,),
+            )
+            for kind, key, value in self._cursor.fetchall():
+                persisted[(kind, key)] = _hash(value)
+        return persisted
+
+    def _set_persisted(self, id: str, hashes: dict[tuple[str, str], bytes]) -> None:
+        self._persisted[id] = hashes
+        self._persisted.move_to_end(id)
+        while len(self._persisted) > PERSISTED_CACHE_SIZE:
+            self._persisted.popitem(last=False)
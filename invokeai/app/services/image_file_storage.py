@@ -1,14 +1,17 @@
 # Copyright (c) 2022 Kyle Schouviller (https://github.com/kyle0654) and the InvokeAI Team
 import json
+import threading
 from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
-from queue import Queue
-from typing import Dict, Optional, Union
+from typing import Callable, Optional, Union
 
-from PIL import Image, PngImagePlugin
+from PIL import Image
 from PIL.Image import Image as PILImageType
 from send2trash import send2trash
 
+from invokeai.app.util.image_encoding import ImageEncoder, get_embedded_metadata
 from invokeai.app.util.thumbnails import get_thumbnail_name, make_thumbnail
 
 
@@ -54,6 +57,11 @@ class ImageFileStorageBase(ABC):
         """Validates the path given for an image or thumbnail."""
         pass
 
+    @abstractmethod
+    def get_extension(self, image: PILImageType, is_intermediate: bool = False) -> str:
+        """Gets the file extension an image will be saved with, which determines its format."""
+        pass
+
     @abstractmethod
     def save(
         self,
@@ -62,8 +70,9 @@ class ImageFileStorageBase(ABC):
         metadata: Optional[dict] = None,
         workflow: Optional[str] = None,
         thumbnail_size: int = 256,
+        is_intermediate: bool = False,
     ) -> None:
-        """Saves an image and a 256x256 WEBP thumbnail. Returns a tuple of the image name, thumbnail name, and created timestamp."""
+        """Saves an image, in the format given by its extension, and a 256x256 WEBP thumbnail."""
         pass
 
     @abstractmethod
@@ -71,19 +80,57 @@ class ImageFileStorageBase(ABC):
         """Deletes an image and its thumbnail (if one exists)."""
         pass
 
+    @abstractmethod
+    def delete_many(
+        self,
+        image_names: list[str],
+        on_progress: Optional[Callable[[int, int], None]] = None,
+    ) -> list[str]:
+        """
+        Deletes many images and their thumbnails, returning the names of the images that
+        could not be deleted. `on_progress(done, total)` is called as deletions complete.
+        """
+        pass
+
+
+def get_decoded_size(image: PILImageType) -> int:
+    """Gets the number of bytes a decoded image occupies in memory."""
+    if image.mode in ("I", "F"):
+        bytes_per_band = 4
+    elif image.mode.startswith("I;16"):
+        bytes_per_band = 2
+    else:
+        bytes_per_band = 1
+    return image.width * image.height * len(image.getbands()) * bytes_per_band
+
 
 class DiskImageFileStorage(ImageFileStorageBase):
     """Stores images on disk"""
 
     __output_folder: Path
-    __cache_ids: Queue  # TODO: this is an incredibly naive cache
-    __cache: Dict[Path, PILImageType]
-    __max_cache_size: int
-
-    def __init__(self, output_folder: Union[str, Path]):
-        self.__cache = dict()
-        self.__cache_ids = Queue()
-        self.__max_cache_size = 10  # TODO: get this from config
+    __cache: OrderedDict[Path, PILImageType]  # decoded images, least recently used first
+    __cache_size: int
+    __max_cache_bytes: int
+    __cache_lock: threading.Lock
+    __delete_workers: int
+    __encoder: ImageEncoder
+    __intermediate_encoder: ImageEncoder
+
+    def __init__(
+        self,
+        output_folder: Union[str, Path],
+        max_cache_bytes: int = 512 * 2**20,
+        delete_workers: int = 8,
+        encoder: Optional[ImageEncoder] = None,
+        intermediate_encoder: Optional[ImageEncoder] = None,
+    ):
+        self.__delete_workers = delete_workers
+        self.__encoder = encoder or ImageEncoder()
+        self.__intermediate_encoder = intermediate_encoder or self.__encoder
+        self.__cache = OrderedDict()
+        self.__cache_size = 0
+        self.__max_cache_bytes = max_cache_bytes
+        self.__cache_lock = threading.Lock()
 
         self.__output_folder: Path = output_folder if isinstance(output_folder, Path) else Path(output_folder)
         self.__thumbnails_folder = self.__output_folder / "thumbnails"
@@ -96,15 +143,28 @@ class DiskImageFileStorage(ImageFileStorageBase):
             image_path = self.get_path(image_name)
 
             cache_item = self.__get_cache(image_path)
-            if cache_item:
-                return cache_item
+            if cache_item is not None:
+                return cache_item.copy()
 
             image = Image.open(image_path)
+            # decode now, so the file is closed and every later get() is a copy rather than a decode
+            image.load()
+            if image.format != "PNG":
+                # expose the metadata the way PNG text chunks are exposed
+                metadata, workflow = get_embedded_metadata(image)
+                if metadata is not None:
+                    image.info["invokeai_metadata"] = metadata
+                if workflow is not None:
+                    image.info["invokeai_workflow"] = workflow
             self.__set_cache(image_path, image)
-            return image
+            return image.copy()
         except FileNotFoundError as e:
             raise ImageFileNotFoundException from e
 
+    def get_extension(self, image: PILImageType, is_intermediate: bool = False) -> str:
+        encoder = self.__intermediate_encoder if is_intermediate else self.__encoder
+        return encoder.get_extension(image)
+
     def save(
         self,
         image: PILImageType,
@@ -112,37 +172,29 @@ class DiskImageFileStorage(ImageFileStorageBase):
         metadata: Optional[dict] = None,
         workflow: Optional[str] = None,
         thumbnail_size: int = 256,
+        is_intermediate: bool = False,
     ) -> None:
         try:
             self.__validate_storage_folders()
             image_path = self.get_path(image_name)
 
-            pnginfo = PngImagePlugin.PngInfo()
-
             if metadata is not None or workflow is not None:
-                if metadata is not None:
-                    pnginfo.add_text("invokeai_metadata", json.dumps(metadata))
-                if workflow is not None:
-                    pnginfo.add_text("invokeai_workflow", workflow)
+                serialized_metadata = json.dumps(metadata) if metadata is not None else None
             else:
                 # For uploaded images, we want to retain metadata. PIL strips it on save; manually add it back
                 # TODO: retain non-invokeai metadata on save...
-                original_metadata = image.info.get("invokeai_metadata", None)
-                if original_metadata is not None:
-                    pnginfo.add_text("invokeai_metadata", original_metadata)
-                original_workflow = image.info.get("invokeai_workflow", None)
-                if original_workflow is not None:
-                    pnginfo.add_text("invokeai_workflow", original_workflow)
+                serialized_metadata, workflow = get_embedded_metadata(image)
 
-            image.save(image_path, "PNG", pnginfo=pnginfo)
+            encoder = self.__intermediate_encoder if is_intermediate else self.__encoder
+            encoder.save(image, image_path, serialized_metadata, workflow)
 
             thumbnail_name = get_thumbnail_name(image_name)
             thumbnail_path = self.get_path(thumbnail_name, thumbnail=True)
             thumbnail_image = make_thumbnail(image, thumbnail_size)
             thumbnail_image.save(thumbnail_path)
 
-            self.__set_cache(image_path, image)
-            self.__set_cache(thumbnail_path, thumbnail_image)
+            # the caller keeps its image; cache a copy so later changes to it don't leak into the cache
+            self.__set_cache(image_path, image.copy())
         except Exception as e:
             raise ImageFileSaveException from e
 
@@ -152,19 +204,41 @@ class DiskImageFileStorage(ImageFileStorageBase):
 
             if image_path.exists():
                 send2trash(image_path)
-            if image_path in self.__cache:
-                del self.__cache[image_path]
+            self.__del_cache(image_path)
 
             thumbnail_name = get_thumbnail_name(image_name)
             thumbnail_path = self.get_path(thumbnail_name, True)
 
             if thumbnail_path.exists():
                 send2trash(thumbnail_path)
-            if thumbnail_path in self.__cache:
-                del self.__cache[thumbnail_path]
         except Exception as e:
             raise ImageFileDeleteException from e
 
+    def delete_many(
+        self,
+        image_names: list[str],
+        on_progress: Optional[Callable[[int, int], None]] = None,
+    ) -> list[str]:
+        # Drop cache entries up front, on this thread; only the file removal runs in the pool
+        for image_name in image_names:
+            self.__del_cache(self.get_path(image_name))
+
+        def delete_files(image_name: str) -> None:
+            for path in (self.get_path(image_name), self.get_path(image_name, True)):
+                if path.exists():
+                    send2trash(path)
+
+        failed: list[str] = []
+        total = len(image_names)
+        with ThreadPoolExecutor(max_workers=self.__delete_workers, thread_name_prefix="image_delete") as executor:
+            futures = {executor.submit(delete_files, image_name): image_name for image_name in image_names}
+            for done, future in enumerate(as_completed(futures), start=1):
+                if future.exception() is not None:
+                    failed.append(futures[future])
+                if on_progress is not None:
+                    on_progress(done, total)
+        return failed
+
     # TODO: make this a bit more flexible for e.g. cloud storage
     def get_path(self, image_name: str, thumbnail: bool = False) -> Path:
         path = self.__output_folder / image_name
@@ -186,14 +260,29 @@ class DiskImageFileStorage(ImageFileStorageBase):
         for folder in folders:
             folder.mkdir(parents=True, exist_ok=True)
 
-    def __get_cache(self, image_name: Path) -> Optional[PILImageType]:
-        return None if image_name not in self.__cache else self.__cache[image_name]
-
-    def __set_cache(self, image_name: Path, image: PILImageType):
-        if image_name not in self.__cache:
-            self.__cache[image_name] = image
-            self.__cache_ids.put(image_name)  # TODO: this should refresh position for LRU cache
-            if len(self.__cache) > self.__max_cache_size:
-                cache_id = self.__cache_ids.get()
-                if cache_id in self.__cache:
-                    del self.__cache[cache_id]
+    def __get_cache(self, image_path: Path) -> Optional[PILImageType]:
+        with self.__cache_lock:
+            image = self.__cache.get(image_path)
+            if image is not None:
+                self.__cache.move_to_end(image_path)
+            return image
+
+    def __set_cache(self, image_path: Path, image: PILImageType):
+        size = get_decoded_size(image)
+        if size > self.__max_cache_bytes:
+            return
+        with self.__cache_lock:
+            previous = self.__cache.pop(image_path, None)
+            if previous is not None:
+                self.__cache_size -= get_decoded_size(previous)
+            self.__cache[image_path] = image
+            self.__cache_size += size
+            while self.__cache_size > self.__max_cache_bytes:
+                _, evicted = self.__cache.popitem(last=False)
+                self.__cache_size -= get_decoded_size(evicted)
+
+    def __del_cache(self, image_path: Path):
+        with self.__cache_lock:
+            image = self.__cache.pop(image_path, None)
+            if image is not None:
+                self.__cache_size -= get_decoded_size(image)
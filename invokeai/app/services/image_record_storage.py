@@ -1,9 +1,11 @@
+import base64
 import json
 import sqlite3
 import threading
 from abc import ABC, abstractmethod
 from datetime import datetime
-from typing import Generic, Optional, TypeVar, cast
+from enum import Enum
+from typing import Any, Generic, Iterator, Optional, TypeVar, cast
 
 from pydantic import BaseModel, Field
 from pydantic.generics import GenericModel
@@ -12,6 +14,7 @@ from invokeai.app.models.image import ImageCategory, ResourceOrigin
 from invokeai.app.services.models.image_record import (
     ImageRecord,
     ImageRecordChanges,
+    ImageRecordWithBoard,
     deserialize_image_record,
 )
 
@@ -29,6 +32,45 @@ class OffsetPaginatedResults(GenericModel, Generic[T]):
     # fmt: on
 
 
+class CursorPaginatedResults(GenericModel, Generic[T]):
+    """Cursor-paginated results"""
+
+    # fmt: off
+    items: list[T] = Field(description="Items")
+    limit: int = Field(description="Limit of items to get")
+    next_cursor: Optional[str] = Field(default=None, description="Cursor of the next page, if there is one")
+    # fmt: on
+
+
+class InvalidCursorException(ValueError):
+    """Raised when a pagination cursor cannot be decoded."""
+
+    def __init__(self, message="Invalid pagination cursor"):
+        super().__init__(message)
+
+
+def encode_cursor(values: list[Any]) -> str:
+    """Encodes the sort key of the last item of a page into an opaque cursor."""
+    return base64.urlsafe_b64encode(json.dumps(values).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str, length: int) -> list[Any]:
+    """Decodes a cursor made by `encode_cursor()` holding `length` values."""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except (ValueError, UnicodeError) as e:
+        raise InvalidCursorException() from e
+    if not isinstance(values, list) or len(values) != length:
+        raise InvalidCursorException()
+    # only values that sqlite can bind
+    for value in values:
+        if not (value is None or isinstance(value, (str, int, float))):
+            raise InvalidCursorException()
+        if isinstance(value, int) and not -(2**63) <= value < 2**63:
+            raise InvalidCursorException()
+    return values
+
+
 # TODO: Should these excpetions subclass existing python exceptions?
 class ImageRecordNotFoundException(Exception):
     """Raised when an image record is not found."""
@@ -51,6 +93,17 @@ class ImageRecordDeleteException(Exception):
         super().__init__(message)
 
 
+# Upper bound on the number of `?` placeholders per statement for bulk operations.
+# Older SQLite builds are compiled with a limit of 999 host parameters.
+BULK_BATCH_SIZE = 900
+
+
+def batched(items: list[str], size: int = BULK_BATCH_SIZE) -> Iterator[list[str]]:
+    """Yields consecutive slices of `items` of at most `size` elements."""
+    for start in range(0, len(items), size):
+        yield items[start : start + size]
+
+
 IMAGE_DTO_COLS = ", ".join(
     list(
         map(
@@ -74,6 +127,35 @@ IMAGE_DTO_COLS = ", ".join(
 )
 
 
+def get_metadata_search_columns(metadata: Optional[dict]) -> dict[str, str]:
+    """Extracts the searchable text of an image's `CoreMetadata`, one string per search index column."""
+    metadata = metadata if isinstance(metadata, dict) else {}
+
+    def text(*keys: str) -> str:
+        return " ".join(str(metadata[k]) for k in keys if metadata.get(k) is not None)
+
+    def model_name(value: Any) -> Optional[str]:
+        return value.get("model_name") if isinstance(value, dict) else None
+
+    models = [model_name(metadata.get("model")), model_name(metadata.get("refiner_model"))]
+    models.append(model_name(metadata.get("vae")))
+    models.extend(model_name(lora.get("lora")) for lora in metadata.get("loras") or [] if isinstance(lora, dict))
+
+    return dict(
+        prompts=text("positive_prompt", "positive_style_prompt"),
+        negative_prompts=text("negative_prompt", "negative_style_prompt"),
+        models=" ".join(m for m in models if m),
+        seed=text("seed"),
+        settings=text("generation_mode", "scheduler", "refiner_scheduler"),
+    )
+
+
+def to_fts_query(query: str) -> str:
+    """Turns free text into an FTS5 query matching every term, as a prefix."""
+    terms = [t.replace('"', '""') for t in query.split()]
+    return " ".join(f'"{t}"*' for t in terms)
+
+
 class ImageRecordStorageBase(ABC):
     """Low-level service responsible for interfacing with the image record store."""
 
@@ -98,6 +180,15 @@ class ImageRecordStorageBase(ABC):
         """Updates an image record."""
         pass
 
+    @abstractmethod
+    def update_many(
+        self,
+        image_names: list[str],
+        changes: ImageRecordChanges,
+    ) -> list[str]:
+        """Applies the same changes to many image records in one transaction. Returns the names updated."""
+        pass
+
     @abstractmethod
     def get_many(
         self,
@@ -107,20 +198,49 @@ class ImageRecordStorageBase(ABC):
         categories: Optional[list[ImageCategory]] = None,
         is_intermediate: Optional[bool] = None,
         board_id: Optional[str] = None,
-    ) -> OffsetPaginatedResults[ImageRecord]:
-        """Gets a page of image records."""
+    ) -> OffsetPaginatedResults[ImageRecordWithBoard]:
+        """Gets a page of image records, with the board each image belongs to."""
+        pass
+
+    @abstractmethod
+    def get_many_by_cursor(
+        self,
+        cursor: Optional[str] = None,
+        limit: int = 10,
+        image_origin: Optional[ResourceOrigin] = None,
+        categories: Optional[list[ImageCategory]] = None,
+        is_intermediate: Optional[bool] = None,
+        board_id: Optional[str] = None,
+    ) -> CursorPaginatedResults[ImageRecordWithBoard]:
+        """Gets the page of image records after `cursor`, or the first page if no cursor is given."""
         pass
 
     # TODO: The database has a nullable `deleted_at` column, currently unused.
     # Should we implement soft deletes? Would need coordination with ImageFileStorage.
+    @abstractmethod
+    def search(
+        self,
+        query: str,
+        offset: int = 0,
+        limit: int = 10,
+        is_intermediate: Optional[bool] = None,
+    ) -> OffsetPaginatedResults[ImageRecordWithBoard]:
+        """Gets a page of the image records whose prompts, models, seed or settings match `query`, best first."""
+        pass
+
+    @abstractmethod
+    def backfill_search_index(self) -> int:
+        """Adds the image records missing from the search index to it. Returns the number of records indexed."""
+        pass
+
     @abstractmethod
     def delete(self, image_name: str) -> None:
         """Deletes an image record."""
         pass
 
     @abstractmethod
-    def delete_many(self, image_names: list[str]) -> None:
-        """Deletes many image records."""
+    def delete_many(self, image_names: list[str]) -> list[str]:
+        """Deletes many image records in one transaction. Returns the names deleted."""
         pass
 
     @abstractmethod
@@ -156,10 +276,12 @@ class SqliteImageRecordStorage(ImageRecordStorageBase):
     _conn: sqlite3.Connection
     _cursor: sqlite3.Cursor
     _lock: threading.Lock
+    _fts_enabled: bool
 
     def __init__(self, filename: str) -> None:
         super().__init__()
         self._filename = filename
+        self._fts_enabled = False
         self._conn = sqlite3.connect(filename, check_same_thread=False)
         # Enable row factory to get rows as dictionaries (must be done before making the cursor!)
         self._conn.row_factory = sqlite3.Row
@@ -240,6 +362,16 @@ class SqliteImageRecordStorage(ImageRecordStorageBase):
             """
         )
 
+        # Matches the gallery sort order, for keyset pagination
+        self._cursor.execute(
+            """--sql
+            CREATE INDEX IF NOT EXISTS idx_images_starred_created_at_image_name
+            ON images(starred DESC, created_at DESC, image_name DESC);
+            """
+        )
+
+        self._create_search_index()
+
         # Add trigger for `updated_at`.
         self._cursor.execute(
             """--sql
@@ -253,6 +385,81 @@ class SqliteImageRecordStorage(ImageRecordStorageBase):
             """
         )
 
+    def _create_search_index(self) -> None:
+        """
+        Creates the `images_fts` full-text index. Its rows are keyed by `image_search_keys`, which gives each
+        image a stable integer id: the rowids of `images`, whose primary key is its name, may change on VACUUM.
+        """
+        self._cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'image_search_keys';")
+        if self._cursor.fetchone() is None:
+            # an index keyed by the rowid of `images`; it is rebuilt by backfill_search_index()
+            self._cursor.execute("DROP TRIGGER IF EXISTS tg_images_fts_delete;")
+            self._cursor.execute("DROP TABLE IF EXISTS images_fts;")
+
+        try:
+            self._cursor.execute(
+                """--sql
+                CREATE VIRTUAL TABLE IF NOT EXISTS images_fts USING fts5(
+                    prompts,
+                    negative_prompts,
+                    models,
+                    seed,
+                    settings,
+                    tokenize = 'unicode61'
+                );
+                """
+            )
+        except sqlite3.OperationalError:
+            # SQLite built without FTS5; search falls back to scanning the metadata
+            return
+
+        self._cursor.execute(
+            """--sql
+            CREATE TABLE IF NOT EXISTS image_search_keys (
+                id INTEGER PRIMARY KEY,
+                image_name TEXT NOT NULL UNIQUE
+            );
+            """
+        )
+
+        self._cursor.execute(
+            """--sql
+            CREATE TRIGGER IF NOT EXISTS tg_images_search_delete
+            AFTER DELETE
+            ON images FOR EACH ROW
+            BEGIN
+                DELETE FROM images_fts
+                WHERE rowid = (SELECT id FROM image_search_keys WHERE image_name = old.image_name);
+                DELETE FROM image_search_keys WHERE image_name = old.image_name;
+            END;
+            """
+        )
+        self._fts_enabled = True
+
+    def _index_metadata(self, image_name: str, metadata: Optional[dict]) -> None:
+        """Adds or replaces the search index row of an image. Must be called with the lock held."""
+        if not self._fts_enabled:
+            return
+        columns = get_metadata_search_columns(metadata)
+        self._cursor.execute("INSERT OR IGNORE INTO image_search_keys (image_name) VALUES (?);", (image_name,))
+        self._cursor.execute("SELECT id FROM image_search_keys WHERE image_name = ?;", (image_name,))
+        search_id = self._cursor.fetchone()[0]
+        self._cursor.execute("DELETE FROM images_fts WHERE rowid = ?;", (search_id,))
+        self._cursor.execute(
+            """--sql
+            INSERT INTO images_fts (rowid, prompts, negative_prompts, models, seed, settings)
+            VALUES (?, ?, ?, ?, ?, ?);
+            """,
+            (
+                search_id,
+                columns["prompts"],
+                columns["negative_prompts"],
+                columns["models"],
+                columns["seed"],
+                columns["settings"],
+            ),
+        )
+
     def get(self, image_name: str) -> Optional[ImageRecord]:
         try:
             self._lock.acquire()
@@ -357,6 +564,98 @@ class SqliteImageRecordStorage(ImageRecordStorageBase):
         finally:
             self._lock.release()
 
+    def update_many(
+        self,
+        image_names: list[str],
+        changes: ImageRecordChanges,
+    ) -> list[str]:
+        # Column names come from the ImageRecordChanges fields, never from user input
+        values = changes.dict(exclude_none=True)
+        if len(values) == 0 or len(image_names) == 0:
+            return []
+        set_clause = ", ".join(f"{column} = ?" for column in values)
+        set_params = [v.value if isinstance(v, Enum) else v for v in values.values()]
+
+        updated: list[str] = []
+        try:
+            self._lock.acquire()
+            for batch in batched(image_names):
+                placeholders = ",".join("?" * len(batch))
+                self._cursor.execute(
+                    f"""--sql
+                    SELECT image_name FROM images
+                    WHERE image_name IN ( {placeholders} );
+                    """,
+                    batch,
+                )
+                updated.extend(r[0] for r in self._cursor.fetchall())
+                self._cursor.execute(
+                    f"""--sql
+                    UPDATE images
+                    SET {set_clause}
+                    WHERE image_name IN ( {placeholders} );
+                    """,
+                    set_params + batch,
+                )
+            self._conn.commit()
+        except sqlite3.Error as e:
+            self._conn.rollback()
+            raise ImageRecordSaveException from e
+        finally:
+            self._lock.release()
+        return updated
+
+    def _build_filter_conditions(
+        self,
+        image_origin: Optional[ResourceOrigin],
+        categories: Optional[list[ImageCategory]],
+        is_intermediate: Optional[bool],
+        board_id: Optional[str],
+    ) -> tuple[str, list[Any]]:
+        """Builds the `AND ...` conditions and parameters shared by the image listing queries."""
+        query_conditions = ""
+        query_params = []
+
+        if image_origin is not None:
+            query_conditions += """--sql
+            AND images.image_origin = ?
+            """
+            query_params.append(image_origin.value)
+
+        if categories is not None:
+            # Convert the enum values to unique list of strings
+            category_strings = list(map(lambda c: c.value, set(categories)))
+            # Create the correct length of placeholders
+            placeholders = ",".join("?" * len(category_strings))
+
+            query_conditions += f"""--sql
+            AND images.image_category IN ( {placeholders} )
+            """
+
+            # Unpack the included categories into the query params
+            for c in category_strings:
+                query_params.append(c)
+
+        if is_intermediate is not None:
+            query_conditions += """--sql
+            AND images.is_intermediate = ?
+            """
+
+            query_params.append(is_intermediate)
+
+        # board_id of "none" is reserved for images without a board
+        if board_id == "none":
+            query_conditions += """--sql
+            AND board_images.board_id IS NULL
+            """
+        elif board_id is not None:
+            query_conditions += """--sql
+            AND board_images.board_id = ?
+            """
+            query_params.append(board_id)
+
+        return query_conditions, query_params
+
     def get_many(
         self,
         offset: Optional[int] = None,
@@ -365,11 +664,12 @@ class SqliteImageRecordStorage(ImageRecordStorageBase):
         categories: Optional[list[ImageCategory]] = None,
         is_intermediate: Optional[bool] = None,
         board_id: Optional[str] = None,
-    ) -> OffsetPaginatedResults[ImageRecord]:
+    ) -> OffsetPaginatedResults[ImageRecordWithBoard]:
         try:
             self._lock.acquire()
 
-            # Manually build two queries - one for the count, one for the records
+            # The total is computed by a window function over the same filtered join, so a
+            # page is a single query. The separate count query only runs for empty pages.
             count_query = """--sql
             SELECT COUNT(*)
             FROM images
@@ -378,55 +678,18 @@ class SqliteImageRecordStorage(ImageRecordStorageBase):
             """
 
             images_query = f"""--sql
-            SELECT {IMAGE_DTO_COLS}
+            SELECT {IMAGE_DTO_COLS}, board_images.board_id, COUNT(*) OVER () AS total_count
             FROM images
             LEFT JOIN board_images ON board_images.image_name = images.image_name
             WHERE 1=1
             """
 
-            query_conditions = ""
-            query_params = []
-
-            if image_origin is not None:
-                query_conditions += """--sql
-                AND images.image_origin = ?
-                """
-                query_params.append(image_origin.value)
-
-            if categories is not None:
-                # Convert the enum values to unique list of strings
-                category_strings = list(map(lambda c: c.value, set(categories)))
-                # Create the correct length of placeholders
-                placeholders = ",".join("?" * len(category_strings))
-
-                query_conditions += f"""--sql
-                AND images.image_category IN ( {placeholders} )
-                """
-
-                # Unpack the included categories into the query params
-                for c in category_strings:
-                    query_params.append(c)
-
-            if is_intermediate is not None:
-                query_conditions += """--sql
-                AND images.is_intermediate = ?
-                """
-
-                query_params.append(is_intermediate)
-
-            # board_id of "none" is reserved for images without a board
-            if board_id == "none":
-                query_conditions += """--sql
-                AND board_images.board_id IS NULL
-                """
-            elif board_id is not None:
-                query_conditions += """--sql
-                AND board_images.board_id = ?
-                """
-                query_params.append(board_id)
+            query_conditions, query_params = self._build_filter_conditions(
+                image_origin, categories, is_intermediate, board_id
+            )
 
             query_pagination = """--sql
-            ORDER BY images.starred DESC, images.created_at DESC LIMIT ? OFFSET ?
+            ORDER BY images.starred DESC, images.created_at DESC, images.image_name DESC LIMIT ? OFFSET ?
             """
 
             # Final images query with pagination
@@ -442,21 +705,183 @@ class SqliteImageRecordStorage(ImageRecordStorageBase):
             # Build the list of images, deserializing each row
             self._cursor.execute(images_query, images_params)
             result = cast(list[sqlite3.Row], self._cursor.fetchall())
-            images = list(map(lambda r: deserialize_image_record(dict(r)), result))
+            images = list(
+                map(
+                    lambda r: ImageRecordWithBoard(**deserialize_image_record(dict(r)).dict(), board_id=r["board_id"]),
+                    result,
+                )
+            )
+
+            if len(result) > 0:
+                count = cast(int, result[0]["total_count"])
+            elif not offset:
+                count = 0
+            else:
+                # Paged past the end; set up and execute the count query, without pagination
+                count_query += query_conditions + ";"
+                count_params = query_params.copy()
+                self._cursor.execute(count_query, count_params)
+                count = cast(int, self._cursor.fetchone()[0])
+        except sqlite3.Error as e:
+            self._conn.rollback()
+            raise e
+        finally:
+            self._lock.release()
+
+        return OffsetPaginatedResults(items=images, offset=offset, limit=limit, total=count)
+
+    def get_many_by_cursor(
+        self,
+        cursor: Optional[str] = None,
+        limit: int = 10,
+        image_origin: Optional[ResourceOrigin] = None,
+        categories: Optional[list[ImageCategory]] = None,
+        is_intermediate: Optional[bool] = None,
+        board_id: Optional[str] = None,
+    ) -> CursorPaginatedResults[ImageRecordWithBoard]:
+        # The cursor is the (starred, created_at, image_name) sort key of the last image of the
+        # previous page. Seeking past it on the matching index costs the same at any depth.
+        query_conditions, query_params = self._build_filter_conditions(
+            image_origin, categories, is_intermediate, board_id
+        )
+        if cursor is not None:
+            query_conditions += """--sql
+            AND (images.starred, images.created_at, images.image_name) < (?, ?, ?)
+            """
+            query_params.extend(decode_cursor(cursor, 3))
+
+        images_query = f"""--sql
+        SELECT {IMAGE_DTO_COLS}, board_images.board_id
+        FROM images
+        LEFT JOIN board_images ON board_images.image_name = images.image_name
+        WHERE 1=1
+        {query_conditions}
+        ORDER BY images.starred DESC, images.created_at DESC, images.image_name DESC
+        LIMIT ?;
+        """
+        # Fetch one extra row to know whether there is a next page
+        query_params.append(limit + 1)
+
+        try:
+            self._lock.acquire()
+            self._cursor.execute(images_query, query_params)
+            result = cast(list[sqlite3.Row], self._cursor.fetchall())
+        except sqlite3.Error as e:
+            self._conn.rollback()
+            raise e
+        finally:
+            self._lock.release()
+
+        next_cursor = None
+        if len(result) > limit:
+            result = result[:limit]
+            last = result[-1]
+            next_cursor = encode_cursor([last["starred"], last["created_at"], last["image_name"]])
 
-            # Set up and execute the count query, without pagination
-            count_query += query_conditions + ";"
-            count_params = query_params.copy()
-            self._cursor.execute(count_query, count_params)
-            count = cast(int, self._cursor.fetchone()[0])
+        images = list(
+            map(
+                lambda r: ImageRecordWithBoard(**deserialize_image_record(dict(r)).dict(), board_id=r["board_id"]),
+                result,
+            )
+        )
+        return CursorPaginatedResults(items=images, limit=limit, next_cursor=next_cursor)
+
+    def search(
+        self,
+        query: str,
+        offset: int = 0,
+        limit: int = 10,
+        is_intermediate: Optional[bool] = None,
+    ) -> OffsetPaginatedResults[ImageRecordWithBoard]:
+        query_conditions = ""
+        query_params: list[Any] = []
+        if is_intermediate is not None:
+            query_conditions = "AND images.is_intermediate = ?"
+            query_params.append(is_intermediate)
+
+        if self._fts_enabled:
+            fts_query = to_fts_query(query)
+            if not fts_query:
+                return OffsetPaginatedResults(items=[], offset=offset, limit=limit, total=0)
+            images_query = f"""--sql
+            SELECT {IMAGE_DTO_COLS}, board_images.board_id, COUNT(*) OVER () AS total_count
+            FROM images_fts
+            JOIN image_search_keys ON image_search_keys.id = images_fts.rowid
+            JOIN images ON images.image_name = image_search_keys.image_name
+            LEFT JOIN board_images ON board_images.image_name = images.image_name
+            WHERE images_fts MATCH ? {query_conditions}
+            ORDER BY images_fts.rank, images.created_at DESC
+            LIMIT ? OFFSET ?;
+            """
+            query_params.insert(0, fts_query)
+        else:
+            images_query = f"""--sql
+            SELECT {IMAGE_DTO_COLS}, board_images.board_id, COUNT(*) OVER () AS total_count
+            FROM images
+            LEFT JOIN board_images ON board_images.image_name = images.image_name
+            WHERE images.metadata LIKE ? {query_conditions}
+            ORDER BY images.created_at DESC
+            LIMIT ? OFFSET ?;
+            """
+            query_params.insert(0, f"%{query}%")
+        query_params.extend([limit, offset])
+
+        try:
+            self._lock.acquire()
+            self._cursor.execute(images_query, query_params)
+            result = cast(list[sqlite3.Row], self._cursor.fetchall())
         except sqlite3.Error as e:
             self._conn.rollback()
             raise e
         finally:
             self._lock.release()
 
+        images = list(
+            map(
+                lambda r: ImageRecordWithBoard(**deserialize_image_record(dict(r)).dict(), board_id=r["board_id"]),
+                result,
+            )
+        )
+        # An empty page past the end reports a total of 0
+        count = cast(int, result[0]["total_count"]) if len(result) > 0 else 0
         return OffsetPaginatedResults(items=images, offset=offset, limit=limit, total=count)
 
+    def backfill_search_index(self, batch_size: int = 500) -> int:
+        if not self._fts_enabled:
+            return 0
+
+        indexed = 0
+        while True:
+            # Take the lock per batch, so that a large backfill doesn't stall image saves
+            try:
+                self._lock.acquire()
+                self._cursor.execute(
+                    """--sql
+                    SELECT images.image_name, images.metadata FROM images
+                    LEFT JOIN image_search_keys ON image_search_keys.image_name = images.image_name
+                    WHERE image_search_keys.id IS NULL
+                    LIMIT ?;
+                    """,
+                    (batch_size,),
+                )
+                result = cast(list[sqlite3.Row], self._cursor.fetchall())
+                for row in result:
+                    try:
+                        metadata = json.loads(row["metadata"]) if row["metadata"] else None
+                    except json.JSONDecodeError:
+                        metadata = None
+                    self._index_metadata(row["image_name"], metadata)
+                self._conn.commit()
+            except sqlite3.Error as e:
+                self._conn.rollback()
+                raise e
+            finally:
+                self._lock.release()
+
+            indexed += len(result)
+            if len(result) < batch_size:
+                return indexed
+
     def delete(self, image_name: str) -> None:
         try:
             self._lock.acquire()
@@ -474,17 +899,18 @@ class SqliteImageRecordStorage(ImageRecordStorageBase):
         finally:
             self._lock.release()
 
-    def delete_many(self, image_names: list[str]) -> None:
+    def delete_many(self, image_names: list[str]) -> list[str]:
+        deleted: list[str] = []
         try:
-            placeholders = ",".join("?" for _ in image_names)
-
             self._lock.acquire()
 
-            # Construct the SQLite query with the placeholders
-            query = f"DELETE FROM images WHERE image_name IN ({placeholders})"
-
-            # Execute the query with the list of IDs as parameters
-            self._cursor.execute(query, image_names)
+            # One transaction, split into statements that stay under the placeholder limit
+            for batch in batched(image_names):
+                placeholders = ",".join("?" for _ in batch)
+                self._cursor.execute(f"SELECT image_name FROM images WHERE image_name IN ({placeholders})", batch)
+                deleted.extend(r[0] for r in self._cursor.fetchall())
+                query = f"DELETE FROM images WHERE image_name IN ({placeholders})"
+                self._cursor.execute(query, batch)
 
             self._conn.commit()
         except sqlite3.Error as e:
@@ -492,6 +918,7 @@ class SqliteImageRecordStorage(ImageRecordStorageBase):
             raise ImageRecordDeleteException from e
         finally:
             self._lock.release()
+        return deleted
 
     def delete_intermediates(self) -> list[str]:
         try:
@@ -563,7 +990,7 @@ class SqliteImageRecordStorage(ImageRecordStorageBase):
                     starred,
                 ),
             )
-            self._conn.commit()
+            inserted = self._cursor.rowcount == 1
 
             self._cursor.execute(
                 """--sql
@@ -573,8 +1000,12 @@ class SqliteImageRecordStorage(ImageRecordStorageBase):
                 """,
                 (image_name,),
             )
+            row = self._cursor.fetchone()
+            if inserted:
+                self._index_metadata(image_name, metadata)
+            self._conn.commit()
 
-            created_at = datetime.fromisoformat(self._cursor.fetchone()[0])
+            created_at = datetime.fromisoformat(row[0])
 
             return created_at
         except sqlite3.Error as e:
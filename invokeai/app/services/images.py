@@ -1,4 +1,7 @@
+import threading
+import time
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 from logging import Logger
 from typing import TYPE_CHECKING, Optional
 
@@ -19,12 +22,14 @@ from invokeai.app.services.image_file_storage import (
     ImageFileStorageBase,
 )
 from invokeai.app.services.image_record_storage import (
+    CursorPaginatedResults,
     ImageRecordDeleteException,
     ImageRecordNotFoundException,
     ImageRecordSaveException,
     ImageRecordStorageBase,
     OffsetPaginatedResults,
 )
+from invokeai.app.services.intermediate_image_storage import IntermediateImage, IntermediateImageStorageBase
 from invokeai.app.services.item_storage import ItemStorageABC
 from invokeai.app.services.models.image_record import (
     ImageDTO,
@@ -35,8 +40,10 @@ from invokeai.app.services.models.image_record import (
 from invokeai.app.services.resource_name import NameServiceBase
 from invokeai.app.services.urls import UrlServiceBase
 from invokeai.app.util.metadata import get_metadata_graph_from_raw_session
+from invokeai.app.util.misc import get_iso_timestamp
 
 if TYPE_CHECKING:
+    from invokeai.app.services.events import EventServiceBase
     from invokeai.app.services.graph import GraphExecutionState
 
 
@@ -68,6 +75,15 @@ class ImageServiceABC(ABC):
         """Updates an image."""
         pass
 
+    @abstractmethod
+    def update_many(
+        self,
+        image_names: list[str],
+        changes: ImageRecordChanges,
+    ) -> list[str]:
+        """Updates many images in one transaction, returning the names of the images updated."""
+        pass
+
     @abstractmethod
     def get_pil_image(self, image_name: str) -> PILImageType:
         """Gets an image as a PIL image."""
@@ -116,11 +132,40 @@ class ImageServiceABC(ABC):
         """Gets a paginated list of image DTOs."""
         pass
 
+    @abstractmethod
+    def get_many_by_cursor(
+        self,
+        cursor: Optional[str] = None,
+        limit: int = 10,
+        image_origin: Optional[ResourceOrigin] = None,
+        categories: Optional[list[ImageCategory]] = None,
+        is_intermediate: Optional[bool] = None,
+        board_id: Optional[str] = None,
+    ) -> CursorPaginatedResults[ImageDTO]:
+        """Gets the page of image DTOs after `cursor`, or the first page if no cursor is given."""
+        pass
+
+    @abstractmethod
+    def search(
+        self,
+        query: str,
+        offset: int = 0,
+        limit: int = 10,
+        is_intermediate: Optional[bool] = None,
+    ) -> OffsetPaginatedResults[ImageDTO]:
+        """Gets a page of image DTOs whose prompts, models or settings match `query`."""
+        pass
+
     @abstractmethod
     def delete(self, image_name: str):
         """Deletes an image."""
         pass
 
+    @abstractmethod
+    def delete_many(self, image_names: list[str]) -> list[str]:
+        """Deletes many images, returning the names of those that existed. Files are removed in the background."""
+        pass
+
     @abstractmethod
     def delete_intermediates(self) -> int:
         """Deletes all intermediate images."""
@@ -131,6 +176,11 @@ class ImageServiceABC(ABC):
         """Deletes all images on a board."""
         pass
 
+    @abstractmethod
+    def release_intermediates(self, session_id: str) -> None:
+        """Releases the intermediate images of a finished session that were never used outside of it."""
+        pass
+
 
 class ImageServiceDependencies:
     """Service dependencies for the ImageService."""
@@ -142,6 +192,8 @@ class ImageServiceDependencies:
     logger: Logger
     names: NameServiceBase
     graph_execution_manager: ItemStorageABC["GraphExecutionState"]
+    events: Optional["EventServiceBase"]
+    intermediate_images: Optional[IntermediateImageStorageBase]
 
     def __init__(
         self,
@@ -152,6 +204,8 @@ class ImageServiceDependencies:
         logger: Logger,
         names: NameServiceBase,
         graph_execution_manager: ItemStorageABC["GraphExecutionState"],
+        events: Optional["EventServiceBase"] = None,
+        intermediate_images: Optional[IntermediateImageStorageBase] = None,
     ):
         self.image_records = image_record_storage
         self.image_files = image_file_storage
@@ -160,13 +214,24 @@ class ImageServiceDependencies:
         self.logger = logger
         self.names = names
         self.graph_execution_manager = graph_execution_manager
+        self.events = events
+        self.intermediate_images = intermediate_images
+
+
+# Minimum interval between two deletion progress events, in seconds
+DELETION_PROGRESS_INTERVAL = 0.5
 
 
 class ImageService(ImageServiceABC):
     _services: ImageServiceDependencies
+    _file_cleanup: ThreadPoolExecutor
+    _promotion_lock: threading.Lock
 
     def __init__(self, services: ImageServiceDependencies):
         self._services = services
+        # Bulk file deletions run here, one operation at a time, off the request and session threads
+        self._file_cleanup = ThreadPoolExecutor(max_workers=1, thread_name_prefix="image_file_cleanup")
+        self._promotion_lock = threading.Lock()
 
     def create(
         self,
@@ -186,7 +251,9 @@ class ImageService(ImageServiceABC):
         if image_category not in ImageCategory:
             raise InvalidImageCategoryException
 
-        image_name = self._services.names.create_image_name()
+        image_name = self._services.names.create_image_name(
+            self._services.image_files.get_extension(image, is_intermediate)
+        )
 
         # TODO: Do we want to store the graph in the image at all? I don't think so...
         # graph = None
@@ -201,6 +268,50 @@ class ImageService(ImageServiceABC):
 
         (width, height) = image.size
 
+        if is_intermediate and board_id is None and self._services.intermediate_images is not None:
+            # Only other nodes of the session are likely to use this image; it is saved if it's needed elsewhere
+            entry = IntermediateImage(
+                image_name=image_name,
+                image_origin=image_origin,
+                image_category=image_category,
+                width=width,
+                height=height,
+                session_id=session_id,
+                node_id=node_id,
+                metadata=metadata,
+                workflow=workflow,
+            )
+            self._services.intermediate_images.save(entry, image)
+            return self._get_intermediate_dto(entry)
+
+        return self._save(
+            image=image,
+            image_name=image_name,
+            image_origin=image_origin,
+            image_category=image_category,
+            node_id=node_id,
+            session_id=session_id,
+            board_id=board_id,
+            is_intermediate=is_intermediate,
+            metadata=metadata,
+            workflow=workflow,
+        )
+
+    def _save(
+        self,
+        image: PILImageType,
+        image_name: str,
+        image_origin: ResourceOrigin,
+        image_category: ImageCategory,
+        node_id: Optional[str],
+        session_id: Optional[str],
+        board_id: Optional[str],
+        is_intermediate: bool,
+        metadata: Optional[dict],
+        workflow: Optional[str],
+    ) -> ImageDTO:
+        (width, height) = image.size
+
         try:
             # TODO: Consider using a transaction here to ensure consistency between storage and database
             self._services.image_records.save(
@@ -219,8 +330,14 @@ class ImageService(ImageServiceABC):
             )
             if board_id is not None:
                 self._services.board_image_records.add_image_to_board(board_id=board_id, image_name=image_name)
-            self._services.image_files.save(image_name=image_name, image=image, metadata=metadata, workflow=workflow)
-            image_dto = self.get_dto(image_name)
+            self._services.image_files.save(
+                image_name=image_name,
+                image=image,
+                metadata=metadata,
+                workflow=workflow,
+                is_intermediate=is_intermediate,
+            )
+            image_dto = self._get_dto(image_name)
 
             return image_dto
         except ImageRecordSaveException:
@@ -233,12 +350,66 @@ class ImageService(ImageServiceABC):
             self._services.logger.error(f"Problem saving image record and file: {str(e)}")
             raise e
 
+    def _get_intermediate_dto(self, entry: IntermediateImage) -> ImageDTO:
+        now = get_iso_timestamp()
+        image_record = ImageRecord(
+            image_name=entry.image_name,
+            image_origin=entry.image_origin,
+            image_category=entry.image_category,
+            width=entry.width,
+            height=entry.height,
+            created_at=now,
+            updated_at=now,
+            deleted_at=None,
+            is_intermediate=True,
+            session_id=entry.session_id,
+            node_id=entry.node_id,
+            starred=False,
+        )
+        return image_record_to_dto(
+            image_record,
+            self._services.urls.get_image_url(entry.image_name),
+            self._services.urls.get_image_url(entry.image_name, True),
+            None,
+        )
+
+    def _promote(self, image_name: str) -> None:
+        """Saves an image held in intermediate storage like any other image, so it can be used outside its session."""
+        intermediate_images = self._services.intermediate_images
+        if intermediate_images is None or intermediate_images.get_entry(image_name) is None:
+            return
+
+        # Concurrent requests for the same image wait here until its record and file exist
+        with self._promotion_lock:
+            entry = intermediate_images.get_entry(image_name)
+            image = intermediate_images.get(image_name)
+            if entry is None or image is None:
+                return
+            self._save(
+                image=image,
+                image_name=entry.image_name,
+                image_origin=entry.image_origin,
+                image_category=entry.image_category,
+                node_id=entry.node_id,
+                session_id=entry.session_id,
+                board_id=None,
+                is_intermediate=True,
+                metadata=entry.metadata,
+                workflow=entry.workflow,
+            )
+            intermediate_images.delete(image_name)
+
+    def release_intermediates(self, session_id: str) -> None:
+        if self._services.intermediate_images is not None:
+            self._services.intermediate_images.release_session(session_id)
+
     def update(
         self,
         image_name: str,
         changes: ImageRecordChanges,
     ) -> ImageDTO:
         try:
+            self._promote(image_name)
             self._services.image_records.update(image_name, changes)
             return self.get_dto(image_name)
         except ImageRecordSaveException:
@@ -248,8 +419,28 @@ class ImageService(ImageServiceABC):
             self._services.logger.error("Problem updating image record")
             raise e
 
+    def update_many(
+        self,
+        image_names: list[str],
+        changes: ImageRecordChanges,
+    ) -> list[str]:
+        try:
+            for image_name in image_names:
+                self._promote(image_name)
+            return self._services.image_records.update_many(image_names, changes)
+        except ImageRecordSaveException:
+            self._services.logger.error("Failed to update image records")
+            raise
+        except Exception as e:
+            self._services.logger.error("Problem updating image records")
+            raise e
+
     def get_pil_image(self, image_name: str) -> PILImageType:
         try:
+            if self._services.intermediate_images is not None:
+                image = self._services.intermediate_images.get(image_name)
+                if image is not None:
+                    return image
             return self._services.image_files.get(image_name)
         except ImageFileNotFoundException:
             self._services.logger.error("Failed to get image file")
@@ -260,6 +451,7 @@ class ImageService(ImageServiceABC):
 
     def get_record(self, image_name: str) -> ImageRecord:
         try:
+            self._promote(image_name)
             return self._services.image_records.get(image_name)
         except ImageRecordNotFoundException:
             self._services.logger.error("Image record not found")
@@ -270,16 +462,8 @@ class ImageService(ImageServiceABC):
 
     def get_dto(self, image_name: str) -> ImageDTO:
         try:
-            image_record = self._services.image_records.get(image_name)
-
-            image_dto = image_record_to_dto(
-                image_record,
-                self._services.urls.get_image_url(image_name),
-                self._services.urls.get_image_url(image_name, True),
-                self._services.board_image_records.get_board_for_image(image_name),
-            )
-
-            return image_dto
+            self._promote(image_name)
+            return self._get_dto(image_name)
         except ImageRecordNotFoundException:
             self._services.logger.error("Image record not found")
             raise
@@ -287,8 +471,19 @@ class ImageService(ImageServiceABC):
             self._services.logger.error("Problem getting image DTO")
             raise e
 
+    def _get_dto(self, image_name: str) -> ImageDTO:
+        image_record = self._services.image_records.get(image_name)
+
+        return image_record_to_dto(
+            image_record,
+            self._services.urls.get_image_url(image_name),
+            self._services.urls.get_image_url(image_name, True),
+            self._services.board_image_records.get_board_for_image(image_name),
+        )
+
     def get_metadata(self, image_name: str) -> Optional[ImageMetadata]:
         try:
+            self._promote(image_name)
             image_record = self._services.image_records.get(image_name)
             metadata = self._services.image_records.get_metadata(image_name)
 
@@ -315,6 +510,7 @@ class ImageService(ImageServiceABC):
 
     def get_path(self, image_name: str, thumbnail: bool = False) -> str:
         try:
+            self._promote(image_name)
             return self._services.image_files.get_path(image_name, thumbnail)
         except Exception as e:
             self._services.logger.error("Problem getting image path")
@@ -359,7 +555,7 @@ class ImageService(ImageServiceABC):
                         r,
                         self._services.urls.get_image_url(r.image_name),
                         self._services.urls.get_image_url(r.image_name, True),
-                        self._services.board_image_records.get_board_for_image(r.image_name),
+                        r.board_id,
                     ),
                     results.items,
                 )
@@ -375,8 +571,84 @@ class ImageService(ImageServiceABC):
             self._services.logger.error("Problem getting paginated image DTOs")
             raise e
 
+    def get_many_by_cursor(
+        self,
+        cursor: Optional[str] = None,
+        limit: int = 10,
+        image_origin: Optional[ResourceOrigin] = None,
+        categories: Optional[list[ImageCategory]] = None,
+        is_intermediate: Optional[bool] = None,
+        board_id: Optional[str] = None,
+    ) -> CursorPaginatedResults[ImageDTO]:
+        try:
+            results = self._services.image_records.get_many_by_cursor(
+                cursor,
+                limit,
+                image_origin,
+                categories,
+                is_intermediate,
+                board_id,
+            )
+
+            image_dtos = list(
+                map(
+                    lambda r: image_record_to_dto(
+                        r,
+                        self._services.urls.get_image_url(r.image_name),
+                        self._services.urls.get_image_url(r.image_name, True),
+                        r.board_id,
+                    ),
+                    results.items,
+                )
+            )
+
+            return CursorPaginatedResults[ImageDTO](
+                items=image_dtos,
+                limit=results.limit,
+                next_cursor=results.next_cursor,
+            )
+        except Exception as e:
+            self._services.logger.error("Problem getting cursor-paginated image DTOs")
+            raise e
+
+    def search(
+        self,
+        query: str,
+        offset: int = 0,
+        limit: int = 10,
+        is_intermediate: Optional[bool] = None,
+    ) -> OffsetPaginatedResults[ImageDTO]:
+        try:
+            results = self._services.image_records.search(query, offset, limit, is_intermediate)
+
+            image_dtos = list(
+                map(
+                    lambda r: image_record_to_dto(
+                        r,
+                        self._services.urls.get_image_url(r.image_name),
+                        self._services.urls.get_image_url(r.image_name, True),
+                        r.board_id,
+                    ),
+                    results.items,
+                )
+            )
+
+            return OffsetPaginatedResults[ImageDTO](
+                items=image_dtos,
+                offset=results.offset,
+                limit=results.limit,
+                total=results.total,
+            )
+        except Exception as e:
+            self._services.logger.error("Problem searching image DTOs")
+            raise e
+
     def delete(self, image_name: str):
         try:
+            if self._services.intermediate_images is not None:
+                if self._services.intermediate_images.get_entry(image_name) is not None:
+                    self._services.intermediate_images.delete(image_name)
+                    return
             self._services.image_files.delete(image_name)
             self._services.image_records.delete(image_name)
         except ImageRecordDeleteException:
@@ -389,18 +661,26 @@ class ImageService(ImageServiceABC):
             self._services.logger.error("Problem deleting image record and file")
             raise e
 
+    def delete_many(self, image_names: list[str]) -> list[str]:
+        try:
+            deleted = self._services.image_records.delete_many(image_names)
+            self._delete_files_in_background(deleted, "delete_images")
+            return deleted
+        except ImageRecordDeleteException:
+            self._services.logger.error("Failed to delete image records")
+            raise
+        except Exception as e:
+            self._services.logger.error("Problem deleting image records and files")
+            raise e
+
     def delete_images_on_board(self, board_id: str):
         try:
             image_names = self._services.board_image_records.get_all_board_image_names_for_board(board_id)
-            for image_name in image_names:
-                self._services.image_files.delete(image_name)
-            self._services.image_records.delete_many(image_names)
+            deleted = self._services.image_records.delete_many(image_names)
+            self._delete_files_in_background(deleted, "delete_images_on_board")
         except ImageRecordDeleteException:
             self._services.logger.error("Failed to delete image records")
             raise
-        except ImageFileDeleteException:
-            self._services.logger.error("Failed to delete image files")
-            raise
         except Exception as e:
             self._services.logger.error("Problem deleting image records and files")
             raise e
@@ -408,16 +688,40 @@ class ImageService(ImageServiceABC):
     def delete_intermediates(self) -> int:
         try:
             image_names = self._services.image_records.delete_intermediates()
-            count = len(image_names)
-            for image_name in image_names:
-                self._services.image_files.delete(image_name)
-            return count
+            self._delete_files_in_background(image_names, "delete_intermediates")
+            return len(image_names)
         except ImageRecordDeleteException:
             self._services.logger.error("Failed to delete image records")
             raise
-        except ImageFileDeleteException:
-            self._services.logger.error("Failed to delete image files")
-            raise
         except Exception as e:
             self._services.logger.error("Problem deleting image records and files")
             raise e
+
+    def _delete_files_in_background(self, image_names: list[str], operation: str) -> None:
+        """
+        Removes the files of images whose records are already deleted, without blocking
+        the caller. Progress is reported with `image_deletion_progress` events.
+        """
+        if len(image_names) == 0:
+            return
+
+        last_emitted = 0.0
+
+        def on_progress(deleted: int, total: int) -> None:
+            nonlocal last_emitted
+            now = time.monotonic()
+            if self._services.events is not None and (
+                deleted == total or now - last_emitted >= DELETION_PROGRESS_INTERVAL
+            ):
+                last_emitted = now
+                self._services.events.emit_image_deletion_progress(operation, deleted, total)
+
+        def delete_files() -> None:
+            try:
+                failed = self._services.image_files.delete_many(image_names, on_progress)
+                if len(failed) > 0:
+                    self._services.logger.error(f"Failed to delete {len(failed)} of {len(image_names)} image files")
+            except Exception as e:
+                self._services.logger.error(f"Problem deleting image files: {e}")
+
+        self._file_cleanup.submit(delete_files)
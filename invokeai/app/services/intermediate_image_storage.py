@@ -0,0 +1,156 @@
+import json
+import threading
+from abc import ABC, abstractmethod
+from datetime import datetime
+from pathlib import Path
+from typing import Optional, Union
+
+from PIL import Image
+from PIL.Image import Image as PILImageType
+from pydantic import BaseModel, Field
+
+from invokeai.app.models.image import ImageCategory, ResourceOrigin
+
+
+class IntermediateImage(BaseModel):
+    """An intermediate image that has no image record or file yet."""
+
+    image_name: str = Field(description="The unique name of the image.")
+    image_origin: ResourceOrigin = Field(description="The origin of the image.")
+    image_category: ImageCategory = Field(description="The category of the image.")
+    width: int = Field(description="The width of the image in px.")
+    height: int = Field(description="The height of the image in px.")
+    session_id: Optional[str] = Field(default=None, description="The session ID that generated this image.")
+    node_id: Optional[str] = Field(default=None, description="The node ID that generated this image.")
+    metadata: Optional[dict] = Field(default=None, description="The metadata of the image.")
+    workflow: Optional[str] = Field(default=None, description="The workflow of the image.")
+    created_at: datetime = Field(default_factory=datetime.utcnow, description="When the image was created.")
+
+
+class IntermediateImageStorageBase(ABC):
+    """
+    Holds the intermediate images made during a session, so that nodes can pass images to each other
+    without encoding them, writing thumbnails or adding image records. An image that is needed outside
+    of its session is promoted to regular storage by the image service.
+    """
+
+    @abstractmethod
+    def save(self, entry: IntermediateImage, image: PILImageType) -> None:
+        """Stores an intermediate image."""
+        pass
+
+    @abstractmethod
+    def get(self, image_name: str) -> Optional[PILImageType]:
+        """Gets a copy of an intermediate image, or None if it isn't stored here."""
+        pass
+
+    @abstractmethod
+    def get_entry(self, image_name: str) -> Optional[IntermediateImage]:
+        """Gets the details of an intermediate image, or None if it isn't stored here."""
+        pass
+
+    @abstractmethod
+    def delete(self, image_name: str) -> None:
+        """Deletes an intermediate image, if it is stored here."""
+        pass
+
+    @abstractmethod
+    def release_session(self, session_id: str) -> None:
+        """Deletes the intermediate images of a session that has finished, after the retention period."""
+        pass
+
+
+class MemoryIntermediateImageStorage(IntermediateImageStorageBase):
+    """Keeps intermediate images in memory."""
+
+    _entries: dict[str, IntermediateImage]
+    _images: dict[str, PILImageType]
+    _retention: float
+    _lock: threading.RLock
+
+    def __init__(self, retention: float = 60.0):
+        self._entries = dict()
+        self._images = dict()
+        self._retention = retention
+        self._lock = threading.RLock()
+
+    def save(self, entry: IntermediateImage, image: PILImageType) -> None:
+        with self._lock:
+            self._write_image(entry.image_name, image)
+            self._entries[entry.image_name] = entry
+
+    def get(self, image_name: str) -> Optional[PILImageType]:
+        with self._lock:
+            if image_name not in self._entries:
+                return None
+            return self._read_image(image_name)
+
+    def get_entry(self, image_name: str) -> Optional[IntermediateImage]:
+        with self._lock:
+            return self._entries.get(image_name)
+
+    def delete(self, image_name: str) -> None:
+        with self._lock:
+            if self._entries.pop(image_name, None) is not None:
+                self._delete_image(image_name)
+
+    def release_session(self, session_id: str) -> None:
+        with self._lock:
+            image_names = [name for name, entry in self._entries.items() if entry.session_id == session_id]
+        if not image_names:
+            return
+        # Clients fetch the results of a session as they are announced, which may be after it completes
+        timer = threading.Timer(self._retention, self._delete_many, args=(image_names,))
+        timer.daemon = True
+        timer.start()
+
+    def _delete_many(self, image_names: list[str]) -> None:
+        for image_name in image_names:
+            self.delete(image_name)
+
+    def _write_image(self, image_name: str, image: PILImageType) -> None:
+        # the node keeps its image; store a copy so later changes to it don't leak in
+        self._images[image_name] = image.copy()
+
+    def _read_image(self, image_name: str) -> PILImageType:
+        return self._images[image_name].copy()
+
+    def _delete_image(self, image_name: str) -> None:
+        self._images.pop(image_name, None)
+
+
+class ScratchIntermediateImageStorage(MemoryIntermediateImageStorage):
+    """
+    Keeps intermediate images in a scratch directory, as uncompressed pixel data preceded by a one-line
+    JSON header, so they cost a write and a read but no encoding or decoding.
+    """
+
+    __scratch_folder: Path
+
+    def __init__(self, scratch_folder: Union[str, Path], retention: float = 60.0):
+        super().__init__(retention)
+        self.__scratch_folder = scratch_folder if isinstance(scratch_folder, Path) else Path(scratch_folder)
+        self.__scratch_folder.mkdir(parents=True, exist_ok=True)
+        # nothing refers to the images left behind by a previous run
+        for path in self.__scratch_folder.glob("*.raw"):
+            path.unlink(missing_ok=True)
+
+    def _write_image(self, image_name: str, image: PILImageType) -> None:
+        header = {"mode": image.mode, "size": image.size, "palette": image.getpalette() if image.mode == "P" else None}
+        with open(self.__get_path(image_name), "wb") as f:
+            f.write(json.dumps(header).encode() + b"\n")
+            f.write(image.tobytes())
+
+    def _read_image(self, image_name: str) -> PILImageType:
+        with open(self.__get_path(image_name), "rb") as f:
+            header = json.loads(f.readline())
+            image = Image.frombytes(header["mode"], tuple(header["size"]), f.read())
+        if header["palette"] is not None:
+            image.putpalette(header["palette"])
+        return image
+
+    def _delete_image(self, image_name: str) -> None:
+        self.__get_path(image_name).unlink(missing_ok=True)
+
+    def __get_path(self, image_name: str) -> Path:
+        return self.__scratch_folder / f"{image_name}.raw"
@@ -9,6 +9,7 @@ if TYPE_CHECKING:
     from invokeai.app.services.images import ImageServiceABC
     from invokeai.app.services.invocation_stats import InvocationStatsServiceBase
     from invokeai.app.services.model_manager_service import ModelManagerServiceBase
+    from invokeai.app.services.model_jobs import ModelJobServiceBase
     from invokeai.app.services.events import EventServiceBase
     from invokeai.app.services.latent_storage import LatentsStorageBase
     from invokeai.app.services.invocation_queue import InvocationQueueABC
@@ -32,6 +33,7 @@ class InvocationServices:
     latents: "LatentsStorageBase"
     logger: "Logger"
     model_manager: "ModelManagerServiceBase"
+    model_jobs: "ModelJobServiceBase"
     processor: "InvocationProcessorABC"
     performance_statistics: "InvocationStatsServiceBase"
     queue: "InvocationQueueABC"
@@ -48,6 +50,7 @@ class InvocationServices:
         latents: "LatentsStorageBase",
         logger: "Logger",
         model_manager: "ModelManagerServiceBase",
+        model_jobs: "ModelJobServiceBase",
         processor: "InvocationProcessorABC",
         performance_statistics: "InvocationStatsServiceBase",
         queue: "InvocationQueueABC",
@@ -63,6 +66,7 @@ class InvocationServices:
         self.latents = latents
         self.logger = logger
         self.model_manager = model_manager
+        self.model_jobs = model_jobs
         self.processor = processor
         self.performance_statistics = performance_statistics
         self.queue = queue
@@ -292,6 +292,9 @@ class InvocationStatsService(InvocationStatsServiceBase):
             logger.info(f"   Models cached: {cache_stats.in_cache}")
             logger.info(f"   Models cleared from cache: {cache_stats.cleared}")
             logger.info(f"   Cache high water mark: {hwm:4.2f}/{tot:4.2f}G")
+            if cache_stats.transfer_time > 0:
+                rate = cache_stats.transferred / GIG / cache_stats.transfer_time
+                logger.info(f"   Model transfers: {(cache_stats.transferred / GIG):4.2f}G at {rate:4.2f}G/s")
 
             completed.add(graph_id)
 
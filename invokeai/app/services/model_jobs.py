@@ -0,0 +1,345 @@
+# Copyright (c) 2023 Lincoln D. Stein and the InvokeAI Team
+
+"""
+Runs model installs, conversions and merges in the background.
+
+Each request becomes a job with an ID, run by a bounded pool of worker
+threads, so that downloads and conversions don't hold up the API server.
+The progress of a job is reported with socket.io events, and a job can
+be cancelled while it is queued or downloading.
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from enum import Enum
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable, List, Literal, Optional
+
+from pydantic import BaseModel, Field
+
+from invokeai.app.util.misc import get_timestamp
+from invokeai.backend.model_management import (
+    BaseModelType,
+    MergeInterpolationMethod,
+    ModelType,
+    SchedulerPredictionType,
+)
+from invokeai.backend.model_management.models import InvalidModelException
+
+if TYPE_CHECKING:
+    from invokeai.app.services.invoker import Invoker
+
+# Number of finished jobs that are kept to be looked up
+MAX_FINISHED_JOBS = 100
+
+# Progress events are emitted at most this often (in seconds)
+PROGRESS_INTERVAL = 0.5
+
+
+class ModelJobType(str, Enum):
+    Install = "install"
+    Convert = "convert"
+    Merge = "merge"
+
+
+class ModelJobStatus(str, Enum):
+    Queued = "queued"
+    Running = "running"
+    Completed = "completed"
+    Failed = "failed"
+    Cancelled = "cancelled"
+
+
+class ModelJob(BaseModel):
+    """A model install, conversion or merge running in the background."""
+
+    id: str = Field(description="The ID of the job")
+    type: ModelJobType = Field(description="What the job does")
+    description: str = Field(description="The model(s) the job works on")
+    status: ModelJobStatus = Field(default=ModelJobStatus.Queued, description="The status of the job")
+    message: Optional[str] = Field(default=None, description="What the job is doing")
+    progress: Optional[float] = Field(default=None, description="The progress of the current download, from 0 to 1")
+    error: Optional[str] = Field(default=None, description="Why the job failed")
+    result: Optional[dict] = Field(
+        default=None, description="The configuration of the installed, converted or merged model"
+    )
+    created_at: int = Field(description="When the job was submitted")
+    started_at: Optional[int] = Field(default=None, description="When the job started running")
+    finished_at: Optional[int] = Field(default=None, description="When the job completed, failed or was cancelled")
+
+
+class ModelJobCancelled(BaseException):
+    """
+    Raised in a job's thread when it is cancelled. Like asyncio.CancelledError, it isn't an Exception,
+    so that the error handling of the installer doesn't swallow it.
+    """
+
+
+class ModelJobServiceBase(ABC):
+    """Runs model installs, conversions and merges in the background"""
+
+    @abstractmethod
+    def submit_install(
+        self,
+        location: str,
+        prediction_type: Optional[SchedulerPredictionType] = None,
+    ) -> ModelJob:
+        """
+        Queue the import of a model from its local path, repo_id or URL.
+        :param location: A model path, repo_id or URL to import
+        :param prediction_type: Prediction type for SDv2 checkpoint files
+        """
+        pass
+
+    @abstractmethod
+    def submit_convert(
+        self,
+        model_name: str,
+        base_model: BaseModelType,
+        model_type: Literal[ModelType.Main, ModelType.Vae],
+        convert_dest_directory: Optional[Path] = None,
+    ) -> ModelJob:
+        """Queue the conversion of a checkpoint model into a diffusers model."""
+        pass
+
+    @abstractmethod
+    def submit_merge(
+        self,
+        model_names: List[str],
+        base_model: BaseModelType,
+        merged_model_name: str,
+        alpha: float = 0.5,
+        interp: Optional[MergeInterpolationMethod] = None,
+        force: bool = False,
+        merge_dest_directory: Optional[Path] = None,
+    ) -> ModelJob:
+        """Queue the merge of two or three diffusers models into a new one."""
+        pass
+
+    @abstractmethod
+    def get_job(self, job_id: str) -> Optional[ModelJob]:
+        """Return a job, or None if there is no such job."""
+        pass
+
+    @abstractmethod
+    def list_jobs(self) -> List[ModelJob]:
+        """Return the queued, running and recently finished jobs, oldest first."""
+        pass
+
+    @abstractmethod
+    def cancel_job(self, job_id: str) -> Optional[ModelJob]:
+        """
+        Cancel a job. A queued job is cancelled right away, and a running one when it next
+        reports progress, which installs do while downloading files. A diffusers model downloaded
+        from a repo_id only reports the start and end of its download. Returns None if there is no such job.
+        """
+        pass
+
+    @abstractmethod
+    def get_future(self, job_id: str) -> Optional[Future]:
+        """
+        Return a future that resolves to the result of a job, or raises the exception that failed it,
+        or None if there is no such job.
+        """
+        pass
+
+
+class ModelJobService(ModelJobServiceBase):
+    """Runs model jobs on a pool of `max_jobs` worker threads"""
+
+    def __init__(self, max_jobs: int = 1):
+        self._executor = ThreadPoolExecutor(max_workers=max_jobs, thread_name_prefix="model_job")
+        self._lock = threading.Lock()
+        # job ID => job, in the order they were submitted
+        self._jobs: OrderedDict[str, ModelJob] = OrderedDict()
+        self._futures: dict[str, Future] = dict()
+        self._cancelled: set[str] = set()
+        self._invoker: Optional[Invoker] = None
+
+    def start(self, invoker: Invoker) -> None:
+        self._invoker = invoker
+
+    def stop(self, invoker: Invoker) -> None:
+        with self._lock:
+            self._cancelled.update(self._jobs.keys())
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def submit_install(
+        self,
+        location: str,
+        prediction_type: Optional[SchedulerPredictionType] = None,
+    ) -> ModelJob:
+        def install(progress: Callable[[str, int, int], None]) -> dict:
+            model_manager = self._invoker.services.model_manager
+            installed = model_manager.heuristic_import(
+                items_to_import={location},
+                prediction_type_helper=lambda x: prediction_type,
+                progress_callback=progress,
+            )
+            info = installed.get(location)
+            if not info:
+                raise InvalidModelException(f"Unable to import {location}")
+            return model_manager.list_model(info.name, base_model=info.base_model, model_type=info.model_type)
+
+        return self._submit(ModelJobType.Install, location, install)
+
+    def submit_convert(
+        self,
+        model_name: str,
+        base_model: BaseModelType,
+        model_type: Literal[ModelType.Main, ModelType.Vae],
+        convert_dest_directory: Optional[Path] = None,
+    ) -> ModelJob:
+        def convert(progress: Callable[[str, int, int], None]) -> dict:
+            model_manager = self._invoker.services.model_manager
+            model_manager.convert_model(
+                model_name,
+                base_model=base_model,
+                model_type=model_type,
+                convert_dest_directory=convert_dest_directory,
+            )
+            return model_manager.list_model(model_name, base_model=base_model, model_type=model_type)
+
+        return self._submit(ModelJobType.Convert, f"{base_model.value}/{model_type.value}/{model_name}", convert)
+
+    def submit_merge(
+        self,
+        model_names: List[str],
+        base_model: BaseModelType,
+        merged_model_name: str,
+        alpha: float = 0.5,
+        interp: Optional[MergeInterpolationMethod] = None,
+        force: bool = False,
+        merge_dest_directory: Optional[Path] = None,
+    ) -> ModelJob:
+        def merge(progress: Callable[[str, int, int], None]) -> dict:
+            model_manager = self._invoker.services.model_manager
+            result = model_manager.merge_models(
+                model_names,
+                base_model,
+                merged_model_name=merged_model_name,
+                alpha=alpha,
+                interp=interp,
+                force=force,
+                merge_dest_directory=merge_dest_directory,
+            )
+            return model_manager.list_model(result.name, base_model=base_model, model_type=ModelType.Main)
+
+        description = f"{'+'.join(model_names)} => {base_model.value}/{merged_model_name}"
+        return self._submit(ModelJobType.Merge, description, merge)
+
+    def get_job(self, job_id: str) -> Optional[ModelJob]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return job.copy() if job else None
+
+    def list_jobs(self) -> List[ModelJob]:
+        with self._lock:
+            return [job.copy() for job in self._jobs.values()]
+
+    def cancel_job(self, job_id: str) -> Optional[ModelJob]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            if job.status not in [ModelJobStatus.Queued, ModelJobStatus.Running]:
+                return job.copy()
+            self._cancelled.add(job_id)
+            # a job that hasn't started yet never will
+            queued = self._futures[job_id].cancel()
+            if queued:
+                self._finish(job, ModelJobStatus.Cancelled)
+            job = job.copy()
+        if queued:
+            self._invoker.services.events.emit_model_job_cancelled(job.dict())
+        return job
+
+    def get_future(self, job_id: str) -> Optional[Future]:
+        with self._lock:
+            return self._futures.get(job_id)
+
+    def _submit(self, job_type: ModelJobType, description: str, task: Callable[[Callable], dict]) -> ModelJob:
+        job = ModelJob(id=str(uuid.uuid4()), type=job_type, description=description, created_at=get_timestamp())
+        with self._lock:
+            self._jobs[job.id] = job
+            self._futures[job.id] = self._executor.submit(self._run, job, task)
+            self._forget_finished_jobs()
+            return job.copy()
+
+    def _run(self, job: ModelJob, task: Callable[[Callable], dict]) -> dict:
+        events = self._invoker.services.events
+        logger = self._invoker.services.logger
+        with self._lock:
+            # cancelled after it was picked up by a worker
+            cancelled = job.id in self._cancelled
+            if cancelled:
+                self._finish(job, ModelJobStatus.Cancelled)
+            else:
+                job.status = ModelJobStatus.Running
+                job.started_at = get_timestamp()
+            started = job.dict()
+        if cancelled:
+            events.emit_model_job_cancelled(started)
+            raise ModelJobCancelled()
+        logger.info(f"Started {job.type.value} job {job.id}: {job.description}")
+        events.emit_model_job_started(started)
+
+        last_emitted = 0.0
+
+        def progress(name: str, done: int, total: int) -> None:
+            nonlocal last_emitted
+            if job.id in self._cancelled:
+                raise ModelJobCancelled()
+            now = time.time()
+            if now - last_emitted < PROGRESS_INTERVAL and done < total:
+                return
+            last_emitted = now
+            with self._lock:
+                job.message = f"Downloading {name}"
+                job.progress = done / total if total else None
+                update = job.dict()
+            events.emit_model_job_progress(update)
+
+        try:
+            result = task(progress)
+        except ModelJobCancelled:
+            with self._lock:
+                self._finish(job, ModelJobStatus.Cancelled)
+                finished = job.dict()
+            logger.info(f"Cancelled {job.type.value} job {job.id}")
+            events.emit_model_job_cancelled(finished)
+            raise
+        except Exception as e:
+            with self._lock:
+                self._finish(job, ModelJobStatus.Failed, error=f"{type(e).__name__}: {e}")
+                finished = job.dict()
+            logger.error(f"{job.type.value.capitalize()} job {job.id} failed: {e}")
+            events.emit_model_job_error(finished)
+            raise
+
+        with self._lock:
+            job.result = result
+            self._finish(job, ModelJobStatus.Completed)
+            finished = job.dict()
+        logger.info(f"Completed {job.type.value} job {job.id}")
+        events.emit_model_job_completed(finished)
+        return result
+
+    def _finish(self, job: ModelJob, status: ModelJobStatus, error: Optional[str] = None) -> None:
+        job.status = status
+        job.error = error
+        job.message = None
+        job.finished_at = get_timestamp()
+        self._cancelled.discard(job.id)
+
+    def _forget_finished_jobs(self) -> None:
+        finished = [job.id for job in self._jobs.values() if job.finished_at is not None]
+        for job_id in finished[: max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self._jobs[job_id]
+            del self._futures[job_id]
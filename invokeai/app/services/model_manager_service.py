@@ -23,6 +23,9 @@ from invokeai.backend.model_management import (
 )
 from invokeai.backend.model_management.model_search import FindModels
 from invokeai.backend.model_management.model_cache import CacheStats
+from invokeai.backend.model_management.convert_cache import ConvertCacheEntry
+from invokeai.backend.stable_diffusion import StableDiffusionGeneratorPipeline
+from invokeai.backend.stable_diffusion.compiled_models import warmup_unet, warmup_vae_decode
 
 import torch
 from invokeai.app.models.exceptions import CanceledException
@@ -216,11 +219,13 @@ class ModelManagerServiceBase(ABC):
         self,
         items_to_import: set[str],
         prediction_type_helper: Optional[Callable[[Path], SchedulerPredictionType]] = None,
+        progress_callback: Optional[Callable[[str, int, int], None]] = None,
     ) -> dict[str, AddModelResult]:
         """Import a list of paths, repo_ids or URLs. Returns the set of
         successfully imported items.
         :param items_to_import: Set of strings corresponding to models to be imported.
         :param prediction_type_helper: A callback that receives the Path of a Stable Diffusion 2 checkpoint model and returns a SchedulerPredictionType.
+        :param progress_callback: A callback that receives the file name, bytes downloaded and total bytes as downloads progress.
 
         The prediction type helper is necessary to distinguish between
         models based on Stable Diffusion 2 Base (requiring
@@ -277,6 +282,21 @@ class ModelManagerServiceBase(ABC):
         """
         pass
 
+    @abstractmethod
+    def list_convert_cache(self) -> List[ConvertCacheEntry]:
+        """
+        List the models converted or mapped in models/.cache, most recently used first.
+        """
+        pass
+
+    @abstractmethod
+    def prune_convert_cache(self, max_size: Optional[float] = None) -> List[ConvertCacheEntry]:
+        """
+        Delete the least recently used converted models until models/.cache fits in
+        `max_size` GB, or in the configured convert_cache_size. Returns the deleted entries.
+        """
+        pass
+
     @abstractmethod
     def collect_cache_stats(self, cache_stats: CacheStats):
         """
@@ -284,6 +304,22 @@ class ModelManagerServiceBase(ABC):
         """
         pass
 
+    @abstractmethod
+    def warmup_compiled_models(self, warmup: List[str]):
+        """
+        Build the compiled UNet and VAE decoder graphs for each
+        "<base model>/<model name>:<width>x<height>" entry in `warmup`.
+        """
+        pass
+
+    @abstractmethod
+    def models_generation(self) -> int:
+        """
+        Return a number that changes whenever models are added, changed, removed or
+        uncached, so that results computed with the models can be discarded.
+        """
+        pass
+
     @abstractmethod
     def commit(self, conf_file: Optional[Path] = None) -> None:
         """
@@ -335,7 +371,7 @@ class ModelManagerService(ModelManagerServiceBase):
 
         logger.debug(f"Maximum RAM cache size: {max_cache_size} GiB")
 
-        sequential_offload = config.sequential_guidance
+        sequential_offload = config.sequential_offload
 
         self.mgr = ModelManager(
             config=config_file,
@@ -508,12 +544,73 @@ class ModelManagerService(ModelManagerServiceBase):
         self.logger.debug(f"convert model {model_name}")
         return self.mgr.convert_model(model_name, base_model, model_type, convert_dest_directory)
 
+    def list_convert_cache(self) -> List[ConvertCacheEntry]:
+        """
+        List the models converted or mapped in models/.cache, most recently used first.
+        """
+        return self.mgr.convert_cache.list_entries()
+
+    def prune_convert_cache(self, max_size: Optional[float] = None) -> List[ConvertCacheEntry]:
+        """
+        Delete the least recently used converted models until models/.cache fits in
+        `max_size` GB, or in the configured convert_cache_size. Returns the deleted entries.
+        """
+        return self.mgr.convert_cache.prune(max_size)
+
     def collect_cache_stats(self, cache_stats: CacheStats):
         """
         Reset model cache statistics for graph with graph_id.
         """
         self.mgr.cache.stats = cache_stats
 
+    def warmup_compiled_models(self, warmup: List[str]):
+        """
+        Build the compiled UNet and VAE decoder graphs for each
+        "<base model>/<model name>:<width>x<height>" entry in `warmup`.
+        Entries that can't be parsed or loaded are logged and skipped.
+        """
+        for entry in warmup:
+            try:
+                model, size = entry.rsplit(":", 1)
+                base_model, model_name = model.split("/", 1)
+                width, height = (int(x) for x in size.lower().split("x"))
+                self._warmup_compiled_model(model_name, BaseModelType(base_model), width, height)
+            except Exception as e:
+                self.logger.warning(f"Compile warm-up of {entry} failed: {e}")
+
+    def _warmup_compiled_model(self, model_name: str, base_model: BaseModelType, width: int, height: int):
+        self.logger.info(f"Warming up compiled graphs for {base_model.value}/{model_name} at {width}x{height}")
+        unet_info = self.get_model(model_name, base_model, ModelType.Main, SubModelType.UNet)
+        vae_info = self.get_model(model_name, base_model, ModelType.Main, SubModelType.Vae)
+        scheduler_info = self.get_model(model_name, base_model, ModelType.Main, SubModelType.Scheduler)
+        batch_size = 1 if self.mgr.app_config.sequential_guidance else 2
+
+        with unet_info as unet:
+            # same attention processors as a denoise run, so the graph keys match
+            pipeline = StableDiffusionGeneratorPipeline(
+                vae=vae_info.context.model,
+                text_encoder=None,
+                tokenizer=None,
+                unet=unet,
+                scheduler=scheduler_info.context.model,
+                safety_checker=None,
+                feature_extractor=None,
+                requires_safety_checker=False,
+            )
+            latents = torch.zeros((1, 4, height // 8, width // 8), device=unet.device, dtype=unet.dtype)
+            pipeline._adjust_memory_efficient_attention(latents)
+            warmup_unet(unet, width, height, batch_size=batch_size)
+
+        with vae_info as vae:
+            warmup_vae_decode(vae, width, height)
+
+    def models_generation(self) -> int:
+        """
+        Return a number that changes whenever models are added, changed, removed or
+        uncached, so that results computed with the models can be discarded.
+        """
+        return self.mgr.generation
+
     def commit(self, conf_file: Optional[Path] = None):
         """
         Write current configuration out to the indicated file.
@@ -560,11 +657,13 @@ class ModelManagerService(ModelManagerServiceBase):
         self,
         items_to_import: set[str],
         prediction_type_helper: Optional[Callable[[Path], SchedulerPredictionType]] = None,
+        progress_callback: Optional[Callable[[str, int, int], None]] = None,
     ) -> dict[str, AddModelResult]:
         """Import a list of paths, repo_ids or URLs. Returns the set of
         successfully imported items.
         :param items_to_import: Set of strings corresponding to models to be imported.
         :param prediction_type_helper: A callback that receives the Path of a Stable Diffusion 2 checkpoint model and returns a SchedulerPredictionType.
+        :param progress_callback: A callback that receives the file name, bytes downloaded and total bytes as downloads progress.
 
         The prediction type helper is necessary to distinguish between
         models based on Stable Diffusion 2 Base (requiring
@@ -577,7 +676,7 @@ class ModelManagerService(ModelManagerServiceBase):
         of the set is a dict corresponding to the newly-created OmegaConf stanza for
         that model.
         """
-        return self.mgr.heuristic_import(items_to_import, prediction_type_helper)
+        return self.mgr.heuristic_import(items_to_import, prediction_type_helper, progress_callback)
 
     def merge_models(
         self,
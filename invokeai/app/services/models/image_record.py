@@ -43,6 +43,16 @@ class ImageRecord(BaseModelExcludeNull):
     """Whether this image is starred."""
 
 
+class ImageRecordWithBoard(ImageRecord):
+    """Deserialized image record, with the id of the board it belongs to."""
+
+    board_id: Optional[str] = Field(
+        default=None,
+        description="The id of the board the image belongs to, if one exists.",
+    )
+    """The id of the board the image belongs to, if one exists."""
+
+
 class ImageRecordChanges(BaseModelExcludeNull, extra=Extra.forbid):
     """A set of changes to apply to an image record.
 
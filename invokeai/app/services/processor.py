@@ -101,6 +101,7 @@ class DefaultInvocationProcessor(InvocationProcessorABC):
 
                         # Check queue to see if this is canceled, and skip if so
                         if self.__invoker.services.queue.is_canceled(graph_execution_state.id):
+                            self.__invoker.services.images.release_intermediates(graph_execution_state.id)
                             continue
 
                         # Save outputs and history
@@ -149,6 +150,7 @@ class DefaultInvocationProcessor(InvocationProcessorABC):
 
                 # Check queue to see if this is canceled, and skip if so
                 if self.__invoker.services.queue.is_canceled(graph_execution_state.id):
+                    self.__invoker.services.images.release_intermediates(graph_execution_state.id)
                     continue
 
                 # Queue any further commands if invoking all
@@ -166,6 +168,7 @@ class DefaultInvocationProcessor(InvocationProcessorABC):
                             error=traceback.format_exc(),
                         )
                 elif is_complete:
+                    self.__invoker.services.images.release_intermediates(graph_execution_state.id)
                     self.__invoker.services.events.emit_graph_execution_complete(graph_execution_state.id)
 
         except KeyboardInterrupt:
@@ -15,8 +15,8 @@ class NameServiceBase(ABC):
 
     # TODO: Add customizable naming schemes
     @abstractmethod
-    def create_image_name(self) -> str:
-        """Creates a name for an image."""
+    def create_image_name(self, extension: str = "png") -> str:
+        """Creates a name for an image, with the given file extension."""
         pass
 
 
@@ -24,7 +24,7 @@ class SimpleNameService(NameServiceBase):
     """Creates image names from UUIDs."""
 
     # TODO: Add customizable naming schemes
-    def create_image_name(self) -> str:
+    def create_image_name(self, extension: str = "png") -> str:
         uuid_str = str(uuid.uuid4())
-        filename = f"{uuid_str}.png"
+        filename = f"{uuid_str}.{extension}"
         return filename
@@ -0,0 +1,120 @@
+"""
+Encoders for image files. InvokeAI's metadata and workflow are kept in every format: in text chunks for
+PNG, and in the EXIF ImageDescription for WEBP, JPEG and AVIF.
+"""
+import json
+import os
+from pathlib import Path
+from typing import Literal, Optional, Union
+
+from PIL import Image, PngImagePlugin
+from PIL.Image import Image as PILImageType
+
+ImageFormat = Literal["png", "webp", "jpeg", "avif", "raw"]
+
+IMAGE_EXTENSIONS: dict[str, str] = {"png": "png", "webp": "webp", "jpeg": "jpg", "avif": "avif", "raw": "png"}
+IMAGE_MEDIA_TYPES: dict[str, str] = {
+    ".png": "image/png",
+    ".webp": "image/webp",
+    ".jpg": "image/jpeg",
+    ".avif": "image/avif",
+}
+
+EXIF_IMAGE_DESCRIPTION = 0x010E
+# JPEG keeps EXIF in a single APP1 segment, which can't exceed 64kb
+MAX_JPEG_EXIF_BYTES = 65533
+
+
+def get_media_type(image_name: Union[str, Path]) -> str:
+    """Gets the media type of an image file from its extension."""
+    return IMAGE_MEDIA_TYPES.get(os.path.splitext(image_name)[1].lower(), "image/png")
+
+
+def avif_supported() -> bool:
+    Image.init()
+    return "AVIF" in Image.SAVE
+
+
+def get_embedded_metadata(image: PILImageType) -> tuple[Optional[str], Optional[str]]:
+    """Gets the serialized metadata and workflow embedded in an image, as (metadata, workflow)."""
+    metadata = image.info.get("invokeai_metadata", None)
+    workflow = image.info.get("invokeai_workflow", None)
+    if metadata is not None or workflow is not None or image.format in (None, "PNG"):
+        return metadata, workflow
+
+    try:
+        description = image.getexif().get(EXIF_IMAGE_DESCRIPTION)
+        embedded = json.loads(description) if description else None
+    except Exception:
+        return None, None
+    if not isinstance(embedded, dict):
+        return None, None
+    return embedded.get("invokeai_metadata", None), embedded.get("invokeai_workflow", None)
+
+
+class ImageEncoder:
+    """
+    Writes images in one format.
+
+    - `png`: lossless, `compress_level` 0 (fastest) to 9 (smallest)
+    - `webp`: lossless, `compress_level` sets the encoder effort
+    - `jpeg`, `avif`: lossy, at `quality`. Images with transparency are written as PNG, and AVIF falls back
+      to lossy WEBP when Pillow can't encode it.
+    - `raw`: uncompressed PNG, the fastest to write and read back
+    """
+
+    def __init__(self, format: ImageFormat = "png", compress_level: int = 6, quality: int = 90):
+        self.format = format
+        self.compress_level = 0 if format == "raw" else compress_level
+        self.quality = quality
+
+    def get_extension(self, image: PILImageType) -> str:
+        """Gets the file extension that `image` will be written with."""
+        if self.format in ("jpeg", "avif") and image.mode in ("RGBA", "LA", "PA", "P"):
+            return "png"
+        if self.format == "avif" and not avif_supported():
+            return "webp"
+        return IMAGE_EXTENSIONS[self.format]
+
+    def save(
+        self,
+        image: PILImageType,
+        path: Path,
+        metadata: Optional[str] = None,
+        workflow: Optional[str] = None,
+    ) -> None:
+        """Writes `image` to `path`, in the format given by the extension of `path`."""
+        extension = path.suffix.lower()
+
+        if extension == ".png":
+            pnginfo = PngImagePlugin.PngInfo()
+            if metadata is not None:
+                pnginfo.add_text("invokeai_metadata", metadata)
+            if workflow is not None:
+                pnginfo.add_text("invokeai_workflow", workflow)
+            image.save(path, "PNG", pnginfo=pnginfo, compress_level=self.compress_level)
+            return
+
+        exif = self.__make_exif(metadata, workflow)
+        if extension == ".webp":
+            if self.format == "webp":
+                # the compression level maps onto WEBP's encoder effort, 0 to 6
+                image.save(path, "WEBP", lossless=True, method=round(self.compress_level * 6 / 9), exif=exif)
+            else:
+                image.save(path, "WEBP", quality=self.quality, exif=exif)
+        elif extension == ".jpg":
+            if len(exif) > MAX_JPEG_EXIF_BYTES:
+                exif = self.__make_exif(metadata, None)
+            image.convert("RGB" if image.mode != "L" else "L").save(path, "JPEG", quality=self.quality, exif=exif)
+        elif extension == ".avif":
+            image.save(path, "AVIF", quality=self.quality, exif=exif)
+        else:
+            raise ValueError(f"Unsupported image extension: {extension}")
+
+    def __make_exif(self, metadata: Optional[str], workflow: Optional[str]) -> bytes:
+        if metadata is None and workflow is None:
+            return b""
+        exif = Image.Exif()
+        # json.dumps escapes non-ASCII characters, as ImageDescription must be ASCII
+        exif[EXIF_IMAGE_DESCRIPTION] = json.dumps({"invokeai_metadata": metadata, "invokeai_workflow": workflow})
+        return exif.tobytes()
@@ -9,7 +9,10 @@ def get_thumbnail_name(image_name: str) -> str:
 
 
 def make_thumbnail(image: Image.Image, size: int = 256) -> Image.Image:
-    """Makes a thumbnail from a PIL Image"""
-    thumbnail = image.copy()
-    thumbnail.thumbnail(size=(size, size))
-    return thumbnail
+    """Makes a thumbnail from a PIL Image, preserving its aspect ratio"""
+    scale = min(size / image.width, size / image.height, 1.0)
+    thumbnail_size = (max(round(image.width * scale), 1), max(round(image.height * scale), 1))
+    # resize() makes a new image, so there is no need to copy the full-size one first. With reducing_gap,
+    # the image is first shrunk by an integer factor with reduce(), which is much cheaper than resampling
+    # from full size.
+    return image.resize(thumbnail_size, Image.Resampling.BICUBIC, reducing_gap=2.0)
@@ -3,6 +3,7 @@ Utility (backend) functions used by model_install.py
 """
 import os
 import shutil
+import time
 import warnings
 from dataclasses import dataclass, field
 from pathlib import Path
@@ -21,6 +22,7 @@ import invokeai.configs as configs
 
 from invokeai.app.services.config import InvokeAIAppConfig
 from invokeai.backend.model_management import ModelManager, ModelType, BaseModelType, ModelVariantType, AddModelResult
+from invokeai.backend.model_management.convert_cache import GIG
 from invokeai.backend.model_management.model_probe import ModelProbe, SchedulerPredictionType, ModelProbeInfo
 from invokeai.backend.util import download_with_resume
 from invokeai.backend.util.devices import torch_dtype, choose_torch_device
@@ -103,6 +105,7 @@ class ModelInstall(object):
         prediction_type_helper: Optional[Callable[[Path], SchedulerPredictionType]] = None,
         model_manager: Optional[ModelManager] = None,
         access_token: Optional[str] = None,
+        progress_callback: Optional[Callable[[str, int, int], None]] = None,
     ):
         self.config = config
         self.mgr = model_manager or ModelManager(config.model_conf_path)
@@ -110,6 +113,8 @@ class ModelInstall(object):
         self.prediction_helper = prediction_type_helper
         self.access_token = access_token or HfFolder.get_token()
         self.reverse_paths = self._reverse_paths(self.datasets)
+        # called with the file name, bytes downloaded and total bytes as downloads progress
+        self.progress_callback = progress_callback
 
     def all_models(self) -> Dict[str, ModelLoadInfo]:
         """
@@ -168,6 +173,18 @@ class ModelInstall(object):
         for i in installed:
             print(f"{i['model_name']}\t{i['base_model']}\t{i['path']}")
 
+    def list_convert_cache(self):
+        entries = self.mgr.convert_cache.list_entries()
+        print(f"Models converted in `{self.mgr.convert_cache.cache_path}`:")
+        for e in entries:
+            last_used = time.strftime("%Y-%m-%d %H:%M", time.localtime(e.last_used))
+            print(f"{e.key}\t{e.size/GIG:4.2f}G\t{last_used}\t{e.source or '<unknown source>'}")
+
+    def prune_convert_cache(self, max_size: Optional[float] = None):
+        removed = self.mgr.convert_cache.prune(max_size)
+        freed = sum(e.size for e in removed)
+        print(f"Removed {len(removed)} converted models, freeing {freed/GIG:4.2f}G")
+
     # logic here a little reversed to maintain backward compatibility
     def starter_models(self, all_models: bool = False) -> Set[str]:
         models = set()
@@ -283,7 +300,7 @@ class ModelInstall(object):
 
     def _install_url(self, url: str) -> AddModelResult:
         with TemporaryDirectory(dir=self.config.models_path) as staging:
-            location = download_with_resume(url, Path(staging))
+            location = download_with_resume(url, Path(staging), progress_callback=self.progress_callback)
             if not location:
                 logger.error(f"Unable to download {url}. Skipping.")
             info = ModelProbe().heuristic_probe(location)
@@ -420,6 +437,10 @@ class ModelInstall(object):
         precision = torch_dtype(choose_torch_device())
         variants = ["fp16", None] if precision == torch.float16 else [None, "fp16"]
 
+        # from_pretrained() doesn't report the progress of its downloads, so only the start and end of the
+        # download are reported, which is when it can be cancelled
+        if self.progress_callback:
+            self.progress_callback(repo_id, 0, 1)
         model = None
         for variant in variants:
             try:
@@ -439,6 +460,8 @@ class ModelInstall(object):
         if not model:
             logger.error(f"Diffusers model {repo_id} could not be downloaded. Skipping.")
             return None
+        if self.progress_callback:
+            self.progress_callback(repo_id, 1, 1)
         model.save_pretrained(staging / name, safe_serialization=True)
         return staging / name
 
@@ -454,6 +477,7 @@ class ModelInstall(object):
                 model_name=filePath.name,
                 access_token=self.access_token,
                 subfolder=filePath.parent,
+                progress_callback=self.progress_callback,
             )
             if p:
                 paths.append(p)
@@ -502,6 +526,7 @@ def hf_download_with_resume(
     model_dest: Path = None,
     access_token: str = None,
     subfolder: str = None,
+    progress_callback: Optional[Callable[[str, int, int], None]] = None,
 ) -> Path:
     model_dest = model_dest or Path(os.path.join(model_dir, model_name))
     os.makedirs(model_dir, exist_ok=True)
@@ -545,6 +570,8 @@ def hf_download_with_resume(
             for data in resp.iter_content(chunk_size=1024):
                 size = file.write(data)
                 bar.update(size)
+                if progress_callback:
+                    progress_callback(model_name, bar.n, bar.total)
     except Exception as e:
         logger.error(f"An error occurred while downloading {model_name}: {str(e)}")
         return None
@@ -0,0 +1,268 @@
+"""
+Manages the models/.cache directory, where checkpoint models are converted to diffusers models.
+
+Each converted model is stored under a key made from a hash of the checkpoint's contents and
+the conversion parameters, so moving or renaming a checkpoint doesn't invalidate its converted
+copy. An index records when each converted model was last used, and the least recently used
+ones are deleted once the cache exceeds its disk budget.
+
+Conversions are written to a staging path and moved into place once complete, so that an
+interrupted conversion never leaves a half-written model in the cache.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+import types
+from contextlib import contextmanager
+from pathlib import Path
+from shutil import rmtree
+from typing import Dict, Iterator, List, Optional, Union
+
+from pydantic import BaseModel, Field
+
+import invokeai.backend.util.logging as logger
+
+GIG = 1073741824
+
+# Default disk budget of the cache, in GB
+DEFAULT_MAX_CONVERT_CACHE_SIZE = 10.0
+
+INDEX_FILE = "index.json"
+STAGING_SUFFIX = ".tmp"
+
+# Checkpoints are hashed in chunks of this many bytes
+HASH_CHUNK_SIZE = 2**20
+
+# Changed when the way checkpoints are hashed changes, so that hashes in the index are recomputed
+HASH_VERSION = 2
+
+# Last use times are written to the index at most this often (in seconds)
+INDEX_SAVE_INTERVAL = 60.0
+
+
+class ConvertCacheEntry(BaseModel):
+    """A converted model in the conversion cache."""
+
+    key: str = Field(description="The cache key of the converted model")
+    source: Optional[str] = Field(default=None, description="The path of the checkpoint it was converted from")
+    size: int = Field(description="Disk space used by the converted model, in bytes")
+    last_used: float = Field(description="When the converted model was last used, in seconds since the epoch")
+
+
+def checkpoint_hash(path: Union[str, Path]) -> str:
+    """Identifies the contents of a checkpoint file by a hash of the whole file."""
+    blake = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            blake.update(chunk)
+    return blake.hexdigest()
+
+
+@contextmanager
+def staging_path(output_path: Union[str, Path]) -> Iterator[Path]:
+    """
+    Yields a path to write a converted model to, which is moved to `output_path` once the
+    block completes, replacing whatever is there. If the block fails, the partial output is
+    deleted and `output_path` is left untouched.
+    """
+    output_path = Path(output_path)
+    staging = output_path.with_name(output_path.name + STAGING_SUFFIX)
+    _remove(staging)
+    try:
+        yield staging
+    except BaseException:
+        _remove(staging)
+        raise
+    _remove(output_path)
+    os.replace(staging, output_path)
+
+
+def _remove(path: Path) -> None:
+    if path.is_dir():
+        rmtree(path)
+    elif path.exists():
+        path.unlink()
+
+
+def _disk_usage(path: Path) -> int:
+    if path.is_file():
+        return path.stat().st_size
+    return sum(f.stat().st_size for f in path.rglob("*") if f.is_file())
+
+
+class ModelConvertCache(object):
+    """
+    The directory of converted models, with a disk budget and LRU eviction.
+    """
+
+    def __init__(
+        self,
+        cache_path: Union[str, Path],
+        max_size: float = DEFAULT_MAX_CONVERT_CACHE_SIZE,
+        logger: types.ModuleType = logger,
+    ):
+        """
+        :param cache_path: the directory of converted models
+        :param max_size: disk budget of the cache, in GB
+        :param logger: logger to use
+        """
+        self.cache_path = Path(cache_path)
+        self.max_size = max_size
+        self.logger = logger
+        self._lock = threading.RLock()
+        # checkpoint path -> its size, mtime and content hash, so that files are only read when they change
+        self._hashes: Dict[str, dict] = dict()
+        # cache key -> ConvertCacheEntry
+        self._entries: Dict[str, ConvertCacheEntry] = dict()
+        self._saved_at = 0.0
+        self._load_index()
+
+    def get_cache_path(self, model_path: Union[str, Path], **parameters) -> Path:
+        """
+        Gets the path that a checkpoint is converted to. `parameters` are everything else that
+        the conversion depends on, such as the base model and the model's config.
+        """
+        model_path = Path(model_path)
+        if model_path.is_dir():
+            # folders are diffusers models, which aren't converted
+            content = str(model_path)
+        else:
+            content = self._get_checkpoint_hash(model_path)
+        key = hashlib.blake2b(
+            json.dumps([content, parameters], sort_keys=True, default=str).encode(), digest_size=16
+        ).hexdigest()
+        return self.cache_path / key
+
+    def record_use(self, cache_path: Union[str, Path], source: Optional[Union[str, Path]] = None) -> None:
+        """
+        Records a use of the converted model at `cache_path`. A model that wasn't in the cache
+        yet is added to it, and the least recently used models are deleted to make room for it.
+        """
+        cache_path = Path(cache_path)
+        if not cache_path.is_relative_to(self.cache_path) or not cache_path.exists():
+            return
+        with self._lock:
+            entry = self._entries.get(cache_path.name)
+            if entry is not None:
+                entry.last_used = time.time()
+                self._save_index(force=False)
+                return
+
+            self._entries[cache_path.name] = ConvertCacheEntry(
+                key=cache_path.name,
+                source=str(source) if source is not None else None,
+                size=_disk_usage(cache_path),
+                last_used=time.time(),
+            )
+            self._evict(self.max_size, keep=cache_path.name)
+            self._save_index()
+
+    def list_entries(self) -> List[ConvertCacheEntry]:
+        """Lists the converted models in the cache, most recently used first."""
+        with self._lock:
+            return sorted(self._entries.values(), key=lambda e: e.last_used, reverse=True)
+
+    def prune(self, max_size: Optional[float] = None) -> List[ConvertCacheEntry]:
+        """
+        Deletes the least recently used converted models until the cache fits in `max_size` GB,
+        or in its budget if not given. Returns the deleted entries.
+        """
+        with self._lock:
+            removed = self._evict(self.max_size if max_size is None else max_size)
+            self._save_index()
+            return removed
+
+    def delete(self, cache_path: Union[str, Path]) -> None:
+        """Deletes the converted model at `cache_path`."""
+        cache_path = Path(cache_path)
+        with self._lock:
+            _remove(cache_path)
+            if self._entries.pop(cache_path.name, None) is not None:
+                self._save_index()
+
+    def _get_checkpoint_hash(self, model_path: Path) -> str:
+        stat = model_path.stat()
+        with self._lock:
+            known = self._hashes.get(str(model_path))
+            if known is not None and (known["size"], known["mtime"], known.get("version")) == (
+                stat.st_size,
+                stat.st_mtime_ns,
+                HASH_VERSION,
+            ):
+                return known["hash"]
+
+        content = checkpoint_hash(model_path)
+        with self._lock:
+            self._hashes[str(model_path)] = {
+                "size": stat.st_size,
+                "mtime": stat.st_mtime_ns,
+                "version": HASH_VERSION,
+                "hash": content,
+            }
+            self._save_index()
+        return content
+
+    def _evict(self, max_size: float, keep: Optional[str] = None) -> List[ConvertCacheEntry]:
+        total = sum(e.size for e in self._entries.values())
+        removed = []
+        for entry in sorted(self._entries.values(), key=lambda e: e.last_used):
+            if total <= max_size * GIG:
+                break
+            if entry.key == keep:
+                continue
+            self.logger.info(f"Removing {entry.source or entry.key} from the conversion cache")
+            _remove(self.cache_path / entry.key)
+            del self._entries[entry.key]
+            total -= entry.size
+            removed.append(entry)
+        return removed
+
+    def _load_index(self) -> None:
+        self.cache_path.mkdir(parents=True, exist_ok=True)
+        index = dict()
+        index_path = self.cache_path / INDEX_FILE
+        if index_path.exists():
+            try:
+                with open(index_path, "r") as f:
+                    index = json.load(f)
+            except (OSError, ValueError) as e:
+                self.logger.warning(f"Could not read the conversion cache index at {index_path}: {e}")
+
+        self._hashes = index.get("hashes", dict())
+        self._entries = {key: ConvertCacheEntry.parse_obj(e) for key, e in index.get("entries", dict()).items()}
+
+        # conversions interrupted by a crash; and models converted before the cache was managed
+        # or whose index entry was lost, which are adopted so that they can be evicted
+        for path in self.cache_path.iterdir():
+            if path.name == INDEX_FILE:
+                continue
+            if path.name.endswith(STAGING_SUFFIX):
+                _remove(path)
+            elif path.name not in self._entries:
+                self._entries[path.name] = ConvertCacheEntry(
+                    key=path.name, size=_disk_usage(path), last_used=path.stat().st_mtime
+                )
+        for key in [key for key in self._entries if not (self.cache_path / key).exists()]:
+            del self._entries[key]
+        self._save_index()
+
+    def _save_index(self, force: bool = True) -> None:
+        now = time.time()
+        if not force and now - self._saved_at < INDEX_SAVE_INTERVAL:
+            return
+        index = {
+            "hashes": self._hashes,
+            "entries": {key: entry.dict() for key, entry in self._entries.items()},
+        }
+        index_path = self.cache_path / INDEX_FILE
+        tmpfile = index_path.with_name(INDEX_FILE + STAGING_SUFFIX)
+        try:
+            with open(tmpfile, "w") as f:
+                json.dump(index, f)
+            os.replace(tmpfile, index_path)
+            self._saved_at = now
+        except OSError as e:
+            self.logger.warning(f"Could not write the conversion cache index at {index_path}: {e}")
@@ -17,17 +17,20 @@
 #
 """ Conversion script for the Stable Diffusion checkpoints."""
 
+import json
 import re
+from bisect import bisect_right
 from contextlib import nullcontext
 from io import BytesIO
 from pathlib import Path
-from typing import Optional, Union
+from typing import Dict, Optional, Tuple, Union
 
 import requests
 import torch
 from diffusers.models import (
     AutoencoderKL,
     ControlNetModel,
+    ModelMixin,
     PriorTransformer,
     UNet2DConditionModel,
 )
@@ -65,6 +68,7 @@ from transformers import (
 from invokeai.app.services.config import InvokeAIAppConfig
 from invokeai.backend.util.logging import InvokeAILogger
 from .models import BaseModelType, ModelVariantType
+from .models.base import CHECKPOINT_KEY_MAP, COMPUTED_WEIGHTS
 
 try:
     from omegaconf import OmegaConf
@@ -789,7 +793,7 @@ def convert_ldm_bert_checkpoint(checkpoint, config):
     return hf_model
 
 
-def convert_ldm_clip_checkpoint(checkpoint, local_files_only=False, text_encoder=None):
+def convert_ldm_clip_checkpoint(checkpoint, local_files_only=False, text_encoder=None, state_dict=None):
     if text_encoder is None:
         config = CLIPTextConfig.from_pretrained(CONVERT_MODEL_ROOT / "clip-vit-large-patch14")
 
@@ -808,6 +812,9 @@ def convert_ldm_clip_checkpoint(checkpoint, local_files_only=False, text_encoder
             if key.startswith(prefix):
                 text_model_dict[key[len(prefix + ".") :]] = checkpoint[key]
 
+    if state_dict is not None:
+        state_dict.update(text_model_dict)
+
     if is_accelerate_available():
         for param_name, param in text_model_dict.items():
             set_module_tensor_to_device(text_model, param_name, "cpu", value=param)
@@ -910,7 +917,7 @@ def convert_paint_by_example_checkpoint(checkpoint):
 
 
 def convert_open_clip_checkpoint(
-    checkpoint, config_name, prefix="cond_stage_model.model.", has_projection=False, **config_kwargs
+    checkpoint, config_name, prefix="cond_stage_model.model.", has_projection=False, state_dict=None, **config_kwargs
 ):
     # text_model = CLIPTextModel.from_pretrained("stabilityai/stable-diffusion-2", subfolder="text_encoder")
     # text_model = CLIPTextModelWithProjection.from_pretrained(
@@ -969,6 +976,9 @@ def convert_open_clip_checkpoint(
 
                 text_model_dict[new_key] = checkpoint[key]
 
+    if state_dict is not None:
+        state_dict.update(text_model_dict)
+
     if is_accelerate_available():
         for param_name, param in text_model_dict.items():
             set_module_tensor_to_device(text_model, param_name, "cpu", value=param)
@@ -1135,6 +1145,8 @@ def download_from_original_stable_diffusion_ckpt(
     text_encoder=None,
     tokenizer=None,
     scan_needed: bool = True,
+    checkpoint: Optional[dict] = None,
+    converted_state_dicts: Optional[Dict[str, dict]] = None,
 ) -> DiffusionPipeline:
     """
     Load a Stable Diffusion pipeline object from a CompVis-style `.ckpt`/`.safetensors` file and (ideally) a `.yaml`
@@ -1193,6 +1205,11 @@ def download_from_original_stable_diffusion_ckpt(
             needed.
         precision (`torch.dtype`, *optional*, defauts to `None`):
             If not provided the precision will be set to the precision of the original file.
+        checkpoint (`dict`, *optional*, defaults to `None`):
+            The state dict of the checkpoint, if it has already been loaded.
+        converted_state_dicts (`dict`, *optional*, defaults to `None`):
+            If given, receives the converted state dict of each model of the pipeline, by component name. Their
+            tensors are the checkpoint's tensors, or views of them, wherever the conversion allows.
         return: A StableDiffusionPipeline object representing the passed-in `.ckpt`/`.safetensors` file.
     """
 
@@ -1218,7 +1235,9 @@ def download_from_original_stable_diffusion_ckpt(
     if not is_omegaconf_available():
         raise ValueError(BACKENDS_MAPPING["omegaconf"][1])
 
-    if from_safetensors:
+    if checkpoint is not None:
+        pass
+    elif from_safetensors:
         from safetensors.torch import load_file as safe_load
 
         checkpoint = safe_load(checkpoint_path, device="cpu")
@@ -1234,6 +1253,11 @@ def download_from_original_stable_diffusion_ckpt(
         else:
             checkpoint = torch.load(checkpoint_path, map_location=device)
 
+    def capture(component: str) -> Optional[dict]:
+        if converted_state_dicts is None:
+            return None
+        return converted_state_dicts.setdefault(component, dict())
+
     # Sometimes models don't have the global_step item
     if "global_step" in checkpoint:
         global_step = checkpoint["global_step"]
@@ -1400,6 +1424,8 @@ def download_from_original_stable_diffusion_ckpt(
     converted_unet_checkpoint = convert_ldm_unet_checkpoint(
         checkpoint, unet_config, path=checkpoint_path, extract_ema=extract_ema
     )
+    if converted_state_dicts is not None:
+        converted_state_dicts["unet"] = converted_unet_checkpoint
 
     ctx = init_empty_weights if is_accelerate_available() else nullcontext
     with ctx():
@@ -1415,6 +1441,8 @@ def download_from_original_stable_diffusion_ckpt(
     if vae_path is None:
         vae_config = create_vae_diffusers_config(original_config, image_size=image_size)
         converted_vae_checkpoint = convert_ldm_vae_checkpoint(checkpoint, vae_config)
+        if converted_state_dicts is not None:
+            converted_state_dicts["vae"] = converted_vae_checkpoint
 
         if (
             "model" in original_config
@@ -1443,7 +1471,9 @@ def download_from_original_stable_diffusion_ckpt(
         config_name = "stabilityai/stable-diffusion-2"
         config_kwargs = {"subfolder": "text_encoder"}
 
-        text_model = convert_open_clip_checkpoint(checkpoint, config_name, **config_kwargs)
+        text_model = convert_open_clip_checkpoint(
+            checkpoint, config_name, state_dict=capture("text_encoder"), **config_kwargs
+        )
         tokenizer = CLIPTokenizer.from_pretrained(CONVERT_MODEL_ROOT / "stable-diffusion-2-clip", subfolder="tokenizer")
 
         if stable_unclip is None:
@@ -1541,7 +1571,7 @@ def download_from_original_stable_diffusion_ckpt(
         )
     elif model_type == "FrozenCLIPEmbedder":
         text_model = convert_ldm_clip_checkpoint(
-            checkpoint, local_files_only=local_files_only, text_encoder=text_encoder
+            checkpoint, local_files_only=local_files_only, text_encoder=text_encoder, state_dict=capture("text_encoder")
         )
         tokenizer = (
             CLIPTokenizer.from_pretrained(CONVERT_MODEL_ROOT / "clip-vit-large-patch14")
@@ -1584,7 +1614,9 @@ def download_from_original_stable_diffusion_ckpt(
     elif model_type in ["SDXL", "SDXL-Refiner"]:
         if model_type == "SDXL":
             tokenizer = CLIPTokenizer.from_pretrained(CONVERT_MODEL_ROOT / "clip-vit-large-patch14")
-            text_encoder = convert_ldm_clip_checkpoint(checkpoint, local_files_only=local_files_only)
+            text_encoder = convert_ldm_clip_checkpoint(
+                checkpoint, local_files_only=local_files_only, state_dict=capture("text_encoder")
+            )
 
             tokenizer_name = CONVERT_MODEL_ROOT / "CLIP-ViT-bigG-14-laion2B-39B-b160k"
             tokenizer_2 = CLIPTokenizer.from_pretrained(tokenizer_name, pad_token="!")
@@ -1592,7 +1624,12 @@ def download_from_original_stable_diffusion_ckpt(
             config_name = tokenizer_name
             config_kwargs = {"projection_dim": 1280}
             text_encoder_2 = convert_open_clip_checkpoint(
-                checkpoint, config_name, prefix="conditioner.embedders.1.model.", has_projection=True, **config_kwargs
+                checkpoint,
+                config_name,
+                prefix="conditioner.embedders.1.model.",
+                has_projection=True,
+                state_dict=capture("text_encoder_2"),
+                **config_kwargs,
             )
 
             pipe = StableDiffusionXLPipeline(
@@ -1614,7 +1651,12 @@ def download_from_original_stable_diffusion_ckpt(
             config_name = tokenizer_name
             config_kwargs = {"projection_dim": 1280}
             text_encoder_2 = convert_open_clip_checkpoint(
-                checkpoint, config_name, prefix="conditioner.embedders.0.model.", has_projection=True, **config_kwargs
+                checkpoint,
+                config_name,
+                prefix="conditioner.embedders.0.model.",
+                has_projection=True,
+                state_dict=capture("text_encoder_2"),
+                **config_kwargs,
             )
 
             pipe = StableDiffusionXLImg2ImgPipeline(
@@ -1737,6 +1779,121 @@ def convert_ckpt_to_diffusers(
     )
 
 
+class CheckpointTensorLocator:
+    """Finds the tensor of a checkpoint that a converted weight is a view of, by the address of its data."""
+
+    def __init__(self, tensors: Dict[str, torch.Tensor]):
+        self._tensors = dict(tensors)
+        self._extents = sorted(
+            (t.data_ptr(), t.data_ptr() + t.numel() * t.element_size(), key)
+            for key, t in self._tensors.items()
+            if t.numel()
+        )
+        self._starts = [start for start, _, _ in self._extents]
+
+    def locate(self, value: torch.Tensor) -> Optional[dict]:
+        """
+        Returns the key of the checkpoint tensor that `value` is, or a view of, with the offset, shape and
+        strides of the view unless it is the whole tensor. Returns None if `value` isn't in the checkpoint.
+        """
+        if value.numel() == 0 or value.device.type != "cpu":
+            return None
+        index = bisect_right(self._starts, value.data_ptr()) - 1
+        if index < 0:
+            return None
+        start, end, key = self._extents[index]
+        source = self._tensors[key]
+        last = sum((size - 1) * stride for size, stride in zip(value.shape, value.stride()))
+        if source.dtype != value.dtype or value.data_ptr() + (last + 1) * value.element_size() > end:
+            return None
+        if value.data_ptr() == start and value.shape == source.shape and value.stride() == source.stride():
+            return {"key": key}
+        return {
+            "key": key,
+            "offset": (value.data_ptr() - start) // value.element_size(),
+            "shape": list(value.shape),
+            "stride": list(value.stride()),
+        }
+
+
+def map_state_dict(
+    state_dict: Dict[str, torch.Tensor], locator: CheckpointTensorLocator
+) -> Tuple[Dict[str, dict], Dict[str, torch.Tensor]]:
+    """
+    Splits the converted state dict of a model into the map of its weights that are read from the checkpoint,
+    and the weights that the conversion computed.
+    """
+    weights = dict()
+    computed = dict()
+    for weight_name, value in state_dict.items():
+        entry = locator.locate(value)
+        if entry is None:
+            computed[weight_name] = value.detach().clone().contiguous()
+        else:
+            weights[weight_name] = entry
+    return weights, computed
+
+
+def map_ckpt_to_diffusers(
+    checkpoint_path: Union[str, Path],
+    dump_path: Union[str, Path],
+    **kwargs,
+):
+    """
+    Takes the arguments of convert_ckpt_to_diffusers(), but writes a diffusers model without
+    weights: the model configs, tokenizers and scheduler, and a map (CHECKPOINT_KEY_MAP) from
+    each weight of the models to the tensor of the checkpoint it is read from, and at which
+    offset and strides if it is a slice of that tensor. DiffusersModel then loads the models
+    straight from the checkpoint. The few weights that the conversion computes are written
+    to COMPUTED_WEIGHTS files.
+
+    Raises NotImplementedError for checkpoints that can't be mapped; they have to be converted.
+    """
+    from safetensors.torch import load_file, save_file
+
+    checkpoint_path = Path(checkpoint_path)
+    dump_path = Path(dump_path)
+    if checkpoint_path.suffix != ".safetensors":
+        raise NotImplementedError(f"Only safetensors checkpoints can be loaded directly: {checkpoint_path}")
+    kwargs.pop("use_safetensors", None)
+
+    checkpoint = load_file(checkpoint_path, device="cpu")
+    # the conversion pops tensors out of the checkpoint; the locator keeps them alive so that their memory isn't reused
+    locator = CheckpointTensorLocator(checkpoint)
+
+    converted = dict()
+    pipe = download_from_original_stable_diffusion_ckpt(
+        str(checkpoint_path), checkpoint=checkpoint, converted_state_dicts=converted, **kwargs
+    )
+    components = {name: c for name, c in pipe.components.items() if c is not None}
+    unmapped = {name for name, c in components.items() if isinstance(c, torch.nn.Module)} - set(converted)
+    if unmapped:
+        raise NotImplementedError(f"The {', '.join(sorted(unmapped))} of {checkpoint_path} can't be mapped")
+
+    pipe.save_config(dump_path)
+
+    models = dict()
+    for name, component in components.items():
+        if not isinstance(component, torch.nn.Module):
+            component.save_pretrained(dump_path / name)
+            continue
+        if isinstance(component, ModelMixin):
+            component.save_config(dump_path / name)
+        else:
+            component.config.save_pretrained(dump_path / name)
+
+        weights, computed = map_state_dict(converted[name], locator)
+        if computed:
+            save_file(computed, dump_path / name / COMPUTED_WEIGHTS)
+        models[name] = {
+            "size": sum(v.numel() * v.element_size() for v in converted[name].values()),
+            "weights": weights,
+        }
+
+    with open(dump_path / CHECKPOINT_KEY_MAP, "w") as f:
+        json.dump({"checkpoint": str(checkpoint_path.resolve()), "models": models}, f)
+
+
 def convert_controlnet_to_diffusers(
     checkpoint_path: Union[str, Path],
     dump_path: Union[str, Path],
@@ -0,0 +1,214 @@
+"""
+Runs models that don't fit in VRAM by streaming their layers onto the GPU.
+
+A LayerStreamer hooks every module of a model that owns parameters or
+buffers. The weights of a module that isn't resident are copied to the
+execution device just before it runs, and dropped again as soon as it
+has run. The storage copy is kept, so dropping is free. While a module
+runs, the next one in execution order is prefetched on a side stream.
+That order is recorded during the first forward pass.
+
+plan() chooses which modules stay resident, within a VRAM budget. The
+modules that ran most often are chosen first, so they stay on the GPU
+across generations while the rest are streamed.
+"""
+
+import weakref
+from typing import Dict, Optional, Set
+
+import torch
+
+
+def _module_tensors(module: torch.nn.Module):
+    yield from module.named_parameters(recurse=False)
+    yield from module.named_buffers(recurse=False)
+
+
+def _same_tensor(t: torch.Tensor, stored: torch.Tensor) -> bool:
+    # `t.data` is a new tensor object on every access
+    return t.device == stored.device and t.data_ptr() == stored.data_ptr()
+
+
+class LayerStreamer(object):
+    """
+    Streams the layers of a model, which stays on `storage_device`, onto `execution_device`
+    as they run. detach() restores the model to a plain module on the storage device.
+    """
+
+    def __init__(self, model: torch.nn.Module, execution_device: torch.device, storage_device: torch.device):
+        # the model cache tells whether a model is in use from its reference count
+        self._model = weakref.ref(model)
+        self.execution_device = execution_device
+        self.storage_device = storage_device
+        # block => the storage copies of its weights
+        self._storage: Dict[torch.nn.Module, Dict[str, torch.Tensor]] = dict()
+        self._sizes: Dict[torch.nn.Module, int] = dict()
+        self._calls: Dict[torch.nn.Module, int] = dict()
+        self._handles: Dict[torch.nn.Module, list] = dict()
+        # block => the block that ran after it the first time
+        self._next: Dict[torch.nn.Module, torch.nn.Module] = dict()
+        self._last_called: Optional[torch.nn.Module] = None
+        self._pinned: Optional[torch.nn.Module] = None
+        self._resident: Set[torch.nn.Module] = set()
+        self._on_device: Set[torch.nn.Module] = set()
+        self._prefetched: Dict[torch.nn.Module, torch.cuda.Event] = dict()
+        self._stream = torch.cuda.Stream(execution_device) if execution_device.type == "cuda" else None
+        self._sync()
+
+    @property
+    def size(self) -> int:
+        return sum(self._sizes.values())
+
+    @property
+    def resident_size(self) -> int:
+        return sum(self._sizes[block] for block in self._resident)
+
+    def plan(self, budget: int):
+        """
+        Chooses the blocks that stay on the execution device, most often run first, within `budget` bytes,
+        and moves them there. Blocks that are no longer chosen are dropped from the execution device.
+        """
+        self._sync()
+        resident = set()
+        used = 0
+        if self._pinned is not None:
+            resident.add(self._pinned)
+            used += self._sizes[self._pinned]
+        order = {block: i for i, block in enumerate(self._storage)}
+        for block in sorted(self._storage, key=lambda b: (-self._calls[b], order[b])):
+            if block in resident or used + self._sizes[block] > budget:
+                continue
+            resident.add(block)
+            used += self._sizes[block]
+
+        for block in self._resident - resident:
+            self._drop(block, write_back=True)
+        for block in resident - self._resident:
+            self._fetch(block)
+        self._resident = resident
+
+    def offload(self):
+        """Drops every block from the execution device."""
+        for block in list(self._on_device):
+            self._drop(block, write_back=block in self._resident)
+        self._resident = set()
+
+    def detach(self):
+        """Removes the hooks and drops every block from the execution device."""
+        self.offload()
+        for handles in self._handles.values():
+            for handle in handles:
+                handle.remove()
+        self._handles = dict()
+
+    def _sync(self):
+        """
+        Picks up the changes made to the model since it was last planned: patchers replace parameters
+        and modules, for instance when resizing the token embeddings for textual inversions.
+        """
+        model = self._model()
+        if model is None:
+            return
+        blocks = [m for m in model.modules() if next(_module_tensors(m), None) is not None]
+        for block in set(self._storage) - set(blocks):
+            self._forget(block)
+
+        for block in blocks:
+            if block not in self._storage:
+                self._storage[block] = dict()
+                self._calls[block] = 0
+                self._handles[block] = [
+                    block.register_forward_pre_hook(self._before),
+                    block.register_forward_hook(self._after),
+                ]
+            storage = self._storage[block]
+            for name, t in _module_tensors(block):
+                if name in storage and (block in self._on_device or _same_tensor(t, storage[name])):
+                    continue
+                # a new or replaced tensor
+                t.data = t.data.to(self.storage_device)
+                storage[name] = t.data
+            self._sizes[block] = sum(t.numel() * t.element_size() for t in storage.values())
+
+        # The block that owns the first parameter is always resident: the `device` property of diffusers and
+        # transformers models is the device of their first parameter, and the pipelines put their inputs there.
+        first_parameter = next(model.parameters(), None)
+        self._pinned = next((b for b in blocks if any(p is first_parameter for p in b.parameters(recurse=False))), None)
+
+    def _forget(self, block: torch.nn.Module):
+        self._drop(block)
+        for handle in self._handles.pop(block, []):
+            handle.remove()
+        for table in (self._storage, self._sizes, self._calls, self._next):
+            table.pop(block, None)
+        self._next = {b: n for b, n in self._next.items() if n is not block}
+        self._resident.discard(block)
+        if self._last_called is block:
+            self._last_called = None
+
+    def _before(self, module: torch.nn.Module, args):
+        self._calls[module] += 1
+        # learn the execution order from the first time each block runs
+        last = self._last_called
+        if last is not None and last is not module and last not in self._next:
+            self._next[last] = module
+        self._last_called = module
+
+        self._fetch(module)
+        next_block = self._next.get(module)
+        if next_block is not None and self._stream is not None:
+            self._prefetch(next_block)
+
+    def _after(self, module: torch.nn.Module, args, output):
+        if module not in self._resident:
+            self._drop(module)
+
+    def _fetch(self, block: torch.nn.Module):
+        if block not in self._on_device:
+            self._copy_to_device(block)
+            return
+        event = self._prefetched.pop(block, None)
+        if event is not None:
+            current = torch.cuda.current_stream(self.execution_device)
+            current.wait_event(event)
+            # the copies were made on the side stream; keep their memory until the current stream is done
+            for _, t in _module_tensors(block):
+                t.data.record_stream(current)
+
+    def _prefetch(self, block: torch.nn.Module):
+        if block in self._on_device:
+            return
+        with torch.cuda.stream(self._stream):
+            self._copy_to_device(block, non_blocking=True)
+            event = torch.cuda.Event()
+            event.record(self._stream)
+        self._prefetched[block] = event
+
+    def _copy_to_device(self, block: torch.nn.Module, non_blocking: bool = False):
+        storage = self._storage[block]
+        with torch.no_grad():
+            for name, t in _module_tensors(block):
+                if not _same_tensor(t, storage[name]):
+                    # replaced while off the device, by model.to(dtype) for instance
+                    storage[name] = t.data.to(self.storage_device)
+                t.data = storage[name].to(self.execution_device, non_blocking=non_blocking)
+        self._on_device.add(block)
+
+    def _drop(self, block: torch.nn.Module, write_back: bool = False):
+        """
+        Drops a block's weights from the execution device. Resident blocks are written back first,
+        as they may have been patched in place while they were on the device.
+        """
+        if block not in self._on_device:
+            return
+        storage = self._storage[block]
+        with torch.no_grad():
+            for name, t in _module_tensors(block):
+                if t.data.dtype != storage[name].dtype:
+                    # converted while on the device
+                    storage[name] = t.data.to(self.storage_device)
+                elif write_back:
+                    storage[name].copy_(t.data)
+                t.data = storage[name]
+        self._on_device.discard(block)
+        self._prefetched.pop(block, None)
@@ -126,10 +126,12 @@ class ModelPatcher:
             with torch.no_grad():
                 for lora, lora_weight in loras:
                     # assert lora.device.type == "cpu"
-                    for layer_key, layer in lora.layers.items():
+                    # a lazily loaded LoRA only reads the layers it is applied from
+                    for layer_key in lora.layers:
                         if not layer_key.startswith(prefix):
                             continue
 
+                        layer = lora.layers[layer_key]
                         module_key, module = cls._resolve_lora_key(model, layer_key, prefix)
                         if module_key not in original_weights:
                             original_weights[module_key] = module.weight.detach().to(device="cpu", copy=True)
@@ -351,10 +353,11 @@ class ONNXModelPatcher:
             blended_loras = dict()
 
             for lora, lora_weight in loras:
-                for layer_key, layer in lora.layers.items():
+                for layer_key in lora.layers:
                     if not layer_key.startswith(prefix):
                         continue
 
+                    layer = lora.layers[layer_key]
                     layer.to(dtype=torch.float32)
                     layer_key = layer_key.replace(prefix, "")
                     # TODO: rewrite to pass original tensor weight(required by ia3)
@@ -4,6 +4,28 @@ They are moved between GPU VRAM and CPU RAM as necessary. If the cache
 grows larger than a preset maximum, then the least recently used
 model will be cleared and (re)loaded from disk when next needed.
 
+Submodels with identical weights, such as the text encoder and VAE
+that fine-tunes share with their base model, are loaded once and
+shared by every model that has them. A shared model is only cleared
+once all the models that share it are least recently used.
+
+With a storage precision of int8 or fp8, the weights of models moved
+off the GPU are quantized to one byte each, so that about twice as many
+fp16 models fit in the cache. They are dequantized when the model is
+moved back onto the GPU.
+
+With sequential offloading, models that don't fit in the free VRAM
+are run a layer at a time: their layers are streamed onto the GPU as
+they run, and the most used ones stay there as long as there is room.
+
+Within its pinned memory budget, the cache keeps the weights of models
+in page-locked RAM. They are copied to and from the GPU asynchronously
+on a dedicated stream, so that the CPU carries on with the graph while
+the copy is in flight, and moving a model off the GPU doesn't allocate.
+
+With a spill cache, models cleared from the cache are written to a
+local directory, and reloading them only reads their weights back.
+
 The cache returns context manager generators designed to load the
 model into the GPU within the context, and unload outside the
 context. Use like this:
@@ -20,15 +42,26 @@ import gc
 import os
 import sys
 import hashlib
-from contextlib import suppress
+from contextlib import contextmanager, suppress
 from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Dict, Union, types, Optional, Type, Any
+from typing import Dict, List, Set, Union, types, Optional, Type, Any
 
 import torch
 
 import invokeai.backend.util.logging as logger
+from ..stable_diffusion.compiled_models import compiled_graph_references, release_compiled_graphs
+from .layer_streaming import LayerStreamer, _same_tensor
 from .models import BaseModelType, ModelType, SubModelType, ModelBase
+from .models.base import calc_model_size_by_data
+from .quantization import (
+    QuantizationState,
+    StoragePrecision,
+    dequantize_weights,
+    quantize_weights,
+    resolve_storage_precision,
+)
+from .spill_cache import ModelSpillCache
 
 # Maximum size of the cache, in gigs
 # Default is roughly enough to hold three fp16 diffusers models in RAM simultaneously
@@ -37,6 +70,12 @@ DEFAULT_MAX_CACHE_SIZE = 6.0
 # amount of GPU memory to hold in reserve for use by generations (GB)
 DEFAULT_MAX_VRAM_CACHE_SIZE = 2.75
 
+# amount of RAM that may be pinned for fast transfers to the GPU (GB)
+DEFAULT_MAX_PINNED_SIZE = 4.0
+
+# amount of free GPU memory left to generations by the layers of a streamed model (GB)
+STREAMING_WORKSPACE = 2.0
+
 # actual size of a gig
 GIG = 1073741824
 
@@ -49,10 +88,17 @@ class CacheStats(object):
     in_cache: int = 0  # number of models in cache
     cleared: int = 0  # number of models cleared to make space
     cache_size: int = 0  # total size of cache
+    transferred: int = 0  # bytes moved between RAM and VRAM
+    transfer_time: float = 0.0  # seconds spent moving them
     # {submodel_key => size}
     loaded_model_sizes: Dict[str, int] = field(default_factory=dict)
 
 
+def _named_tensors(model: torch.nn.Module):
+    yield from model.named_parameters()
+    yield from model.named_buffers()
+
+
 class ModelLocker(object):
     "Forward declaration"
     pass
@@ -67,12 +113,26 @@ class _CacheRecord:
     size: int
     model: Any
     cache: ModelCache
+    content_key: Optional[str]
+    keys: Set[str]
+    quantization: Optional[QuantizationState]
+    streamer: Optional[LayerStreamer]
+    pinned: Optional[Dict[str, torch.Tensor]]
     _locks: int
 
-    def __init__(self, cache, model: Any, size: int):
+    def __init__(self, cache, model: Any, size: int, content_key: Optional[str] = None):
         self.size = size
         self.model = model
         self.cache = cache
+        self.content_key = content_key
+        # the cache keys of the models that share this one
+        self.keys = set()
+        # set while the model's weights are quantized
+        self.quantization = None
+        # set once the model is run with sequential offloading
+        self.streamer = None
+        # name => page-locked copy of each weight, for models in the pinned memory budget
+        self.pinned = None
         self._locks = 0
 
     def lock(self):
@@ -88,6 +148,8 @@ class _CacheRecord:
 
     @property
     def loaded(self):
+        if self.streamer is not None:
+            return self.streamer.resident_size > 0
         if self.model is not None and hasattr(self.model, "device"):
             return self.model.device != self.cache.storage_device
         else:
@@ -105,6 +167,9 @@ class ModelCache(object):
         sequential_offload: bool = False,
         lazy_offloading: bool = True,
         sha_chunksize: int = 16777216,
+        storage_precision: StoragePrecision = "same",
+        max_pinned_size: float = DEFAULT_MAX_PINNED_SIZE,
+        spill_cache: Optional[ModelSpillCache] = None,
         logger: types.ModuleType = logger,
     ):
         """
@@ -113,8 +178,11 @@ class ModelCache(object):
         :param storage_device: Torch device to save inactive model in [torch.device('cpu')]
         :param precision: Precision for loaded models [torch.float16]
         :param lazy_offloading: Keep model in VRAM until another model needs to be loaded
-        :param sequential_offload: Conserve VRAM by loading and unloading each stage of the pipeline sequentially
+        :param sequential_offload: Conserve VRAM by streaming the layers of models that don't fit in it onto the GPU
         :param sha_chunksize: Chunksize to use when calculating sha256 model hash
+        :param storage_precision: Quantize the weights of models moved off the execution device to "int8" or "fp8" ["same"]
+        :param max_pinned_size: Maximum amount of the RAM cache kept in pinned memory, for CUDA devices [4.0 GB]
+        :param spill_cache: Where to spill the models cleared from the cache, if anywhere [None]
         """
         self.model_infos: Dict[str, ModelBase] = dict()
         # allow lazy offloading only when vram cache enabled
@@ -125,13 +193,36 @@ class ModelCache(object):
         self.execution_device: torch.device = execution_device
         self.storage_device: torch.device = storage_device
         self.sha_chunksize = sha_chunksize
+        self.spill_cache = spill_cache
         self.logger = logger
+        # models that run where they are stored are never moved, so they are never quantized
+        if storage_precision != "same" and execution_device == storage_device:
+            self.logger.warning(f"Models run on {storage_device}; they are kept in the cache at full precision")
+            storage_precision = "same"
+        self.sequential_offload = sequential_offload and execution_device.type == "cuda"
+        if storage_precision != "same" and self.sequential_offload:
+            # streamed layers are copied to the GPU as they are stored
+            self.logger.warning("Models are kept in the cache at full precision when sequential offloading is enabled")
+            storage_precision = "same"
+        self.storage_precision: StoragePrecision = resolve_storage_precision(storage_precision)
+        # quantized weights are new tensors every time the model is moved off the GPU
+        self.max_pinned_size: float = (
+            max_pinned_size if execution_device.type == "cuda" and self.storage_precision == "same" else 0
+        )
+        self._pinned_size = 0
+        self._transfer_stream = torch.cuda.Stream(execution_device) if self.max_pinned_size > 0 else None
+        # transfers whose time is not known yet: (stats, start event, end event, bytes)
+        self._pending_transfers = list()
 
         # used for stats collection
         self.stats = None
 
-        self._cached_models = dict()
+        self._cached_models: Dict[str, _CacheRecord] = dict()
         self._cache_stack = list()
+        # incremented whenever a model is uncached, because its files or its config changed
+        self.generation = 0
+        # content key => the record shared by the models with those weights
+        self._content_models: Dict[str, _CacheRecord] = dict()
 
     def get_key(
         self,
@@ -198,6 +289,13 @@ class ModelCache(object):
         )
         # TODO: lock for no copies on simultaneous calls?
         cache_entry = self._cached_models.get(key, None)
+        content_key = None
+        if cache_entry is None and (content_key := self._get_content_key(model_info, submodel)):
+            cache_entry = self._content_models.get(content_key, None)
+            if cache_entry is not None:
+                self.logger.debug(f"Sharing the cached {next(iter(cache_entry.keys))} as {key}")
+                cache_entry.keys.add(key)
+                self._cached_models[key] = cache_entry
         if cache_entry is None:
             self.logger.info(
                 f"Loading model {model_path}, type {base_model.value}:{model_type.value}{':'+submodel.value if submodel else ''}"
@@ -211,20 +309,27 @@ class ModelCache(object):
 
             # clean memory to make MemoryUsage() more accurate
             gc.collect()
-            model = model_info.get_model(child_type=submodel, torch_dtype=self.precision)
+            model = self.spill_cache.restore(key) if self.spill_cache is not None else None
+            if model is None:
+                model = model_info.get_model(child_type=submodel, torch_dtype=self.precision)
             if mem_used := model_info.get_size(submodel):
                 self.logger.debug(f"CPU RAM used for load: {(mem_used/GIG):.2f} GB")
 
-            cache_entry = _CacheRecord(self, model, mem_used)
+            cache_entry = _CacheRecord(self, model, mem_used, content_key)
+            self._pin(cache_entry)
+            cache_entry.keys.add(key)
             self._cached_models[key] = cache_entry
+            if content_key:
+                self._content_models[content_key] = cache_entry
         else:
             if self.stats:
                 self.stats.hits += 1
 
+        self._collect_transfers()
         if self.stats:
             self.stats.cache_size = self.max_cache_size * GIG
             self.stats.high_watermark = max(self.stats.high_watermark, self._cache_size())
-            self.stats.in_cache = len(self._cached_models)
+            self.stats.in_cache = len(self._cache_records())
             self.stats.loaded_model_sizes[key] = max(
                 self.stats.loaded_model_sizes.get(key, 0), model_info.get_size(submodel)
             )
@@ -264,10 +369,13 @@ class ModelCache(object):
                     if self.cache.lazy_offloading:
                         self.cache._offload_unlocked_models(self.size_needed)
 
-                    if self.model.device != self.cache.execution_device:
+                    if self.cache._needs_streaming(self.cache_entry):
+                        self.cache._stream_model(self.key, self.cache_entry)
+                    elif self.model.device != self.cache.execution_device:
                         self.cache.logger.debug(f"Moving {self.key} into {self.cache.execution_device}")
                         with VRAMUsage() as mem:
-                            self.model.to(self.cache.execution_device)  # move into GPU
+                            self.cache._move_to_device(self.cache_entry)
+                            self.cache._dequantize(self.cache_entry)
                         self.cache.logger.debug(f"GPU VRAM used for load: {(mem.vram_used/GIG):.2f} GB")
 
                     self.cache.logger.debug(f"Locking {self.key} in {self.cache.execution_device}")
@@ -281,7 +389,14 @@ class ModelCache(object):
             # in the event that the caller wants the model in RAM, we
             # move it into CPU if it is in GPU and not locked
             elif self.cache_entry.loaded and not self.cache_entry.locked:
-                self.model.to(self.cache.storage_device)
+                self.cache._move_to_storage(self.cache_entry, quantize=False)
+            if not self.gpu_load and self.cache._transfer_stream is not None:
+                # the caller uses the weights on the CPU, where they may still be in flight
+                self.cache._transfer_stream.synchronize()
+            if not self.gpu_load and self.cache_entry.quantization is not None:
+                # the caller uses the model where it is stored, so it has to be stored at full precision
+                self.cache._dequantize(self.cache_entry)
+                self.cache_entry.size = calc_model_size_by_data(self.model)
 
             return self.model
 
@@ -290,15 +405,46 @@ class ModelCache(object):
                 return
 
             self.cache_entry.unlock()
+            self.cache._collect_transfers()
             if not self.cache.lazy_offloading:
                 self.cache._offload_unlocked_models()
                 self.cache._print_cuda_stats()
 
     # TODO: should it be called untrack_model?
     def uncache_model(self, cache_id: str):
+        self.generation += 1
         with suppress(ValueError):
             self._cache_stack.remove(cache_id)
-        self._cached_models.pop(cache_id, None)
+        cache_entry = self._drop_key(cache_id)
+        if cache_entry is not None and not cache_entry.keys:
+            release_compiled_graphs(cache_entry.model)
+            if cache_entry.streamer is not None:
+                cache_entry.streamer.detach()
+            self._unpin(cache_entry)
+        if self.spill_cache is not None:
+            # the model's files have changed or are gone
+            self.spill_cache.delete(cache_id)
+
+    def _drop_key(self, key: str) -> Optional[_CacheRecord]:
+        """Removes a cache key. The model is only released once no other key shares it."""
+        cache_entry = self._cached_models.pop(key, None)
+        if cache_entry is None:
+            return None
+        cache_entry.keys.discard(key)
+        if not cache_entry.keys and self._content_models.get(cache_entry.content_key) is cache_entry:
+            del self._content_models[cache_entry.content_key]
+        return cache_entry
+
+    def _get_content_key(self, model_info: ModelBase, submodel: Optional[SubModelType]) -> Optional[str]:
+        try:
+            content_key = model_info.get_content_key(submodel)
+        except Exception as e:
+            self.logger.debug(f"Could not identify the weights of {model_info.model_path}: {e}")
+            return None
+        return f"{content_key}:{self.precision}" if content_key else None
+
+    def _cache_records(self) -> List[_CacheRecord]:
+        return list({id(m): m for m in self._cached_models.values()}.values())
 
     def model_hash(
         self,
@@ -326,7 +472,7 @@ class ModelCache(object):
         cached_models = 0
         loaded_models = 0
         locked_models = 0
-        for model_info in self._cached_models.values():
+        for model_info in self._cache_records():
             cached_models += 1
             if model_info.loaded:
                 loaded_models += 1
@@ -338,7 +484,7 @@ class ModelCache(object):
         )
 
     def _cache_size(self) -> int:
-        return sum([m.size for m in self._cached_models.values()])
+        return sum([m.size for m in self._cache_records()])
 
     def _make_cache_room(self, model_size):
         # calculate how much memory this model will require
@@ -359,7 +505,13 @@ class ModelCache(object):
             model_key = self._cache_stack[pos]
             cache_entry = self._cached_models[model_key]
 
-            refs = sys.getrefcount(cache_entry.model)
+            # a shared model is as recently used as the last model that used it
+            if any(self._cache_stack.index(key) > pos for key in cache_entry.keys if key != model_key):
+                pos += 1
+                continue
+
+            # compiled graphs hold references to the model; they are released if it is evicted
+            refs = sys.getrefcount(cache_entry.model) - compiled_graph_references(cache_entry.model)
 
             # manualy clear local variable references of just finished function calls
             # for some reason python don't want to collect it even by gc.collect() immidiately
@@ -396,8 +548,21 @@ class ModelCache(object):
                 current_size -= cache_entry.size
                 if self.stats:
                     self.stats.cleared += 1
-                del self._cache_stack[pos]
-                del self._cached_models[model_key]
+                release_compiled_graphs(cache_entry.model)
+                if cache_entry.streamer is not None:
+                    cache_entry.streamer.detach()
+                self._unpin(cache_entry)
+                # quantized weights can't be restored without their scales
+                if self.spill_cache is not None and cache_entry.quantization is None:
+                    if self._transfer_stream is not None:
+                        # the weights may still be in flight into their pinned buffers
+                        self._transfer_stream.synchronize()
+                    self.spill_cache.spill(cache_entry.keys, cache_entry.model)
+                # the other keys sharing the model are all before this one
+                pos -= len(cache_entry.keys) - 1
+                for key in list(cache_entry.keys):
+                    self._cache_stack.remove(key)
+                    self._drop_key(key)
                 del cache_entry
 
             else:
@@ -412,13 +577,14 @@ class ModelCache(object):
         reserved = self.max_vram_cache_size * GIG
         vram_in_use = torch.cuda.memory_allocated()
         self.logger.debug(f"{(vram_in_use/GIG):.2f}GB VRAM used for models; max allowed={(reserved/GIG):.2f}GB")
-        for model_key, cache_entry in sorted(self._cached_models.items(), key=lambda x: x[1].size):
+        for cache_entry in sorted(self._cache_records(), key=lambda x: x.size):
+            model_key = next(iter(cache_entry.keys))
             if vram_in_use <= reserved:
                 break
             if not cache_entry.locked and cache_entry.loaded:
                 self.logger.debug(f"Offloading {model_key} from {self.execution_device} into {self.storage_device}")
                 with VRAMUsage() as mem:
-                    cache_entry.model.to(self.storage_device)
+                    self._move_to_storage(cache_entry)
                 self.logger.debug(f"GPU VRAM freed: {(mem.vram_used/GIG):.2f} GB")
                 vram_in_use += mem.vram_used  # note vram_used is negative
                 self.logger.debug(f"{(vram_in_use/GIG):.2f}GB VRAM used for models; max allowed={(reserved/GIG):.2f}GB")
@@ -426,6 +592,179 @@ class ModelCache(object):
         gc.collect()
         torch.cuda.empty_cache()
 
+    def _needs_streaming(self, cache_entry: _CacheRecord) -> bool:
+        """
+        Tells whether a model has to be streamed, because it doesn't fit in the free VRAM less the workspace
+        left to generations. A streamed model that fits again is turned back into a plain model.
+        """
+        if not self.sequential_offload or not isinstance(cache_entry.model, torch.nn.Module):
+            return False
+        free = self._free_vram()
+        if cache_entry.streamer is not None:
+            free += cache_entry.streamer.resident_size
+        elif cache_entry.loaded:
+            return False
+        if cache_entry.size + STREAMING_WORKSPACE * GIG <= free:
+            if cache_entry.streamer is not None:
+                cache_entry.streamer.detach()
+                cache_entry.streamer = None
+            return False
+        return True
+
+    def _free_vram(self) -> int:
+        # memory held by torch's allocator for reuse is free as far as models are concerned
+        free, _ = torch.cuda.mem_get_info(self.execution_device)
+        return (
+            free
+            + torch.cuda.memory_reserved(self.execution_device)
+            - torch.cuda.memory_allocated(self.execution_device)
+        )
+
+    def _stream_model(self, key: str, cache_entry: _CacheRecord):
+        """
+        Prepares a model to run with its layers streamed onto the execution device, keeping as many
+        of them resident as fit in the free VRAM, less the workspace left to generations.
+        """
+        streamer = cache_entry.streamer
+        if streamer is None:
+            streamer = cache_entry.streamer = LayerStreamer(
+                cache_entry.model, self.execution_device, self.storage_device
+            )
+        free = self._free_vram()
+        budget = free + streamer.resident_size - STREAMING_WORKSPACE * GIG
+        with VRAMUsage() as mem:
+            streamer.plan(int(budget))
+        self.logger.debug(
+            f"Streaming {key} into {self.execution_device}: {(streamer.resident_size/GIG):.2f}"
+            f"/{(streamer.size/GIG):.2f} GB resident, GPU VRAM used for load: {(mem.vram_used/GIG):.2f} GB"
+        )
+
+    def _pin(self, cache_entry: _CacheRecord):
+        """Moves the weights of a newly loaded model to pinned memory, if it fits in the budget."""
+        model = cache_entry.model
+        if not isinstance(model, torch.nn.Module) or self.max_pinned_size <= 0:
+            return
+        if self._pinned_size + cache_entry.size > self.max_pinned_size * GIG:
+            return
+        pinned = dict()
+        unpinned = []
+        with torch.no_grad():
+            try:
+                for name, t in _named_tensors(model):
+                    if t.device.type != "cpu":
+                        continue
+                    unpinned.append((t, t.data))
+                    t.data = t.data.pin_memory()
+                    pinned[name] = t.data
+            except RuntimeError as e:
+                # page-locked memory is limited by the OS (e.g. ulimit -l, or WSL), and runs out before RAM does
+                for t, data in unpinned:
+                    t.data = data
+                self.max_pinned_size = 0
+                self.logger.warning(f"Could not pin memory for fast transfers to the GPU; pinning is disabled: {e}")
+                return
+        cache_entry.pinned = pinned
+        self._pinned_size += cache_entry.size
+        self.logger.debug(f"Pinned {(cache_entry.size/GIG):.2f} GB; {(self._pinned_size/GIG):.2f} GB pinned in total")
+
+    def _unpin(self, cache_entry: _CacheRecord):
+        if cache_entry.pinned is not None:
+            cache_entry.pinned = None
+            self._pinned_size -= cache_entry.size
+
+    def _move_to_device(self, cache_entry: _CacheRecord):
+        """
+        Moves a model to the execution device. Pinned weights are copied on the transfer stream without
+        waiting for the copy: the kernels that use them are queued after it.
+        """
+        model = cache_entry.model
+        if cache_entry.pinned is None or cache_entry.streamer is not None:
+            with self._timed_transfer(cache_entry.size):
+                model.to(self.execution_device)
+            return
+
+        current = torch.cuda.current_stream(self.execution_device)
+        with torch.no_grad(), self._timed_transfer(cache_entry.size, self._transfer_stream):
+            # queued after the last copy of the model off the device, which wrote the pinned buffers
+            with torch.cuda.stream(self._transfer_stream):
+                for name, t in _named_tensors(model):
+                    pinned = cache_entry.pinned.get(name)
+                    if pinned is not None and _same_tensor(t, pinned):
+                        t.data = pinned.to(self.execution_device, non_blocking=True)
+        current.wait_stream(self._transfer_stream)
+        for _, t in _named_tensors(model):
+            if t.device == self.execution_device:
+                # allocated on the transfer stream and used on the current one
+                t.data.record_stream(current)
+        # weights added or replaced since the model was pinned
+        model.to(self.execution_device)
+
+    def _move_to_storage(self, cache_entry: _CacheRecord, quantize: bool = True):
+        """
+        Moves a model to the storage device, quantizing its weights first if so configured. The weights of
+        pinned models are copied back into their pinned buffers, without waiting for the copy.
+        """
+        if cache_entry.streamer is not None:
+            cache_entry.streamer.offload()
+        elif cache_entry.pinned is not None:
+            # the weights are copied once the kernels queued so far are done with them
+            self._transfer_stream.wait_stream(torch.cuda.current_stream(self.execution_device))
+            with torch.no_grad(), self._timed_transfer(cache_entry.size, self._transfer_stream):
+                with torch.cuda.stream(self._transfer_stream):
+                    for name, t in _named_tensors(cache_entry.model):
+                        pinned = cache_entry.pinned.get(name)
+                        if pinned is None or pinned.shape != t.shape or pinned.dtype != t.dtype:
+                            continue
+                        pinned.copy_(t.data, non_blocking=True)
+                        # keep the memory on the device until the copy is done
+                        t.data.record_stream(self._transfer_stream)
+                        t.data = pinned
+            # weights added or replaced since the model was pinned
+            cache_entry.model.to(self.storage_device)
+        elif (
+            quantize
+            and self.storage_precision != "same"
+            and cache_entry.quantization is None
+            and isinstance(cache_entry.model, torch.nn.Module)
+        ):
+            cache_entry.quantization = quantize_weights(cache_entry.model, self.storage_precision)
+            cache_entry.size = calc_model_size_by_data(cache_entry.model)
+            with self._timed_transfer(cache_entry.size):
+                cache_entry.model.to(self.storage_device)
+        else:
+            with self._timed_transfer(cache_entry.size):
+                cache_entry.model.to(self.storage_device)
+
+    @contextmanager
+    def _timed_transfer(self, size: int, stream: Optional[torch.cuda.Stream] = None):
+        """Times the copies queued on `stream` (the current one by default) within the block, without waiting."""
+        if not self._has_cuda() or self.stats is None:
+            yield
+            return
+        stream = stream or torch.cuda.current_stream(self.execution_device)
+        start = torch.cuda.Event(enable_timing=True)
+        end = torch.cuda.Event(enable_timing=True)
+        start.record(stream)
+        yield
+        end.record(stream)
+        self._pending_transfers.append((self.stats, start, end, size))
+
+    def _collect_transfers(self):
+        """Adds the transfers that have completed to the stats they were made for."""
+        pending = list()
+        for stats, start, end, size in self._pending_transfers:
+            if not end.query():
+                pending.append((stats, start, end, size))
+                continue
+            stats.transferred += size
+            stats.transfer_time += start.elapsed_time(end) / 1000
+        self._pending_transfers = pending
+
+    def _dequantize(self, cache_entry: _CacheRecord):
+        if cache_entry.quantization is not None:
+            dequantize_weights(cache_entry.model, cache_entry.quantization)
+            cache_entry.quantization = None
+
     def _local_model_hash(self, model_path: Union[str, Path]) -> str:
         sha = hashlib.sha256()
         path = Path(model_path)
@@ -168,6 +168,13 @@ structure at initialization time by scanning the models directory. The
 in-memory data structure can be resynchronized by calling
 `manager.scan_models_directory()`.
 
+When `get_model()` is asked for a model that isn't known, the
+folder for its base and type and the autoimport paths are rescanned,
+so that files pasted in since startup are found. Only folders whose
+modification times changed since they were last scanned are rescanned,
+and a name that still isn't found is reported missing without checking
+again for `MISSING_MODEL_TTL` seconds.
+
 Files and folders placed inside the `autoimport` paths (paths
 defined in `invokeai.yaml`) will also be scanned for new models at
 initialization time and added to `models.yaml`. Files will not be
@@ -228,9 +235,10 @@ the root is the InvokeAI ROOTDIR.
 """
 from __future__ import annotations
 
-import hashlib
 import os
 import textwrap
+import threading
+import time
 import types
 from dataclasses import dataclass
 from pathlib import Path
@@ -246,8 +254,10 @@ from pydantic import BaseModel, Field
 import invokeai.backend.util.logging as logger
 from invokeai.app.services.config import InvokeAIAppConfig
 from invokeai.backend.util import CUDA_DEVICE, Chdir
+from .convert_cache import ModelConvertCache
 from .model_cache import ModelCache, ModelLocker
 from .model_search import ModelSearch
+from .spill_cache import ModelSpillCache
 from .models import (
     BaseModelType,
     ModelType,
@@ -267,6 +277,16 @@ from .models import (
 # reduce confusion.
 CONFIG_FILE_VERSION = "3.0.0"
 
+# Seconds for which a model that was looked up and not found is reported missing without checking the disk
+MISSING_MODEL_TTL = 10.0
+
+# A directory modified this recently (in seconds) may change again without its mtime changing, on
+# filesystems with coarse timestamps, so it is rescanned until it has been left alone for longer
+MTIME_GRANULARITY = 2.0
+
+# The mtimes of a set of directories, or None if they must be rescanned regardless
+DirectorySignature = Optional[Tuple[Tuple[str, int], ...]]
+
 
 @dataclass
 class ModelInfo:
@@ -306,6 +326,7 @@ class ModelManager(object):
     """
 
     logger: types.ModuleType = logger
+    missing_model_ttl: float = MISSING_MODEL_TTL
 
     def __init__(
         self,
@@ -343,11 +364,32 @@ class ModelManager(object):
             max_cache_size=max_cache_size,
             max_vram_cache_size=self.app_config.vram_cache_size,
             lazy_offloading=self.app_config.lazy_offload,
+            storage_precision=self.app_config.storage_precision,
+            max_pinned_size=self.app_config.pinned_cache_size,
+            spill_cache=ModelSpillCache(
+                spill_path=self.app_config.spill_path,
+                max_size=self.app_config.spill_cache_size,
+                logger=logger,
+            )
+            if self.app_config.spill_cache_size > 0
+            else None,
             execution_device=device_type,
             precision=precision,
             sequential_offload=sequential_offload,
             logger=logger,
         )
+        self.convert_cache = ModelConvertCache(
+            cache_path=self.resolve_model_path(".cache"),
+            max_size=self.app_config.convert_cache_size,
+            logger=logger,
+        )
+
+        # held while scanning, so that concurrent lookups of a missing model trigger a single rescan
+        self._scan_lock = threading.RLock()
+        self._missing_models: Dict[str, float] = dict()
+        self._scanned_signatures: Dict[str, DirectorySignature] = dict()
+        # incremented whenever the model configuration is changed or reread
+        self._config_generation = 0
 
         self._read_models(config)
 
@@ -358,6 +400,7 @@ class ModelManager(object):
             else:
                 return
 
+        self._config_generation += 1
         self.models = dict()
         for model_key, model_config in config.items():
             if model_key.startswith("_"):
@@ -370,6 +413,8 @@ class ModelManager(object):
 
         # check config version number and update on disk/RAM if necessary
         self.cache_keys = dict()
+        self._missing_models = dict()
+        self._scanned_signatures = dict()
 
         # add controlnet, lora and textual_inversion models from disk
         self.scan_models_directory()
@@ -390,17 +435,70 @@ class ModelManager(object):
         :param model_name: symbolic name of the model in models.yaml
         :param model_type: ModelType enum indicating the type of model to return
         :param base_model: BaseModelType enum indicating the base model used by this model
-        :param rescan: if True, scan_models_directory
+        :param rescan: if True and the model isn't known, rescan the folders that may
+               have received it since they were last scanned
         """
         model_key = self.create_key(model_name, base_model, model_type)
-        exists = model_key in self.models
+        if model_key in self.models:
+            return True
+        if not rescan or self._recently_missing(model_key):
+            return False
 
         # if model not found try to find it (maybe file just pasted)
-        if rescan and not exists:
-            self.scan_models_directory(base_model=base_model, model_type=model_type)
-            exists = self.model_exists(model_name, base_model, model_type, rescan=False)
+        with self._scan_lock:
+            # a scan by another thread may have settled it while this one waited
+            if model_key in self.models:
+                return True
+            if self._recently_missing(model_key):
+                return False
+
+            models_dir = self.resolve_model_path(Path(BaseModelType(base_model).value, ModelType(model_type).value))
+            models_dir_changed = self._signature_changed(str(models_dir), self._get_signature([models_dir]))
+            autoimport_changed = self._signature_changed(
+                "autoimport", self._get_signature(self._get_autoimport_directories(), recursive=True)
+            )
+            if models_dir_changed or autoimport_changed:
+                self.scan_models_directory(base_model=base_model, model_type=model_type, autoimport=autoimport_changed)
 
-        return exists
+            exists = model_key in self.models
+            if exists:
+                self._missing_models.pop(model_key, None)
+            else:
+                now = time.monotonic()
+                self._missing_models = {
+                    k: t for k, t in self._missing_models.items() if now - t < self.missing_model_ttl
+                }
+                self._missing_models[model_key] = now
+            return exists
+
+    def _recently_missing(self, model_key: str) -> bool:
+        missed_at = self._missing_models.get(model_key)
+        return missed_at is not None and time.monotonic() - missed_at < self.missing_model_ttl
+
+    def _get_signature(self, directories: List[Path], recursive: bool = False) -> DirectorySignature:
+        """
+        Gets the mtimes of `directories` and, if `recursive`, of the directories below them. A directory's
+        mtime changes when entries are added to it, removed or renamed.
+        """
+        signature = []
+        newest = 0
+        for directory in sorted(directories):
+            walk = os.walk(directory, followlinks=True) if recursive else [(str(directory), [], [])]
+            for root, dirs, _ in walk:
+                # hidden directories are skipped by the autoimport search too
+                dirs[:] = [d for d in dirs if not d.startswith(".")]
+                try:
+                    mtime = os.stat(root).st_mtime_ns
+                except OSError:
+                    mtime = -1
+                newest = max(newest, mtime)
+                signature.append((root, mtime))
+        if time.time_ns() - newest < MTIME_GRANULARITY * 1e9:
+            return None
+        return tuple(signature)
+
+    def _signature_changed(self, key: str, signature: DirectorySignature) -> bool:
+        return signature is None or self._scanned_signatures.get(key) != signature
 
     @classmethod
     def create_key(
@@ -430,8 +528,30 @@ class ModelManager(object):
 
         return (model_name, base_model, model_type)
 
-    def _get_model_cache_path(self, model_path):
-        return self.resolve_model_path(Path(".cache") / hashlib.md5(str(model_path).encode()).hexdigest())
+    def _get_model_cache_path(
+        self,
+        model_path: Path,
+        base_model: BaseModelType,
+        model_type: ModelType,
+        model_config: ModelConfigBase,
+    ) -> Path:
+        # the converted model depends on the checkpoint's contents and on the config file it is converted with
+        return self.convert_cache.get_cache_path(
+            model_path,
+            base_model=base_model.value,
+            model_type=model_type.value,
+            config=getattr(model_config, "config", None),
+        )
+
+    def _delete_model_cache(
+        self,
+        model_path: Path,
+        base_model: BaseModelType,
+        model_type: ModelType,
+        model_config: ModelConfigBase,
+    ):
+        if model_path.exists():
+            self.convert_cache.delete(self._get_model_cache_path(model_path, base_model, model_type, model_config))
 
     @classmethod
     def initialize_model_config(cls, config_path: Path):
@@ -478,16 +598,16 @@ class ModelManager(object):
                 self.models.pop(model_key, None)
                 raise ModelNotFoundException(f'Files for model "{model_key}" not found at {model_path}')
 
-        # TODO: path
-        # TODO: is it accurate to use path as id
-        dst_convert_path = self._get_model_cache_path(model_path)
+        dst_convert_path = self._get_model_cache_path(model_path, base_model, model_type, model_config)
 
+        source_path = model_path
         model_path = model_class.convert_if_required(
             base_model=base_model,
             model_path=str(model_path),  # TODO: refactor str/Path types logic
             output_path=dst_convert_path,
             config=model_config,
         )
+        self.convert_cache.record_use(model_path, source=source_path)
 
         model_context = self.cache.get_model(
             model_path=model_path,
@@ -563,6 +683,14 @@ class ModelManager(object):
         instance = constructor(model_path, base_model, model_type)
         return instance
 
+    @property
+    def generation(self) -> int:
+        """
+        Changes whenever models are added, changed, removed or uncached, so that results
+        computed with the models can be discarded.
+        """
+        return self._config_generation + self.cache.generation
+
     def model_info(
         self,
         model_name: str,
@@ -677,9 +805,7 @@ class ModelManager(object):
 
         # if model inside invoke models folder - delete files
         model_path = self.resolve_model_path(model_cfg.path)
-        cache_path = self._get_model_cache_path(model_path)
-        if cache_path.exists():
-            rmtree(str(cache_path))
+        self._delete_model_cache(model_path, base_model, model_type, model_cfg)
 
         if model_path.is_relative_to(self.app_config.models_path):
             if model_path.is_dir():
@@ -724,12 +850,7 @@ class ModelManager(object):
 
             # remove conversion cache as config changed
             old_model_path = self.resolve_model_path(old_model.path)
-            old_model_cache = self._get_model_cache_path(old_model_path)
-            if old_model_cache.exists():
-                if old_model_cache.is_dir():
-                    rmtree(str(old_model_cache))
-                else:
-                    old_model_cache.unlink()
+            self._delete_model_cache(old_model_path, base_model, model_type, old_model)
 
             # remove in-memory cache
             # note: it not guaranteed to release memory(model can has other references)
@@ -786,13 +907,10 @@ class ModelManager(object):
             move(old_path, new_path)
             model_cfg.path = str(new_path.relative_to(self.app_config.models_path))
 
-        # clean up caches
-        old_model_cache = self._get_model_cache_path(old_path)
-        if old_model_cache.exists():
-            if old_model_cache.is_dir():
-                rmtree(str(old_model_cache))
-            else:
-                old_model_cache.unlink()
+        # clean up caches; converted models are keyed by the checkpoint's contents, so they are still valid
+        # once moved, unless the model was rebased
+        if new_base != base_model:
+            self._delete_model_cache(self.resolve_model_path(model_cfg.path), base_model, model_type, model_cfg)
 
         cache_ids = self.cache_keys.pop(model_key, [])
         for cache_id in cache_ids:
@@ -827,18 +945,26 @@ class ModelManager(object):
         if info["model_format"] != "checkpoint":
             raise ValueError(f"not a checkpoint format model: {model_name}")
 
-        # We are taking advantage of a side effect of get_model() that converts check points
-        # into cached diffusers directories stored at `location`. It doesn't matter
-        # what submodeltype we request here, so we get the smallest.
-        submodel = {"submodel_type": SubModelType.Scheduler} if model_type == ModelType.Main else {}
-        model = self.get_model(
-            model_name,
-            base_model,
-            model_type,
-            **submodel,
-        )
         checkpoint_path = self.resolve_model_path(info["path"])
-        old_diffusers_path = self.resolve_model_path(model.location)
+        if model_type == ModelType.Main:
+            # The cached copy of a main model may be a map to the weights of the checkpoint,
+            # so convert the checkpoint in full.
+            model_class = self._get_implementation(base_model, model_type)
+            model_config = self._get_model_config(base_model, model_name, model_type)
+            old_diffusers_path = Path(
+                model_class.convert_if_required(
+                    base_model=base_model,
+                    model_path=str(checkpoint_path),
+                    output_path=self._get_model_cache_path(checkpoint_path, base_model, model_type, model_config),
+                    config=model_config,
+                    direct=False,
+                )
+            )
+        else:
+            # We are taking advantage of a side effect of get_model() that converts check points
+            # into cached diffusers directories stored at `location`.
+            model = self.get_model(model_name, base_model, model_type)
+            old_diffusers_path = self.resolve_model_path(model.location)
         new_diffusers_path = (
             dest_directory or self.app_config.models_path / base_model.value / model_type.value
         ) / model_name
@@ -897,6 +1023,7 @@ class ModelManager(object):
         """
         Write current configuration out to the indicated file.
         """
+        self._config_generation += 1
         data_to_save = dict()
         data_to_save["__metadata__"] = self.config_meta.dict()
 
@@ -943,6 +1070,22 @@ class ModelManager(object):
         self,
         base_model: Optional[BaseModelType] = None,
         model_type: Optional[ModelType] = None,
+        autoimport: bool = True,
+    ):
+        """
+        Add the models found in the models directory, and remove the ones whose files are gone.
+        :param base_model: only scan the folders of this base model
+        :param model_type: only scan the folders of this model type
+        :param autoimport: also scan the autoimport paths and import the models found there
+        """
+        with self._scan_lock:
+            self._scan_models_directory(base_model, model_type, autoimport)
+
+    def _scan_models_directory(
+        self,
+        base_model: Optional[BaseModelType],
+        model_type: Optional[ModelType],
+        autoimport: bool,
     ):
         loaded_files = set()
         new_models_found = False
@@ -978,6 +1121,8 @@ class ModelManager(object):
                         continue
                     model_class = self._get_implementation(cur_base_model, cur_model_type)
                     models_dir = self.resolve_model_path(Path(cur_base_model.value, cur_model_type.value))
+                    # taken before listing the folder, so that anything added during the scan is picked up next time
+                    self._scanned_signatures[str(models_dir)] = self._get_signature([models_dir])
 
                     if not models_dir.exists():
                         continue  # TODO: or create all folders?
@@ -1004,7 +1149,12 @@ class ModelManager(object):
                             except NotImplementedError as e:
                                 self.logger.warning(e)
 
-        imported_models = self.scan_autoimport_directory()
+        imported_models = dict()
+        if autoimport:
+            self._scanned_signatures["autoimport"] = self._get_signature(
+                self._get_autoimport_directories(), recursive=True
+            )
+            imported_models = self.scan_autoimport_directory()
         if (new_models_found or imported_models) and self.config_path:
             self.commit()
 
@@ -1037,8 +1187,6 @@ class ModelManager(object):
             def models_found(self):
                 return self.new_models_found
 
-        config = self.app_config
-
         # LS: hacky
         # Patch in the SD VAE from core so that it is available for use by the UI
         try:
@@ -1052,30 +1200,36 @@ class ModelManager(object):
             prediction_type_helper=ask_user_for_prediction_type,
         )
         known_paths = {self.resolve_model_path(x["path"]) for x in self.list_models()}
-        directories = {
+        directories = self._get_autoimport_directories()
+        scanner = ScanAndImport(directories, self.logger, ignore=known_paths, installer=installer)
+        scanner.search()
+
+        return scanner.models_found()
+
+    def _get_autoimport_directories(self) -> List[Path]:
+        config = self.app_config
+        return [
             config.root_path / x
-            for x in [
+            for x in {
                 config.autoimport_dir,
                 config.lora_dir,
                 config.embedding_dir,
                 config.controlnet_dir,
-            ]
+            }
             if x
-        }
-        scanner = ScanAndImport(directories, self.logger, ignore=known_paths, installer=installer)
-        scanner.search()
-
-        return scanner.models_found()
+        ]
 
     def heuristic_import(
         self,
         items_to_import: Set[str],
         prediction_type_helper: Optional[Callable[[Path], SchedulerPredictionType]] = None,
+        progress_callback: Optional[Callable[[str, int, int], None]] = None,
     ) -> Dict[str, AddModelResult]:
         """Import a list of paths, repo_ids or URLs. Returns the set of
         successfully imported items.
         :param items_to_import: Set of strings corresponding to models to be imported.
         :param prediction_type_helper: A callback that receives the Path of a Stable Diffusion 2 checkpoint model and returns a SchedulerPredictionType.
+        :param progress_callback: A callback that receives the file name, bytes downloaded and total bytes as downloads progress.
 
         The prediction type helper is necessary to distinguish between
         models based on Stable Diffusion 2 Base (requiring
@@ -1098,7 +1252,10 @@ class ModelManager(object):
         successfully_installed = dict()
 
         installer = ModelInstall(
-            config=self.app_config, prediction_type_helper=prediction_type_helper, model_manager=self
+            config=self.app_config,
+            prediction_type_helper=prediction_type_helper,
+            model_manager=self,
+            progress_callback=progress_callback,
         )
         for thing in items_to_import:
             installed = installer.heuristic_import(thing)
@@ -1,10 +1,14 @@
+import hashlib
 import json
 import os
+import struct
 import sys
+import threading
 import typing
 import inspect
 import warnings
 from abc import ABCMeta, abstractmethod
+from collections import defaultdict
 from contextlib import suppress
 from enum import Enum
 from pathlib import Path
@@ -14,7 +18,7 @@ import torch
 import numpy as np
 import onnx
 import safetensors.torch
-from diffusers import DiffusionPipeline, ConfigMixin
+from diffusers import DiffusionPipeline, ConfigMixin, ModelMixin
 from onnx import numpy_helper
 from onnxruntime import (
     InferenceSession,
@@ -22,10 +26,28 @@ from onnxruntime import (
     get_available_providers,
 )
 from pydantic import BaseModel, Field
-from typing import List, Dict, Optional, Type, Literal, TypeVar, Generic, Callable, Any, Union
+from typing import List, Dict, Optional, Type, Literal, TypeVar, Generic, Callable, Any, Union, Tuple
 from diffusers import logging as diffusers_logging
 from transformers import logging as transformers_logging
 
+from ..convert_cache import checkpoint_hash
+
+
+# Written in place of the weights of a diffusers model that is loaded straight from a checkpoint: maps each
+# weight of its models to the tensor of the checkpoint it is taken from
+CHECKPOINT_KEY_MAP = "checkpoint_key_map.json"
+
+# The weights of a model loaded from a checkpoint that are computed, rather than taken from the checkpoint
+COMPUTED_WEIGHTS = "computed_weights.safetensors"
+
+# Files of a model up to this size are read on every lookup to identify its contents; the hashes of
+# larger ones are remembered until the file changes
+CONTENT_KEY_FULL_READ_SIZE = 4194304
+
+# (path, what was hashed) -> the size, mtime and hash of the file, so that weights are only read once
+_file_hashes: Dict[Tuple[str, str], Tuple[int, int, str]] = dict()
+_file_hashes_lock = threading.Lock()
+
 
 class DuplicateModelException(Exception):
     pass
@@ -231,6 +253,14 @@ class ModelBase(metaclass=ABCMeta):
     ) -> Any:
         raise NotImplementedError()
 
+    def get_content_key(self, child_type: Optional[SubModelType] = None) -> Optional[str]:
+        """
+        Identifies the weights of a model before it is loaded, so that models with identical
+        weights can share one instance in the RAM cache. Returns None if they can't be identified
+        without loading the model.
+        """
+        return None
+
 
 class DiffusersModel(ModelBase):
     # child_types: Dict[str, Type]
@@ -250,13 +280,20 @@ class DiffusersModel(ModelBase):
 
         config_data.pop("_ignore_files", None)
 
+        # a model mapped from a checkpoint has no weights of its own
+        self.checkpoint_key_map = read_checkpoint_key_map(self.model_path)
+        mapped_models = self.checkpoint_key_map["models"] if self.checkpoint_key_map else dict()
+
         # retrieve all folder_names that contain relevant files
         child_components = [k for k, v in config_data.items() if isinstance(v, list)]
 
         for child_name in child_components:
             child_type = self._hf_definition_to_type(config_data[child_name])
             self.child_types[child_name] = child_type
-            self.child_sizes[child_name] = calc_model_size_by_fs(self.model_path, subfolder=child_name)
+            if child_name in mapped_models:
+                self.child_sizes[child_name] = mapped_models[child_name]["size"]
+            else:
+                self.child_sizes[child_name] = calc_model_size_by_fs(self.model_path, subfolder=child_name)
 
     def get_size(self, child_type: Optional[SubModelType] = None):
         if child_type is None:
@@ -275,6 +312,58 @@ class DiffusersModel(ModelBase):
         if child_type not in self.child_types:
             return None  # TODO: or raise
 
+        # the map is gone if the checkpoint has since been converted in full, and is
+        # updated when the checkpoint is moved, so it is read again on every load
+        self.checkpoint_key_map = read_checkpoint_key_map(self.model_path)
+        if self.checkpoint_key_map is not None and child_type.value in self.checkpoint_key_map["models"]:
+            model = self._load_from_checkpoint(child_type, torch_dtype)
+        else:
+            model = self._load_from_pretrained(child_type, torch_dtype)
+
+        # calc more accurate size
+        self.child_sizes[child_type] = calc_model_size_by_data(model)
+        return model
+
+    def get_content_key(self, child_type: Optional[SubModelType] = None) -> Optional[str]:
+        """
+        Fine-tunes often share the text encoders and VAE of their base model, so identical
+        submodels of different models are loaded once. They are identified by their configs and
+        a hash of their weights: the weight files of a diffusers folder, or the tensors of the
+        checkpoint a mapped model is read from. The hashes are remembered by path, size and
+        mtime, so weights are only read again when they change.
+        """
+        if child_type is None or child_type not in self.child_types:
+            return None
+        subfolder = Path(self.model_path, child_type.value)
+        if not subfolder.is_dir():
+            return None
+
+        blake = hashlib.blake2b(self.child_types[child_type].__name__.encode(), digest_size=16)
+        for path in sorted(subfolder.rglob("*")):
+            if not path.is_file():
+                continue
+            blake.update(str(path.relative_to(subfolder)).encode())
+            if path.stat().st_size > CONTENT_KEY_FULL_READ_SIZE:
+                blake.update(_memoized_file_hash(path, "", lambda: checkpoint_hash(path)).encode())
+            else:
+                blake.update(path.read_bytes())
+
+        key_map = read_checkpoint_key_map(self.model_path)
+        if key_map is not None and child_type.value in key_map["models"]:
+            weights = key_map["models"][child_type.value]["weights"]
+            blake.update(json.dumps(weights, sort_keys=True).encode())
+            keys = sorted({entry["key"] for entry in weights.values()})
+            checkpoint = key_map["checkpoint"]
+            blake.update(
+                _memoized_file_hash(
+                    checkpoint,
+                    hashlib.blake2b(json.dumps(keys).encode(), digest_size=16).hexdigest(),
+                    lambda: _hash_safetensors_tensors(checkpoint, keys),
+                ).encode()
+            )
+        return blake.hexdigest()
+
+    def _load_from_pretrained(self, child_type: SubModelType, torch_dtype: Optional[torch.dtype]):
         if torch_dtype == torch.float16:
             variants = ["fp16", None]
         else:
@@ -299,14 +388,113 @@ class DiffusersModel(ModelBase):
                 pass
         else:
             raise Exception(f"Failed to load {self.base_model}:{self.model_type}:{child_type} model")
-
-        # calc more accurate size
-        self.child_sizes[child_type] = calc_model_size_by_data(model)
         return model
 
+    def _load_from_checkpoint(self, child_type: SubModelType, torch_dtype: Optional[torch.dtype]) -> torch.nn.Module:
+        """
+        Builds a model from its config, and reads its weights one at a time from the memory-mapped checkpoint
+        the model was mapped from.
+        """
+        from accelerate import init_empty_weights
+        from accelerate.utils import set_module_tensor_to_device
+
+        model_class = self.child_types[child_type]
+        subfolder = os.path.join(self.model_path, child_type.value)
+        with init_empty_weights():
+            if issubclass(model_class, ModelMixin):
+                model = model_class.from_config(model_class.load_config(subfolder))
+            else:
+                model = model_class(model_class.config_class.from_pretrained(subfolder))
+
+        # several weights can be views of one tensor, e.g. the query, key and value projections of OpenCLIP
+        weights_by_key = defaultdict(list)
+        for name, entry in self.checkpoint_key_map["models"][child_type.value]["weights"].items():
+            weights_by_key[entry["key"]].append((name, entry))
+
+        with safetensors.safe_open(self.checkpoint_key_map["checkpoint"], framework="pt", device="cpu") as checkpoint:
+            for key, weights in weights_by_key.items():
+                tensor = checkpoint.get_tensor(key)
+                for name, entry in weights:
+                    value = tensor
+                    if "offset" in entry:
+                        offset = tensor.storage_offset() + entry["offset"]
+                        value = tensor.as_strided(entry["shape"], entry["stride"], offset).contiguous()
+                    set_module_tensor_to_device(model, name, "cpu", value=value, dtype=torch_dtype)
+
+        computed_path = os.path.join(subfolder, COMPUTED_WEIGHTS)
+        if os.path.exists(computed_path):
+            for name, value in safetensors.torch.load_file(computed_path, device="cpu").items():
+                set_module_tensor_to_device(model, name, "cpu", value=value, dtype=torch_dtype)
+
+        missing = [name for name, param in model.named_parameters() if param.device.type == "meta"]
+        if missing:
+            raise Exception(
+                f"The checkpoint map at {self.model_path} doesn't cover {', '.join(missing[:5])}; delete it to remap"
+            )
+
+        if torch_dtype is not None:
+            model.to(torch_dtype)
+        return model.eval()
+
     # def convert_if_required(model_path: str, cache_path: str, config: Optional[dict]) -> str:
 
 
+def _memoized_file_hash(path: Union[str, Path], part: str, compute: Callable[[], str]) -> str:
+    """
+    Returns the hash that `compute` makes of `part` of the file at `path`, computing it again only
+    when the size or mtime of the file changes.
+    """
+    stat = os.stat(path)
+    key = (str(path), part)
+    with _file_hashes_lock:
+        known = _file_hashes.get(key)
+    if known is not None and known[:2] == (stat.st_size, stat.st_mtime_ns):
+        return known[2]
+
+    content = compute()
+    with _file_hashes_lock:
+        _file_hashes[key] = (stat.st_size, stat.st_mtime_ns, content)
+    return content
+
+
+def _hash_safetensors_tensors(checkpoint_path: Union[str, Path], keys: List[str]) -> str:
+    """Hashes the dtype, shape and data of some tensors of a safetensors file."""
+    blake = hashlib.blake2b(digest_size=16)
+    with open(checkpoint_path, "rb") as f:
+        (header_size,) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(header_size))
+        for key in keys:
+            tensor = header[key]
+            start, end = tensor["data_offsets"]
+            blake.update(f"{key}:{tensor['dtype']}:{tensor['shape']}".encode())
+            f.seek(8 + header_size + start)
+            remaining = end - start
+            while remaining > 0:
+                chunk = f.read(min(remaining, 2**20))
+                if not chunk:
+                    break
+                blake.update(chunk)
+                remaining -= len(chunk)
+    return blake.hexdigest()
+
+
+def read_checkpoint_key_map(model_path: Union[str, Path]) -> Optional[dict]:
+    """Reads the checkpoint key map of a diffusers model, or returns None if its weights are its own."""
+    key_map_path = os.path.join(model_path, CHECKPOINT_KEY_MAP)
+    if not os.path.exists(key_map_path):
+        return None
+    with open(key_map_path, "r") as f:
+        return json.load(f)
+
+
+def write_checkpoint_key_map(model_path: Union[str, Path], key_map: dict) -> None:
+    """Writes the checkpoint key map of a diffusers model, replacing the old one at once."""
+    key_map_path = os.path.join(model_path, CHECKPOINT_KEY_MAP)
+    with open(key_map_path + ".tmp", "w") as f:
+        json.dump(key_map, f)
+    os.replace(key_map_path + ".tmp", key_map_path)
+
+
 def calc_model_size_by_fs(model_path: str, subfolder: Optional[str] = None, variant: Optional[str] = None):
     if subfolder is not None:
         model_path = os.path.join(model_path, subfolder)
@@ -18,6 +18,7 @@ from .base import (
 )
 from invokeai.app.services.config import InvokeAIAppConfig
 import invokeai.backend.util.logging as logger
+from ..convert_cache import staging_path
 
 
 class ControlNetModelFormat(str, Enum):
@@ -148,12 +149,13 @@ def _convert_controlnet_ckpt_and_cache(
     # to avoid circular import errors
     from ..convert_ckpt_to_diffusers import convert_controlnet_to_diffusers
 
-    convert_controlnet_to_diffusers(
-        weights,
-        output_path,
-        original_config_file=app_config.root_path / model_config,
-        image_size=512,
-        scan_needed=True,
-        from_safetensors=weights.suffix == ".safetensors",
-    )
+    with staging_path(output_path) as staging:
+        convert_controlnet_to_diffusers(
+            weights,
+            staging,
+            original_config_file=app_config.root_path / model_config,
+            image_size=512,
+            scan_needed=True,
+            from_safetensors=weights.suffix == ".safetensors",
+        )
     return output_path
@@ -1,12 +1,17 @@
 import bisect
+import json
 import os
+import threading
+from collections.abc import Mapping
 from enum import Enum
 from pathlib import Path
-from typing import Dict, Optional, Union
+from typing import Dict, Iterator, Optional, Type, Union
 
 import torch
+from safetensors import safe_open
 from safetensors.torch import load_file
 
+from ..convert_cache import staging_path
 from .base import (
     BaseModelType,
     InvalidModelException,
@@ -18,6 +23,9 @@ from .base import (
     classproperty,
 )
 
+# The index of the layers of a safetensors LoRA, written to the conversion cache
+LORA_KEY_INDEX = "lora_key_index.json"
+
 
 class LoRAModelFormat(str, Enum):
     LyCORIS = "lycoris"
@@ -34,7 +42,12 @@ class LoRAModel(ModelBase):
         assert model_type == ModelType.Lora
         super().__init__(model_path, base_model, model_type)
 
-        self.model_size = os.path.getsize(self.model_path)
+        # a safetensors LoRA is represented by the index of its layers, see convert_if_required()
+        self.key_index = read_lora_key_index(self.model_path)
+        if self.key_index is not None:
+            self.model_size = self.key_index["size"]
+        else:
+            self.model_size = os.path.getsize(self.model_path)
 
     def get_size(self, child_type: Optional[SubModelType] = None):
         if child_type is not None:
@@ -49,11 +62,17 @@ class LoRAModel(ModelBase):
         if child_type is not None:
             raise Exception("There is no child models in lora")
 
-        model = LoRAModelRaw.from_checkpoint(
-            file_path=self.model_path,
-            dtype=torch_dtype,
-            base_model=self.base_model,
-        )
+        if self.key_index is not None:
+            model = LoRAModelRaw.from_key_index(
+                key_index=self.key_index,
+                dtype=torch_dtype,
+            )
+        else:
+            model = LoRAModelRaw.from_checkpoint(
+                file_path=self.model_path,
+                dtype=torch_dtype,
+                base_model=self.base_model,
+            )
 
         self.model_size = model.calc_size()
         return model
@@ -88,10 +107,78 @@ class LoRAModel(ModelBase):
         if cls.detect_format(model_path) == LoRAModelFormat.Diffusers:
             # TODO: add diffusers lora when it stabilizes a bit
             raise NotImplementedError("Diffusers lora not supported")
+        elif model_path.endswith(".safetensors"):
+            return _index_lora_and_cache(model_path, output_path, base_model)
         else:
             return model_path
 
 
+def _index_lora_and_cache(model_path: str, output_path: str, base_model: BaseModelType) -> str:
+    """
+    Writes the index of the layers of a safetensors LoRA to the conversion cache, and returns its
+    path. The index groups the keys of the file by layer, with the SDXL keys already converted to
+    diffusers format, so that loading the LoRA only has to read the tensors of each layer.
+    """
+    lora_path = str(Path(model_path).resolve())
+    output_path = Path(output_path)
+
+    key_index = read_lora_key_index(output_path)
+    if key_index is not None:
+        # the cache is keyed by the LoRA's contents, so the same file may have moved
+        if key_index["lora"] != lora_path:
+            key_index["lora"] = lora_path
+            write_lora_key_index(output_path, key_index)
+        return str(output_path)
+
+    with safe_open(lora_path, framework="pt", device="cpu") as f:
+        numels = {key: _numel(f.get_slice(key).get_shape()) for key in f.keys()}
+
+    layers = LoRAModelRaw._group_state({key: key for key in numels})
+    if base_model == BaseModelType.StableDiffusionXL:
+        layers = LoRAModelRaw._convert_sdxl_keys_to_diffusers_format(layers)
+    for layer_key, tensor_keys in layers.items():
+        # fail now rather than when the layer is first used
+        _get_layer_class(layer_key, tensor_keys)
+
+    with staging_path(output_path) as staging:
+        staging.mkdir()
+        write_lora_key_index(
+            staging,
+            {
+                "lora": lora_path,
+                "size": os.path.getsize(lora_path),
+                "layers": {
+                    layer_key: {"keys": tensor_keys, "numel": sum(numels[key] for key in tensor_keys.values())}
+                    for layer_key, tensor_keys in layers.items()
+                },
+            },
+        )
+    return str(output_path)
+
+
+def read_lora_key_index(model_path: Union[str, Path]) -> Optional[dict]:
+    """Reads the index of the layers of a LoRA, or returns None if `model_path` is the LoRA itself."""
+    key_index_path = os.path.join(model_path, LORA_KEY_INDEX)
+    if not os.path.exists(key_index_path):
+        return None
+    with open(key_index_path, "r") as f:
+        return json.load(f)
+
+
+def write_lora_key_index(model_path: Union[str, Path], key_index: dict) -> None:
+    key_index_path = os.path.join(model_path, LORA_KEY_INDEX)
+    with open(key_index_path + ".tmp", "w") as f:
+        json.dump(key_index, f)
+    os.replace(key_index_path + ".tmp", key_index_path)
+
+
+def _numel(shape) -> int:
+    numel = 1
+    for dim in shape:
+        numel *= dim
+    return numel
+
+
 class LoRALayerBase:
     # rank: Optional[int]
     # alpha: Optional[float]
@@ -436,17 +523,108 @@ class IA3Layer(LoRALayerBase):
         self.on_input = self.on_input.to(device=device, dtype=dtype)
 
 
+def _get_layer_class(layer_key: str, values: dict) -> Type[LoRALayerBase]:
+    """Picks the layer implementation from the names of the layer's tensors."""
+    # lora and locon
+    if "lora_down.weight" in values:
+        return LoRALayer
+
+    # loha
+    elif "hada_w1_b" in values:
+        return LoHALayer
+
+    # lokr
+    elif "lokr_w1_b" in values or "lokr_w1" in values:
+        return LoKRLayer
+
+    # diff
+    elif "diff" in values:
+        return FullLayer
+
+    # ia3
+    elif "weight" in values and "on_input" in values:
+        return IA3Layer
+
+    else:
+        print(f">> Encountered unknown lora layer module: {layer_key} - {list(values.keys())}")
+        raise Exception("Unknown lora format!")
+
+
+class LazyLoRALayers(Mapping):
+    """
+    The layers of a safetensors LoRA, read from the memory-mapped file when each one is first used.
+    Iterating over the keys doesn't read anything.
+    """
+
+    def __init__(
+        self,
+        file_path: str,
+        layers_index: Dict[str, dict],
+        device: torch.device,
+        dtype: torch.dtype,
+    ):
+        self._file_path = file_path
+        self._layers_index = layers_index
+        self._device = device
+        self._dtype = dtype
+        self._layers: Dict[str, LoRALayerBase] = dict()
+        self._file = None
+        self._lock = threading.Lock()
+
+    def __getitem__(self, layer_key: str) -> LoRALayerBase:
+        layer = self._layers.get(layer_key)
+        if layer is not None:
+            return layer
+
+        tensor_keys = self._layers_index[layer_key]["keys"]
+        with self._lock:
+            if layer_key not in self._layers:
+                if self._file is None:
+                    self._file = safe_open(self._file_path, framework="pt", device="cpu")
+                values = {leaf: self._file.get_tensor(key) for leaf, key in tensor_keys.items()}
+                layer = _get_layer_class(layer_key, values)(layer_key, values)
+                layer.to(device=self._device, dtype=self._dtype)
+                self._layers[layer_key] = layer
+            return self._layers[layer_key]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._layers_index)
+
+    def __len__(self) -> int:
+        return len(self._layers_index)
+
+    def to(
+        self,
+        device: Optional[torch.device] = None,
+        dtype: Optional[torch.dtype] = None,
+    ):
+        with self._lock:
+            for layer in self._layers.values():
+                layer.to(device=device, dtype=dtype)
+            self._device = device
+            self._dtype = dtype
+
+    def calc_size(self) -> int:
+        """The size of the layers once all are read."""
+        element_size = torch.empty((), dtype=self._dtype).element_size()
+        model_size = 0
+        for layer_key, entry in self._layers_index.items():
+            layer = self._layers.get(layer_key)
+            model_size += layer.calc_size() if layer is not None else entry["numel"] * element_size
+        return model_size
+
+
 # TODO: rename all methods used in model logic with Info postfix and remove here Raw postfix
 class LoRAModelRaw:  # (torch.nn.Module):
     _name: str
-    layers: Dict[str, LoRALayer]
+    layers: Mapping[str, LoRALayerBase]
     _device: torch.device
     _dtype: torch.dtype
 
     def __init__(
         self,
         name: str,
-        layers: Dict[str, LoRALayer],
+        layers: Mapping[str, LoRALayerBase],
         device: torch.device,
         dtype: torch.dtype,
     ):
@@ -473,12 +651,17 @@ class LoRAModelRaw:  # (torch.nn.Module):
         dtype: Optional[torch.dtype] = None,
     ):
         # TODO: try revert if exception?
-        for key, layer in self.layers.items():
-            layer.to(device=device, dtype=dtype)
+        if isinstance(self.layers, LazyLoRALayers):
+            self.layers.to(device=device, dtype=dtype)
+        else:
+            for key, layer in self.layers.items():
+                layer.to(device=device, dtype=dtype)
         self._device = device
         self._dtype = dtype
 
     def calc_size(self) -> int:
+        if isinstance(self.layers, LazyLoRALayers):
+            return self.layers.calc_size()
         model_size = 0
         for _, layer in self.layers.items():
             model_size += layer.calc_size()
@@ -506,19 +689,13 @@ class LoRAModelRaw:  # (torch.nn.Module):
         converted_count = 0  # The number of Stability AI keys converted to diffusers format.
         not_converted_count = 0  # The number of keys that were not converted.
 
-        # Get a sorted list of Stability AI UNet keys so that we can efficiently search for keys with matching prefixes.
-        # For example, we want to efficiently find `input_blocks_4_1` in the list when searching for
-        # `input_blocks_4_1_proj_in`.
-        stability_unet_keys = list(SDXL_UNET_STABILITY_TO_DIFFUSERS_MAP)
-        stability_unet_keys.sort()
-
         new_state_dict = dict()
         for full_key, value in state_dict.items():
             if full_key.startswith("lora_unet_"):
                 search_key = full_key.replace("lora_unet_", "")
-                # Use bisect to find the key in stability_unet_keys that *may* match the search_key's prefix.
-                position = bisect.bisect_right(stability_unet_keys, search_key)
-                map_key = stability_unet_keys[position - 1]
+                # Use bisect to find the key in SDXL_UNET_STABILITY_KEYS that *may* match the search_key's prefix.
+                position = bisect.bisect_right(SDXL_UNET_STABILITY_KEYS, search_key)
+                map_key = SDXL_UNET_STABILITY_KEYS[position - 1]
                 # Now, check if the map_key *actually* matches the search_key.
                 if search_key.startswith(map_key):
                     new_key = full_key.replace(map_key, SDXL_UNET_STABILITY_TO_DIFFUSERS_MAP[map_key])
@@ -574,29 +751,7 @@ class LoRAModelRaw:  # (torch.nn.Module):
             state_dict = cls._convert_sdxl_keys_to_diffusers_format(state_dict)
 
         for layer_key, values in state_dict.items():
-            # lora and locon
-            if "lora_down.weight" in values:
-                layer = LoRALayer(layer_key, values)
-
-            # loha
-            elif "hada_w1_b" in values:
-                layer = LoHALayer(layer_key, values)
-
-            # lokr
-            elif "lokr_w1_b" in values or "lokr_w1" in values:
-                layer = LoKRLayer(layer_key, values)
-
-            # diff
-            elif "diff" in values:
-                layer = FullLayer(layer_key, values)
-
-            # ia3
-            elif "weight" in values and "on_input" in values:
-                layer = IA3Layer(layer_key, values)
-
-            else:
-                print(f">> Encountered unknown lora layer module in {model.name}: {layer_key} - {list(values.keys())}")
-                raise Exception("Unknown lora format!")
+            layer = _get_layer_class(layer_key, values)(layer_key, values)
 
             # lower memory consumption by removing already parsed layer values
             state_dict[layer_key].clear()
@@ -606,6 +761,24 @@ class LoRAModelRaw:  # (torch.nn.Module):
 
         return model
 
+    @classmethod
+    def from_key_index(
+        cls,
+        key_index: dict,
+        device: Optional[torch.device] = None,
+        dtype: Optional[torch.dtype] = None,
+    ):
+        """Opens a safetensors LoRA indexed by _index_lora_and_cache(); its layers are read when first used."""
+        device = device or torch.device("cpu")
+        dtype = dtype or torch.float32
+
+        return cls(
+            device=device,
+            dtype=dtype,
+            name=Path(key_index["lora"]).stem,
+            layers=LazyLoRALayers(key_index["lora"], key_index["layers"], device=device, dtype=dtype),
+        )
+
     @staticmethod
     def _group_state(state_dict: dict):
         state_dict_groupped = dict()
@@ -709,3 +882,8 @@ def make_sdxl_unet_conversion_map():
 SDXL_UNET_STABILITY_TO_DIFFUSERS_MAP = {
     sd.rstrip(".").replace(".", "_"): hf.rstrip(".").replace(".", "_") for sd, hf in make_sdxl_unet_conversion_map()
 }
+
+# A sorted list of Stability AI UNet keys so that we can efficiently search for keys with matching prefixes.
+# For example, we want to efficiently find `input_blocks_4_1` in the list when searching for
+# `input_blocks_4_1_proj_in`.
+SDXL_UNET_STABILITY_KEYS = sorted(SDXL_UNET_STABILITY_TO_DIFFUSERS_MAP)
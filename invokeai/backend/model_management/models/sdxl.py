@@ -110,6 +110,7 @@ class StableDiffusionXLModel(DiffusersModel):
         output_path: str,
         config: ModelConfigBase,
         base_model: BaseModelType,
+        direct: Optional[bool] = None,
     ) -> str:
         # The convert script adapted from the diffusers package uses
         # strings for the base model type. To avoid making too many
@@ -122,6 +123,7 @@ class StableDiffusionXLModel(DiffusersModel):
                 model_config=config,
                 output_path=output_path,
                 use_safetensors=False,  # corrupts sdxl models for some reason
+                direct=direct,
             )
         else:
             return model_path
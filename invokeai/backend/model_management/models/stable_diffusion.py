@@ -13,6 +13,8 @@ from .base import (
     DiffusersModel,
     SilenceWarnings,
     read_checkpoint_meta,
+    read_checkpoint_key_map,
+    write_checkpoint_key_map,
     classproperty,
     InvalidModelException,
     ModelNotFoundException,
@@ -20,6 +22,7 @@ from .base import (
 from .sdxl import StableDiffusionXLModel
 import invokeai.backend.util.logging as logger
 from invokeai.app.services.config import InvokeAIAppConfig
+from ..convert_cache import staging_path
 from omegaconf import OmegaConf
 
 
@@ -119,6 +122,7 @@ class StableDiffusion1Model(DiffusersModel):
         output_path: str,
         config: ModelConfigBase,
         base_model: BaseModelType,
+        direct: Optional[bool] = None,
     ) -> str:
         if isinstance(config, cls.CheckpointConfig):
             return _convert_ckpt_and_cache(
@@ -126,6 +130,7 @@ class StableDiffusion1Model(DiffusersModel):
                 model_config=config,
                 load_safety_checker=False,
                 output_path=output_path,
+                direct=direct,
             )
         else:
             return model_path
@@ -230,12 +235,14 @@ class StableDiffusion2Model(DiffusersModel):
         output_path: str,
         config: ModelConfigBase,
         base_model: BaseModelType,
+        direct: Optional[bool] = None,
     ) -> str:
         if isinstance(config, cls.CheckpointConfig):
             return _convert_ckpt_and_cache(
                 version=BaseModelType.StableDiffusion2,
                 model_config=config,
                 output_path=output_path,
+                direct=direct,
             )
         else:
             return model_path
@@ -252,12 +259,19 @@ def _convert_ckpt_and_cache(
     ],
     output_path: str,
     use_save_model: bool = False,
+    direct: Optional[bool] = None,
     **kwargs,
 ) -> str:
     """
     Convert the checkpoint model indicated in mconfig into a
     diffusers, cache it to disk, and return Path to converted
     file. If already on disk then just returns Path.
+
+    If `direct`, which defaults to not `convert_checkpoints`, a
+    safetensors checkpoint is mapped rather than converted: only
+    the configs of the diffusers model and a map of its weights to
+    the checkpoint's are cached, and the weights are read from the
+    checkpoint when the model is loaded.
     """
     app_config = InvokeAIAppConfig.get_config()
 
@@ -266,13 +280,23 @@ def _convert_ckpt_and_cache(
     output_path = Path(output_path)
     variant = model_config.variant
     pipeline_class = StableDiffusionInpaintPipeline if variant == "inpaint" else StableDiffusionPipeline
+    if direct is None:
+        direct = not app_config.convert_checkpoints
 
     # return cached version if it exists
     if output_path.exists():
-        return output_path
+        key_map = read_checkpoint_key_map(output_path)
+        if key_map is None:
+            return output_path
+        if direct:
+            # the cache is keyed by the checkpoint's contents, so the same checkpoint may have moved
+            if key_map["checkpoint"] != str(weights.resolve()):
+                key_map["checkpoint"] = str(weights.resolve())
+                write_checkpoint_key_map(output_path, key_map)
+            return output_path
 
     # to avoid circular import errors
-    from ..convert_ckpt_to_diffusers import convert_ckpt_to_diffusers
+    from ..convert_ckpt_to_diffusers import convert_ckpt_to_diffusers, map_ckpt_to_diffusers
     from ...util.devices import choose_torch_device, torch_dtype
 
     model_base_to_model_type = {
@@ -281,22 +305,30 @@ def _convert_ckpt_and_cache(
         BaseModelType.StableDiffusionXL: "SDXL",
         BaseModelType.StableDiffusionXLRefiner: "SDXL-Refiner",
     }
+    conversion_args = dict(
+        model_type=model_base_to_model_type[version],
+        model_version=version,
+        model_variant=model_config.variant,
+        original_config_file=config_file,
+        extract_ema=True,
+        scan_needed=True,
+        pipeline_class=pipeline_class,
+        from_safetensors=weights.suffix == ".safetensors",
+        precision=torch_dtype(choose_torch_device()),
+        **kwargs,
+    )
+    if direct and weights.suffix == ".safetensors":
+        logger.info(f"Mapping {weights} to diffusers format")
+        try:
+            with SilenceWarnings(), staging_path(output_path) as staging:
+                map_ckpt_to_diffusers(weights, staging, **conversion_args)
+            return output_path
+        except NotImplementedError as e:
+            logger.warning(f"{e}; converting it instead")
+
     logger.info(f"Converting {weights} to diffusers format")
-    with SilenceWarnings():
-        convert_ckpt_to_diffusers(
-            weights,
-            output_path,
-            model_type=model_base_to_model_type[version],
-            model_version=version,
-            model_variant=model_config.variant,
-            original_config_file=config_file,
-            extract_ema=True,
-            scan_needed=True,
-            pipeline_class=pipeline_class,
-            from_safetensors=weights.suffix == ".safetensors",
-            precision=torch_dtype(choose_torch_device()),
-            **kwargs,
-        )
+    with SilenceWarnings(), staging_path(output_path) as staging:
+        convert_ckpt_to_diffusers(weights, staging, **conversion_args)
     return output_path
 
 
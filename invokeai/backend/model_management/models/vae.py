@@ -8,6 +8,7 @@ import torch
 from omegaconf import OmegaConf
 
 from invokeai.app.services.config import InvokeAIAppConfig
+from ..convert_cache import staging_path
 from .base import (
     ModelBase,
     ModelConfigBase,
@@ -174,5 +175,6 @@ def _convert_vae_ckpt_and_cache(
         vae_config=config,
         image_size=image_size,
     )
-    vae_model.save_pretrained(output_path, safe_serialization=True)
+    with staging_path(output_path) as staging:
+        vae_model.save_pretrained(staging, safe_serialization=True)
     return output_path
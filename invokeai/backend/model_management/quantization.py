@@ -0,0 +1,71 @@
+"""
+Weight-only quantization of models parked in the RAM cache.
+
+The weights of linear and convolution layers are stored in one byte per
+element while the model is off the execution device, and restored to
+their original dtype once it is moved back. Quantizing and dequantizing
+are done on the execution device, so only the compressed weights cross
+the bus.
+"""
+
+from typing import Dict, Literal, Tuple
+
+import torch
+
+import invokeai.backend.util.logging as logger
+
+StoragePrecision = Literal["same", "int8", "fp8"]
+
+# Smaller weights (norms, biases, embeddings of a few tokens) aren't worth compressing
+MIN_QUANTIZED_NUMEL = 4096
+
+# The largest magnitude representable in float8_e4m3fn
+FP8_MAX = 448.0
+
+# name of a quantized parameter => (per-channel or per-tensor scale, original dtype)
+QuantizationState = Dict[str, Tuple[torch.Tensor, torch.dtype]]
+
+
+def fp8_available() -> bool:
+    return hasattr(torch, "float8_e4m3fn")
+
+
+def resolve_storage_precision(precision: StoragePrecision) -> StoragePrecision:
+    if precision == "fp8" and not fp8_available():
+        logger.warning(f"fp8 storage requires torch 2.1 or later (found {torch.__version__}); using int8 instead")
+        return "int8"
+    return precision
+
+
+def quantize_weights(model: torch.nn.Module, precision: StoragePrecision) -> QuantizationState:
+    """
+    Replaces the floating point weights of `model` with their int8 or fp8 quantization, on the device
+    they are on, and returns what dequantize_weights() needs to restore them.
+    """
+    state: QuantizationState = dict()
+    with torch.no_grad():
+        for name, param in model.named_parameters():
+            if not param.is_floating_point() or param.ndim < 2 or param.numel() < MIN_QUANTIZED_NUMEL:
+                continue
+            weight = param.data.float()
+            if precision == "fp8":
+                scale = weight.abs().amax().clamp(min=1e-12) / FP8_MAX
+                quantized = (weight / scale).to(torch.float8_e4m3fn)
+            else:
+                # one scale per output channel
+                scale = weight.abs().amax(dim=tuple(range(1, weight.ndim)), keepdim=True).clamp(min=1e-12) / 127
+                quantized = (weight / scale).round_().clamp_(-127, 127).to(torch.int8)
+            state[name] = (scale.to(param.dtype), param.dtype)
+            param.data = quantized
+            del weight
+    return state
+
+
+def dequantize_weights(model: torch.nn.Module, state: QuantizationState) -> None:
+    """Restores the weights of a model quantized by quantize_weights(), on the device they are on."""
+    with torch.no_grad():
+        for name, param in model.named_parameters():
+            if name not in state:
+                continue
+            scale, dtype = state[name]
+            param.data = param.data.to(dtype) * scale.to(param.device)
@@ -0,0 +1,170 @@
+"""
+A second tier of the model RAM cache, on a local disk.
+
+Models evicted from the RAM cache are written to the spill directory as
+safetensors files and their weights are released, leaving the modules
+and their configs in memory. Reloading a spilled model reads its weights
+back from the memory-mapped file, instead of loading, converting, casting
+and patching it again. The file is kept once the model is back in RAM, so
+evicting it again costs nothing as long as its weights are unchanged.
+
+Spilled weights are only usable by the process that wrote them, as that
+is where their modules are, so they are deleted on startup. Only files
+named the way the spill cache names them are deleted, so pointing
+spill_dir at a directory that holds other files doesn't lose them.
+"""
+
+import hashlib
+import re
+import time
+import types
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+import safetensors
+import safetensors.torch
+import torch
+
+import invokeai.backend.util.logging as logger
+
+from .convert_cache import GIG, STAGING_SUFFIX, staging_path
+
+SPILL_SUFFIX = ".safetensors"
+
+# The names of spilled models, and of the files they are written to before being moved into place
+SPILL_FILE_PATTERN = re.compile(r"[0-9a-f]{32}" + re.escape(SPILL_SUFFIX) + "(" + re.escape(STAGING_SUFFIX) + ")?")
+
+# name => (dtype, shape) of each tensor of a spilled model
+Signature = Dict[str, Tuple[torch.dtype, Tuple[int, ...]]]
+
+
+@dataclass
+class _SpillRecord:
+    path: Path
+    size: int
+    signature: Signature
+    keys: List[str]
+    last_used: float = field(default_factory=time.time)
+    # the model with its weights released, while it is spilled. None once it has been restored: the RAM
+    # cache tells whether a model is in use from its reference count
+    model: Optional[torch.nn.Module] = None
+
+
+def _named_tensors(model: torch.nn.Module):
+    yield from model.named_parameters()
+    yield from model.named_buffers()
+
+
+def _signature(model: torch.nn.Module) -> Signature:
+    return {name: (t.dtype, tuple(t.shape)) for name, t in _named_tensors(model)}
+
+
+class ModelSpillCache(object):
+    """
+    The directory that models evicted from the RAM cache are spilled to, with a disk budget and LRU eviction.
+    """
+
+    def __init__(self, spill_path: Union[str, Path], max_size: float, logger: types.ModuleType = logger):
+        """
+        :param spill_path: the directory to spill models to
+        :param max_size: disk budget of the directory, in GB
+        :param logger: logger to use
+        """
+        self.spill_path = Path(spill_path)
+        self.max_size = max_size
+        self.logger = logger
+        # cache key => the record of the spilled model
+        self._records: Dict[str, _SpillRecord] = dict()
+
+        self.spill_path.mkdir(parents=True, exist_ok=True)
+        for path in self.spill_path.iterdir():
+            if SPILL_FILE_PATTERN.fullmatch(path.name) and path.is_file():
+                path.unlink()
+
+    def spill(self, keys: Iterable[str], model: torch.nn.Module) -> bool:
+        """
+        Writes the weights of a model being evicted from the RAM cache under the cache keys `keys`,
+        unless they were spilled before, and releases them. Returns False if the model can't be spilled.
+        """
+        keys = sorted(keys)
+        if not isinstance(model, torch.nn.Module) or not keys:
+            return False
+        signature = _signature(model)
+        record = next((self._records[key] for key in keys if key in self._records), None)
+        if record is not None and (record.signature != signature or not record.path.exists()):
+            self._remove(record)
+            record = None
+
+        if record is None:
+            path = self.spill_path / (hashlib.blake2b(keys[0].encode(), digest_size=16).hexdigest() + SPILL_SUFFIX)
+            try:
+                with staging_path(path) as staging:
+                    tensors = {name: t.detach().to("cpu").contiguous() for name, t in _named_tensors(model)}
+                    safetensors.torch.save_file(tensors, staging)
+                    del tensors
+            except Exception as e:
+                # e.g. tensors sharing memory, which safetensors can't store
+                self.logger.debug(f"Could not spill {keys[0]}: {e}")
+                return False
+            record = _SpillRecord(path=path, size=path.stat().st_size, signature=signature, keys=keys)
+            if record.size > self.max_size * GIG:
+                path.unlink()
+                return False
+            self.logger.debug(f"Spilled {keys[0]} to {path} ({(record.size/GIG):.2f} GB)")
+
+        for key in set(keys) - set(record.keys):
+            record.keys.append(key)
+        for key in record.keys:
+            self._records[key] = record
+        record.model = model
+        record.last_used = time.time()
+        with torch.no_grad():
+            for _, t in _named_tensors(model):
+                t.data = torch.empty(0, dtype=t.dtype)
+        self._evict(keep=record)
+        return True
+
+    def restore(self, key: str) -> Optional[torch.nn.Module]:
+        """Returns the model spilled under `key` with its weights read back, or None if there isn't one."""
+        record = self._records.get(key)
+        if record is None or record.model is None:
+            return None
+        model = record.model
+        try:
+            with safetensors.safe_open(record.path, framework="pt", device="cpu") as f, torch.no_grad():
+                for name, t in _named_tensors(model):
+                    t.data = f.get_tensor(name)
+        except Exception as e:
+            self.logger.warning(f"Could not restore {key} from {record.path}: {e}")
+            self._remove(record)
+            return None
+        record.model = None
+        record.last_used = time.time()
+        self.logger.debug(f"Restored {key} from {record.path}")
+        return model
+
+    def delete(self, key: str) -> None:
+        """Forgets the model spilled under `key`, whose files have changed or are gone."""
+        record = self._records.get(key)
+        if record is not None:
+            self._remove(record)
+
+    def _remove(self, record: _SpillRecord) -> None:
+        for key in record.keys:
+            if self._records.get(key) is record:
+                del self._records[key]
+        record.model = None
+        record.path.unlink(missing_ok=True)
+
+    def _evict(self, keep: _SpillRecord) -> None:
+        records = list({id(r): r for r in self._records.values()}.values())
+        total = sum(r.size for r in records)
+        for record in sorted(records, key=lambda r: r.last_used):
+            if total <= self.max_size * GIG:
+                break
+            if record is keep:
+                continue
+            self.logger.debug(f"Removing {record.keys[0]} from the spill cache")
+            self._remove(record)
+            total -= record.size
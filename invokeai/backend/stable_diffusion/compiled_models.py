@@ -0,0 +1,314 @@
+# Copyright (c) 2023 the InvokeAI Development Team
+"""
+Opt-in compiled execution of the UNet, VAE decoder and ControlNet.
+
+When `compile_mode` is "compile" (torch.compile) or "trace" (torch.jit.trace),
+calls routed through `run_compiled()` are executed by a graph specialised for
+the exact call: the module instance, device, dtype, the shapes of every tensor
+input (which fixes the latent size bucket and the batch size), the set of
+optional arguments that were passed, and the module's attention processors and
+seamless padding. Graphs are kept per module for as long as the RAM model
+cache holds that module, so steady-state serving of a fixed set of resolutions
+only pays the compilation cost once. `release_compiled_graphs()` must be
+called when a module leaves the model cache.
+
+Calls whose arguments can't be passed to a graph (e.g. prompt-to-prompt
+attention contexts) and graphs that fail to build run eagerly.
+"""
+from __future__ import annotations
+
+import threading
+import weakref
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+import torch
+import torch.nn as nn
+
+import invokeai.backend.util.logging as logger
+from invokeai.app.services.config import InvokeAIAppConfig
+
+
+@dataclass(frozen=True)
+class GraphKey:
+    model_id: int
+    method: str
+    device: str
+    dtype: torch.dtype
+    shapes: Tuple[Tuple[int, ...], ...]  # tensor input shapes, batch size first
+    signature: Tuple[Any, ...]  # argument layout and python constants
+    structure: Tuple[Any, ...]  # attention processors, padding modes and parameter dtypes
+
+
+class _FlatModule(nn.Module):
+    """Calls a method of the wrapped module from a flat list of tensors and returns a flat tuple."""
+
+    def __init__(self, module: nn.Module, method: str, args_spec: tuple, kwargs_spec: tuple, constants: dict):
+        super().__init__()
+        self.module = module
+        self.method = method
+        self.args_spec = args_spec
+        self.kwargs_spec = kwargs_spec
+        self.constants = constants
+        self.output_structure = None
+
+    def forward(self, *tensors: torch.Tensor):
+        tensors = list(tensors)
+        args = [_unflatten_value(spec, tensors) for spec in self.args_spec]
+        kwargs = {name: _unflatten_value(spec, tensors) for name, spec in self.kwargs_spec}
+        kwargs.update(self.constants)
+        output = getattr(self.module, self.method)(*args, **kwargs)
+        flat_output: List[torch.Tensor] = []
+        self.output_structure = _flatten_output(output, flat_output)
+        return tuple(flat_output)
+
+
+def _flatten_value(value: Any, tensors: List[torch.Tensor]) -> Optional[Any]:
+    """Append the tensors of `value` to `tensors` and return its layout, or None if it can't be flattened."""
+    if isinstance(value, torch.Tensor):
+        tensors.append(value)
+        return "tensor"
+    if isinstance(value, (list, tuple)) and all(isinstance(v, torch.Tensor) for v in value):
+        tensors.extend(value)
+        return ("list", len(value))
+    if isinstance(value, dict) and all(isinstance(v, torch.Tensor) for v in value.values()):
+        keys = tuple(sorted(value))
+        tensors.extend(value[k] for k in keys)
+        return ("dict", keys)
+    return None
+
+
+def _unflatten_value(spec: Any, tensors: List[torch.Tensor]) -> Any:
+    if spec == "tensor":
+        return tensors.pop(0)
+    kind, layout = spec
+    if kind == "list":
+        return [tensors.pop(0) for _ in range(layout)]
+    return {k: tensors.pop(0) for k in layout}
+
+
+def _flatten_output(output: Any, tensors: List[torch.Tensor]) -> Any:
+    if isinstance(output, torch.Tensor):
+        tensors.append(output)
+        return "tensor"
+    return tuple(_flatten_output(o, tensors) for o in output)
+
+
+def _unflatten_output(structure: Any, tensors: List[torch.Tensor]) -> Any:
+    if structure == "tensor":
+        return tensors.pop(0)
+    return tuple(_unflatten_output(s, tensors) for s in structure)
+
+
+def _structure_token(module: nn.Module) -> Tuple[Any, ...]:
+    """Module state that changes the computation without changing the parameters."""
+    processors = getattr(module, "attn_processors", None)
+    processor_types = tuple(sorted({type(p).__name__ for p in processors.values()})) if processors else ()
+    conv = next((m for m in module.modules() if isinstance(m, nn.Conv2d)), None)
+    padding = tuple(sorted(getattr(conv, "asymmetric_padding_mode", {}).items())) if conv is not None else ()
+    # the fp32 VAE decode keeps some blocks in half precision
+    parameters = list(module.parameters())
+    dtypes = (parameters[0].dtype, parameters[-1].dtype) if parameters else ()
+    return processor_types, padding, dtypes
+
+
+class CompiledGraphCache:
+    """Per-module LRU of compiled graphs, keyed by GraphKey."""
+
+    def __init__(self, mode: str = "none", max_graphs_per_model: int = 8):
+        self.mode = mode
+        self.max_graphs_per_model = max_graphs_per_model
+        self._graphs: Dict[int, OrderedDict[GraphKey, Optional[Tuple[Any, Any]]]] = dict()
+        # module id => the wrappers that graphs were built from; each one references the module
+        self._wrappers: Dict[int, weakref.WeakSet] = dict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode in ("compile", "trace")
+
+    def release(self, module: Any):
+        """Drop all graphs built for `module` (they hold references to its parameters)."""
+        with self._lock:
+            self._graphs.pop(id(module), None)
+            self._wrappers.pop(id(module), None)
+
+    def references(self, module: Any) -> int:
+        """Number of references to `module` held by the graphs built for it."""
+        with self._lock:
+            return len(self._wrappers.get(id(module), ()))
+
+    def graph_count(self, module: Optional[Any] = None) -> int:
+        if module is not None:
+            return len(self._graphs.get(id(module), {}))
+        return sum(len(graphs) for graphs in self._graphs.values())
+
+    def run(
+        self,
+        module: nn.Module,
+        *args,
+        method: str = "forward",
+        tensor_kwargs: Tuple[str, ...] = (),
+        **kwargs,
+    ) -> Any:
+        """
+        Call `getattr(module, method)(*args, **kwargs)` through a compiled graph.
+
+        :param tensor_kwargs: python scalar kwargs to pass to the graph as 0-d
+                              tensors instead of baking them in as constants
+        """
+        if not self.enabled:
+            return getattr(module, method)(*args, **kwargs)
+
+        tensors: List[torch.Tensor] = []
+        args_spec = []
+        for value in args:
+            spec = _flatten_value(value, tensors)
+            if spec is None:
+                return getattr(module, method)(*args, **kwargs)
+            args_spec.append(spec)
+        reference = next(
+            (v for v in list(args) + [kwargs[k] for k in sorted(kwargs)] if isinstance(v, torch.Tensor)), None
+        )
+        if reference is None:
+            return getattr(module, method)(*args, **kwargs)
+
+        kwargs_spec = []
+        constants = {}
+        for name in sorted(kwargs):
+            value = kwargs[name]
+            if name in tensor_kwargs and isinstance(value, (int, float)) and not isinstance(value, bool):
+                value = torch.tensor(float(value), device=reference.device, dtype=reference.dtype)
+            if value is None or isinstance(value, (bool, int, float, str)):
+                constants[name] = value
+                continue
+            spec = _flatten_value(value, tensors)
+            if spec is None:
+                return getattr(module, method)(*args, **kwargs)
+            kwargs_spec.append((name, spec))
+
+        key = GraphKey(
+            model_id=id(module),
+            method=method,
+            device=str(reference.device),
+            dtype=reference.dtype,
+            shapes=tuple(tuple(t.shape) for t in tensors),
+            signature=(tuple(args_spec), tuple(kwargs_spec), tuple(sorted(constants.items()))),
+            structure=_structure_token(module),
+        )
+
+        with self._lock:
+            graphs = self._graphs.setdefault(id(module), OrderedDict())
+            entry = graphs.get(key, False)
+            if entry is not False:
+                graphs.move_to_end(key)
+
+        if entry is None:  # building this graph failed before
+            return getattr(module, method)(*args, **kwargs)
+
+        if entry is False:
+            flat = _FlatModule(module, method, tuple(args_spec), tuple(kwargs_spec), constants)
+            with self._lock:
+                self._wrappers.setdefault(id(module), weakref.WeakSet()).add(flat)
+            output, entry = self._build(flat, tensors, key)
+            with self._lock:
+                graphs[key] = entry
+                while len(graphs) > self.max_graphs_per_model:
+                    graphs.popitem(last=False)
+            if output is not None:
+                return output
+
+        if entry is None:
+            return getattr(module, method)(*args, **kwargs)
+        graph, structure = entry
+        return _unflatten_output(structure, list(graph(*tensors)))
+
+    def _build(self, flat: _FlatModule, tensors: List[torch.Tensor], key: GraphKey) -> Tuple[Any, Any]:
+        """Return (output of this call or None, (graph, output structure) or None on failure)."""
+        logger.info(f"Compiling {type(flat.module).__name__}.{flat.method} ({self.mode}) for input shapes {key.shapes}")
+        try:
+            if self.mode == "trace":
+                graph = torch.jit.trace(flat, tuple(tensors), check_trace=False, strict=False)
+                return None, (graph, flat.output_structure)
+            else:
+                # run eagerly once to learn the output layout; compilation happens on the next call
+                output = flat(*tensors)
+                graph = torch.compile(flat, dynamic=False)
+                return _unflatten_output(flat.output_structure, list(output)), (graph, flat.output_structure)
+        except Exception as e:
+            logger.warning(f"Could not compile {type(flat.module).__name__}.{flat.method}, running eagerly: {e}")
+            return None, None
+
+
+_graph_cache: Optional[CompiledGraphCache] = None
+
+
+def get_compiled_graph_cache() -> CompiledGraphCache:
+    global _graph_cache
+    if _graph_cache is None:
+        config = InvokeAIAppConfig.get_config()
+        _graph_cache = CompiledGraphCache(mode=config.compile_mode, max_graphs_per_model=config.compile_max_graphs)
+    return _graph_cache
+
+
+def run_compiled(module: nn.Module, *args, **kwargs) -> Any:
+    return get_compiled_graph_cache().run(module, *args, **kwargs)
+
+
+def release_compiled_graphs(module: Any):
+    if _graph_cache is not None:
+        _graph_cache.release(module)
+
+
+def compiled_graph_references(module: Any) -> int:
+    return _graph_cache.references(module) if _graph_cache is not None else 0
+
+
+def unet_forward(unet: nn.Module, sample: torch.Tensor, timestep: torch.Tensor, encoder_hidden_states, **kwargs):
+    """Run the UNet, through a compiled graph when enabled, and return the predicted noise."""
+    return run_compiled(unet, sample, timestep, encoder_hidden_states, return_dict=False, **kwargs)[0]
+
+
+@torch.inference_mode()
+def warmup_unet(unet: nn.Module, width: int, height: int, batch_size: int = 2, tokens: int = 77):
+    """
+    Build the UNet graph used by a plain classifier-free guidance step at the
+    given output resolution, with the same arguments the pipeline passes.
+    """
+    config = unet.config
+    sample = torch.zeros(
+        (batch_size, config.in_channels, height // 8, width // 8), device=unet.device, dtype=unet.dtype
+    )
+    timestep = torch.full((batch_size,), 999, device=unet.device, dtype=torch.long)
+    encoder_hidden_states = torch.zeros(
+        (batch_size, tokens, config.cross_attention_dim), device=unet.device, dtype=unet.dtype
+    )
+    added_cond_kwargs = None
+    if config.addition_embed_type == "text_time":
+        text_embeds_dim = config.projection_class_embeddings_input_dim - 6 * config.addition_time_embed_dim
+        added_cond_kwargs = {
+            "text_embeds": torch.zeros((batch_size, text_embeds_dim), device=unet.device, dtype=unet.dtype),
+            "time_ids": torch.zeros((batch_size, 6), device=unet.device, dtype=unet.dtype),
+        }
+    unet_forward(
+        unet,
+        sample,
+        timestep,
+        encoder_hidden_states,
+        cross_attention_kwargs=None,
+        encoder_attention_mask=None,
+        added_cond_kwargs=added_cond_kwargs,
+        down_block_additional_residuals=None,
+        mid_block_additional_residual=None,
+    )
+
+
+@torch.inference_mode()
+def warmup_vae_decode(vae: nn.Module, width: int, height: int):
+    """Build the VAE decoder graph used by an untiled decode at the given output resolution."""
+    factor = 2 ** (len(vae.config.block_out_channels) - 1)
+    latents = torch.zeros(
+        (1, vae.config.latent_channels, height // factor, width // factor), device=vae.device, dtype=vae.dtype
+    )
+    run_compiled(vae, latents, method="decode", return_dict=False)
@@ -32,8 +32,11 @@ from .diffusion import (
     InvokeAIDiffuserComponent,
     PostprocessingSettings,
     BasicConditioningInfo,
+    SDXLConditioningInfo,
 )
 from ..util import normalize_device, auto_detect_slice_size
+from ..util.tiles import blend_weights, tile_starts
+from .compiled_models import unet_forward
 
 
 @dataclass
@@ -169,6 +172,56 @@ class ControlNetData:
     resize_mode: str = Field(default="just_resize")
 
 
+@dataclass
+class LatentWindow:
+    y: int
+    x: int
+    height: int
+    width: int
+    weight: torch.Tensor  # [height, width] blend weights; the weights of all windows sum to one everywhere
+
+    def crop(self, tensor: torch.Tensor, scale: int = 1) -> torch.Tensor:
+        return tensor[
+            :, :, self.y * scale : (self.y + self.height) * scale, self.x * scale : (self.x + self.width) * scale
+        ]
+
+
+@dataclass
+class TiledDenoiseSettings:
+    """
+    Run the UNet over overlapping latent windows instead of the whole
+    latent, blending the per-window noise predictions (MultiDiffusion).
+    Sizes are in latent units.
+    """
+
+    tile_size: int
+    overlap: int
+    batch_size: int = 1
+    """Number of windows evaluated together in a single UNet call."""
+
+    def windows(self, height: int, width: int, device: torch.device) -> List[LatentWindow]:
+        tile_h, tile_w = min(self.tile_size, height), min(self.tile_size, width)
+        y_weights = blend_weights(height, self.tile_size, self.overlap)
+        x_weights = blend_weights(width, self.tile_size, self.overlap)
+        windows = []
+        for y, wy in zip(tile_starts(height, self.tile_size, self.overlap), y_weights):
+            for x, wx in zip(tile_starts(width, self.tile_size, self.overlap), x_weights):
+                weight = torch.from_numpy(wy[:, None] * wx[None, :]).to(device=device)
+                windows.append(LatentWindow(y=y, x=x, height=tile_h, width=tile_w, weight=weight))
+        return windows
+
+
+def _repeat_conditioning_info(info: BasicConditioningInfo, count: int) -> BasicConditioningInfo:
+    info = dataclasses.replace(info, embeds=info.embeds.repeat(count, 1, 1))
+    if isinstance(info, SDXLConditioningInfo):
+        info = dataclasses.replace(
+            info,
+            pooled_embeds=info.pooled_embeds.repeat(count, 1),
+            add_time_ids=info.add_time_ids.repeat(count, 1),
+        )
+    return info
+
+
 @dataclass
 class ConditioningData:
     unconditioned_embeddings: BasicConditioningInfo
@@ -204,6 +257,16 @@ class ConditioningData:
                 scheduler_args[name] = value
         return dataclasses.replace(self, scheduler_args=scheduler_args)
 
+    def repeated(self, count: int) -> ConditioningData:
+        """Return a copy whose embeddings are repeated `count` times along the batch dimension."""
+        if count == 1:
+            return self
+        return dataclasses.replace(
+            self,
+            unconditioned_embeddings=_repeat_conditioning_info(self.unconditioned_embeddings, count),
+            text_embeddings=_repeat_conditioning_info(self.text_embeddings, count),
+        )
+
 
 @dataclass
 class InvokeAIStableDiffusionPipelineOutput(StableDiffusionPipelineOutput):
@@ -360,6 +423,7 @@ class StableDiffusionGeneratorPipeline(StableDiffusionPipeline):
         mask: Optional[torch.Tensor] = None,
         masked_latents: Optional[torch.Tensor] = None,
         seed: Optional[int] = None,
+        tiled_denoise: Optional[TiledDenoiseSettings] = None,
     ) -> tuple[torch.Tensor, Optional[AttentionMapSaver]]:
         if init_timestep.shape[0] == 0:
             return latents, None
@@ -409,6 +473,7 @@ class StableDiffusionGeneratorPipeline(StableDiffusionPipeline):
                 additional_guidance=additional_guidance,
                 control_data=control_data,
                 callback=callback,
+                tiled_denoise=tiled_denoise,
             )
         finally:
             self.invokeai_diffuser.model_forward_callback = self._unet_forward
@@ -428,8 +493,15 @@ class StableDiffusionGeneratorPipeline(StableDiffusionPipeline):
         additional_guidance: List[Callable] = None,
         control_data: List[ControlNetData] = None,
         callback: Callable[[PipelineIntermediateState], None] = None,
+        tiled_denoise: Optional[TiledDenoiseSettings] = None,
     ):
-        self._adjust_memory_efficient_attention(latents)
+        windows = None
+        if tiled_denoise is not None:
+            windows = tiled_denoise.windows(latents.shape[2], latents.shape[3], latents.device)
+            # attention only ever sees a single window
+            self._adjust_memory_efficient_attention(windows[0].crop(latents))
+        else:
+            self._adjust_memory_efficient_attention(latents)
         if additional_guidance is None:
             additional_guidance = []
 
@@ -467,6 +539,8 @@ class StableDiffusionGeneratorPipeline(StableDiffusionPipeline):
                     total_step_count=len(timesteps),
                     additional_guidance=additional_guidance,
                     control_data=control_data,
+                    windows=windows,
+                    window_batch_size=tiled_denoise.batch_size if tiled_denoise is not None else 1,
                 )
                 latents = step_output.prev_sample
 
@@ -512,6 +586,8 @@ class StableDiffusionGeneratorPipeline(StableDiffusionPipeline):
         total_step_count: int,
         additional_guidance: List[Callable] = None,
         control_data: List[ControlNetData] = None,
+        windows: Optional[List[LatentWindow]] = None,
+        window_batch_size: int = 1,
     ):
         # invokeai_diffuser has batched timesteps, but diffusers schedulers expect a single value
         timestep = t[0]
@@ -522,6 +598,61 @@ class StableDiffusionGeneratorPipeline(StableDiffusionPipeline):
         #     i.e. before or after passing it to InvokeAIDiffuserComponent
         latent_model_input = self.scheduler.scale_model_input(latents, timestep)
 
+        if windows is not None:
+            noise_pred = self._tiled_noise_pred(
+                latent_model_input,
+                t,
+                step_index=step_index,
+                total_step_count=total_step_count,
+                conditioning_data=conditioning_data,
+                control_data=control_data,
+                windows=windows,
+                window_batch_size=window_batch_size,
+            )
+        else:
+            noise_pred = self._noise_pred(
+                latent_model_input,
+                t,
+                step_index=step_index,
+                total_step_count=total_step_count,
+                conditioning_data=conditioning_data,
+                control_data=control_data,
+            )
+
+        # compute the previous noisy sample x_t -> x_t-1
+        step_output = self.scheduler.step(noise_pred, timestep, latents, **conditioning_data.scheduler_args)
+
+        # TODO: issue to diffusers?
+        # undo internal counter increment done by scheduler.step, so timestep can be resolved as before call
+        # this needed to be able call scheduler.add_noise with current timestep
+        if self.scheduler.order == 2:
+            self.scheduler._index_counter[timestep.item()] -= 1
+
+        # TODO: this additional_guidance extension point feels redundant with InvokeAIDiffusionComponent.
+        #    But the way things are now, scheduler runs _after_ that, so there was
+        #    no way to use it to apply an operation that happens after the last scheduler.step.
+        for guidance in additional_guidance:
+            step_output = guidance(step_output, timestep, conditioning_data)
+
+        # restore internal counter
+        if self.scheduler.order == 2:
+            self.scheduler._index_counter[timestep.item()] += 1
+
+        return step_output
+
+    def _noise_pred(
+        self,
+        latent_model_input: torch.Tensor,
+        t: torch.Tensor,
+        step_index: int,
+        total_step_count: int,
+        conditioning_data: ConditioningData,
+        control_data: List[ControlNetData] = None,
+        uncond_cache_key: Any = None,
+    ) -> torch.Tensor:
+        """Run the controlnets and the UNet once and return the guided noise prediction."""
+        timestep = t[0]
+
         # default is no controlnet, so set controlnet processing output to None
         controlnet_down_block_samples, controlnet_mid_block_sample = None, None
         if control_data is not None:
@@ -540,6 +671,7 @@ class StableDiffusionGeneratorPipeline(StableDiffusionPipeline):
             step_index=step_index,
             total_step_count=total_step_count,
             conditioning_data=conditioning_data,
+            uncond_cache_key=uncond_cache_key,
             # extra:
             down_block_additional_residuals=controlnet_down_block_samples,  # from controlnet(s)
             mid_block_additional_residual=controlnet_mid_block_sample,  # from controlnet(s)
@@ -549,32 +681,76 @@ class StableDiffusionGeneratorPipeline(StableDiffusionPipeline):
         if isinstance(guidance_scale, list):
             guidance_scale = guidance_scale[step_index]
 
-        noise_pred = self.invokeai_diffuser._combine(
+        return self.invokeai_diffuser._combine(
             uc_noise_pred,
             c_noise_pred,
             guidance_scale,
         )
 
-        # compute the previous noisy sample x_t -> x_t-1
-        step_output = self.scheduler.step(noise_pred, timestep, latents, **conditioning_data.scheduler_args)
-
-        # TODO: issue to diffusers?
-        # undo internal counter increment done by scheduler.step, so timestep can be resolved as before call
-        # this needed to be able call scheduler.add_noise with current timestep
-        if self.scheduler.order == 2:
-            self.scheduler._index_counter[timestep.item()] -= 1
-
-        # TODO: this additional_guidance extension point feels redundant with InvokeAIDiffusionComponent.
-        #    But the way things are now, scheduler runs _after_ that, so there was
-        #    no way to use it to apply an operation that happens after the last scheduler.step.
-        for guidance in additional_guidance:
-            step_output = guidance(step_output, timestep, conditioning_data)
-
-        # restore internal counter
-        if self.scheduler.order == 2:
-            self.scheduler._index_counter[timestep.item()] += 1
+    def _tiled_noise_pred(
+        self,
+        latent_model_input: torch.Tensor,
+        t: torch.Tensor,
+        step_index: int,
+        total_step_count: int,
+        conditioning_data: ConditioningData,
+        control_data: Optional[List[ControlNetData]],
+        windows: List[LatentWindow],
+        window_batch_size: int,
+    ) -> torch.Tensor:
+        """
+        Predict noise window by window and blend the predictions. Windows are
+        stacked along the batch dimension, `window_batch_size` at a time.
+        """
+        forward_callback = self.invokeai_diffuser.model_forward_callback
+        inpainting = isinstance(forward_callback, AddsMaskLatents)
+        if inpainting or self.invokeai_diffuser.cross_attention_control_context is not None:
+            # the mask channels and the prompt2prompt processors assume one sample per conditioning
+            window_batch_size = 1
+
+        noise_pred = torch.zeros_like(latent_model_input)
+        repeated_conditioning = {}
+        try:
+            for i in range(0, len(windows), window_batch_size):
+                group = windows[i : i + window_batch_size]
+                count = len(group)
+                if count not in repeated_conditioning:
+                    repeated_conditioning[count] = conditioning_data.repeated(count)
+                if inpainting:
+                    self.invokeai_diffuser.model_forward_callback = AddsMaskLatents(
+                        forward_callback.forward,
+                        group[0].crop(forward_callback.mask),
+                        group[0].crop(forward_callback.initial_image_latents),
+                    )
 
-        return step_output
+                group_pred = self._noise_pred(
+                    torch.cat([w.crop(latent_model_input) for w in group]),
+                    t.repeat(count),
+                    step_index=step_index,
+                    total_step_count=total_step_count,
+                    conditioning_data=repeated_conditioning[count],
+                    control_data=self._crop_control_data(control_data, group, latent_model_input.shape[2]),
+                    uncond_cache_key=i,
+                )
+                for window, window_pred in zip(group, group_pred.chunk(count)):
+                    window.crop(noise_pred).add_(window_pred * window.weight.to(dtype=window_pred.dtype))
+        finally:
+            self.invokeai_diffuser.model_forward_callback = forward_callback
+        return noise_pred
+
+    def _crop_control_data(
+        self, control_data: Optional[List[ControlNetData]], windows: List[LatentWindow], latent_height: int
+    ) -> Optional[List[ControlNetData]]:
+        if control_data is None:
+            return None
+        cropped = []
+        for control_datum in control_data:
+            image = control_datum.image_tensor
+            scale = image.shape[2] // latent_height
+            # the control image is either a single image or the same image twice (uncond, cond)
+            crops = torch.cat([w.crop(image[:1], scale) for w in windows])
+            cropped.append(dataclasses.replace(control_datum, image_tensor=torch.cat([crops] * image.shape[0])))
+        return cropped
 
     def _unet_forward(
         self,
@@ -597,10 +773,11 @@ class StableDiffusionGeneratorPipeline(StableDiffusionPipeline):
             ).add_mask_channels(latents)
 
         # First three args should be positional, not keywords, so torch hooks can see them.
-        return self.unet(
+        return unet_forward(
+            self.unet,
             latents,
             t,
             text_embeddings,
             cross_attention_kwargs=cross_attention_kwargs,
             **kwargs,
-        ).sample
+        )
@@ -11,6 +11,7 @@ from typing_extensions import TypeAlias
 
 from invokeai.app.services.config import InvokeAIAppConfig
 
+from ..compiled_models import run_compiled
 from .cross_attention_control import (
     Arguments,
     Context,
@@ -70,10 +71,14 @@ class InvokeAIDiffuserComponent:
     At the moment it includes the following features:
     * Cross attention control ("prompt2prompt")
     * Hybrid conditioning (used for inpainting)
+    * Guidance scheduling (skipping or reusing the unconditioned prediction)
     """
 
     debug_thresholding = False
     sequential_guidance = False
+    guidance_interval_start = 0.0
+    guidance_interval_end = 1.0
+    uncond_reuse_stride = 1
 
     @dataclass
     class ExtraConditioningInfo:
@@ -99,6 +104,11 @@ class InvokeAIDiffuserComponent:
         self.model_forward_callback = model_forward_callback
         self.cross_attention_control_context = None
         self.sequential_guidance = config.sequential_guidance
+        self.guidance_interval_start = config.guidance_interval_start
+        self.guidance_interval_end = config.guidance_interval_end
+        self.uncond_reuse_stride = config.uncond_reuse_stride
+        # cache key -> (step index, unconditioned prediction)
+        self._uncond_cache: dict[Any, tuple[int, torch.Tensor]] = {}
 
     @contextmanager
     def custom_attention_context(
@@ -230,7 +240,8 @@ class InvokeAIDiffuserComponent:
                     controlnet_weight = control_datum.weight
 
                 # controlnet(s) inference
-                down_samples, mid_sample = control_datum.model(
+                down_samples, mid_sample = run_compiled(
+                    control_datum.model,
                     sample=sample_model_input,
                     timestep=timestep,
                     encoder_hidden_states=encoder_hidden_states,
@@ -240,6 +251,7 @@ class InvokeAIDiffuserComponent:
                     added_cond_kwargs=added_cond_kwargs,
                     guess_mode=soft_injection,  # this is still called guess_mode in diffusers ControlNetModel
                     return_dict=False,
+                    tensor_kwargs=("conditioning_scale",),
                 )
                 if cfg_injection:
                     # Inferred ControlNet only for the conditional batch.
@@ -267,8 +279,18 @@ class InvokeAIDiffuserComponent:
         conditioning_data,  # TODO: type
         step_index: int,
         total_step_count: int,
+        uncond_cache_key: Any = None,
         **kwargs,
     ):
+        """
+        Return the unconditioned and conditioned noise predictions.
+
+        Outside the configured guidance interval the unconditioned branch is
+        not evaluated and the conditioned prediction is returned for both, so
+        that guidance becomes a no-op. Inside it, the unconditioned branch is
+        only evaluated every `uncond_reuse_stride` steps; in between, the last
+        prediction stored under `uncond_cache_key` is reused.
+        """
         cross_attention_control_types_to_do = []
         context: Context = self.cross_attention_control_context
         if self.cross_attention_control_context is not None:
@@ -279,6 +301,19 @@ class InvokeAIDiffuserComponent:
 
         wants_cross_attention_control = len(cross_attention_control_types_to_do) > 0
 
+        if step_index == 0:
+            self._uncond_cache.clear()
+        uncond_action = "compute"
+        if not wants_cross_attention_control:
+            uncond_action = self._get_uncond_action(sample, step_index, total_step_count, uncond_cache_key)
+
+        if uncond_action == "skip":
+            conditioned_next_x = self._apply_conditioning_only(sample, timestep, conditioning_data, **kwargs)
+            return conditioned_next_x, conditioned_next_x
+        elif uncond_action == "reuse":
+            conditioned_next_x = self._apply_conditioning_only(sample, timestep, conditioning_data, **kwargs)
+            return self._uncond_cache[uncond_cache_key][1], conditioned_next_x
+
         if wants_cross_attention_control:
             (
                 unconditioned_next_x,
@@ -312,8 +347,21 @@ class InvokeAIDiffuserComponent:
                 **kwargs,
             )
 
+        if self.uncond_reuse_stride > 1:
+            self._uncond_cache[uncond_cache_key] = (step_index, unconditioned_next_x)
         return unconditioned_next_x, conditioned_next_x
 
+    def _get_uncond_action(self, sample: torch.Tensor, step_index: int, total_step_count: int, cache_key: Any) -> str:
+        """Decide whether the unconditioned branch is computed, reused from the cache or skipped."""
+        percent_through = step_index / total_step_count
+        if not (self.guidance_interval_start <= percent_through < self.guidance_interval_end):
+            return "skip"
+        if self.uncond_reuse_stride > 1 and cache_key in self._uncond_cache:
+            cached_step, cached = self._uncond_cache[cache_key]
+            if cached.shape == sample.shape and 0 < step_index - cached_step < self.uncond_reuse_stride:
+                return "reuse"
+        return "compute"
+
     def do_latent_postprocessing(
         self,
         postprocessing_settings: PostprocessingSettings,
@@ -472,6 +520,39 @@ class InvokeAIDiffuserComponent:
         )
         return unconditioned_next_x, conditioned_next_x
 
+    def _apply_conditioning_only(
+        self,
+        x: torch.Tensor,
+        sigma,
+        conditioning_data,
+        **kwargs,
+    ):
+        # conditioned branch only; controlnet residuals were computed for (uncond, cond)
+        down_block_additional_residuals = kwargs.pop("down_block_additional_residuals", None)
+        if down_block_additional_residuals is not None:
+            down_block_additional_residuals = [d.chunk(2)[1] for d in down_block_additional_residuals]
+
+        mid_block_additional_residual = kwargs.pop("mid_block_additional_residual", None)
+        if mid_block_additional_residual is not None:
+            mid_block_additional_residual = mid_block_additional_residual.chunk(2)[1]
+
+        added_cond_kwargs = None
+        if type(conditioning_data.text_embeddings) is SDXLConditioningInfo:
+            added_cond_kwargs = {
+                "text_embeds": conditioning_data.text_embeddings.pooled_embeds,
+                "time_ids": conditioning_data.text_embeddings.add_time_ids,
+            }
+
+        return self.model_forward_callback(
+            x,
+            sigma,
+            conditioning_data.text_embeddings.embeds,
+            down_block_additional_residuals=down_block_additional_residuals,
+            mid_block_additional_residual=mid_block_additional_residual,
+            added_cond_kwargs=added_cond_kwargs,
+            **kwargs,
+        )
+
     def _apply_cross_attention_controlled_conditioning(
         self,
         x: torch.Tensor,
@@ -0,0 +1,180 @@
+# Copyright (c) 2023 the InvokeAI Development Team
+"""
+Tiled VAE encode/decode with overlap blending.
+
+Decoding works on one row of latent tiles at a time. Each decoded tile
+is weighted on the device and accumulated into a float32 band that is
+only as tall as one tile; rows that no later tile can touch are rounded
+straight into the preallocated uint8 output. The peak host memory is
+therefore the uint8 image plus one band, and the peak device memory is
+bounded by the tile size, whatever the size of the output.
+"""
+import math
+from typing import Optional
+
+import numpy as np
+import psutil
+import torch
+from diffusers.models import AutoencoderKL
+from diffusers.models.vae import DiagonalGaussianDistribution
+
+from invokeai.app.services.config import InvokeAIAppConfig
+
+from ..util.devices import normalize_device
+from ..util.tiles import blend_weights, tile_starts
+from .compiled_models import run_compiled
+
+# Rough peak activation memory of the SD VAE decoder per output pixel at
+# half precision. Used only to pick a tile size that fits in free memory.
+DECODE_BYTES_PER_PIXEL = 1536
+# Fraction of the free memory we are willing to spend on a single tile.
+FREE_MEMORY_FRACTION = 0.6
+# Tile size bounds, in pixels.
+MIN_TILE_SIZE = 256
+MAX_TILE_SIZE = 2048
+DEFAULT_TILE_SIZE = 512
+
+
+def vae_scale_factor(vae: AutoencoderKL) -> int:
+    return 2 ** (len(vae.config.block_out_channels) - 1)
+
+
+def choose_tile_size(vae: AutoencoderKL, device: torch.device, dtype: torch.dtype) -> int:
+    """
+    Pick the largest square tile (in pixels) whose decode should fit in
+    the memory currently free on `device`.
+    """
+    device = normalize_device(device)
+    if device.type == "cuda":
+        mem_free, _ = torch.cuda.mem_get_info(device)
+    elif device.type == "cpu":
+        mem_free = psutil.virtual_memory().available
+    else:
+        return DEFAULT_TILE_SIZE
+
+    element_size = torch.tensor([], dtype=dtype).element_size()
+    bytes_per_pixel = DECODE_BYTES_PER_PIXEL * element_size / 2
+    side = int(math.sqrt(mem_free * FREE_MEMORY_FRACTION / bytes_per_pixel))
+    multiple = vae_scale_factor(vae) * 8
+    side -= side % multiple
+    return max(MIN_TILE_SIZE, min(MAX_TILE_SIZE, side))
+
+
+def _resolve_tiling(
+    vae: AutoencoderKL, tile_size: Optional[int], overlap: Optional[int], dtype: torch.dtype
+) -> tuple[int, int]:
+    """Return (tile_size, overlap) in latent units."""
+    config = InvokeAIAppConfig.get_config()
+    if tile_size is None:
+        tile_size = config.vae_tile_size
+    if overlap is None:
+        overlap = config.vae_tile_overlap
+    if not tile_size:
+        tile_size = choose_tile_size(vae, vae.device, dtype)
+    factor = vae_scale_factor(vae)
+    return max(1, tile_size // factor), overlap // factor
+
+
+def _to_uint8(band: np.ndarray) -> np.ndarray:
+    return np.clip(np.rint(band), 0, 255).astype(np.uint8)
+
+
+@torch.inference_mode()
+def vae_decode(
+    vae: AutoencoderKL,
+    latents: torch.Tensor,
+    tiled: bool = False,
+    tile_size: Optional[int] = None,
+    overlap: Optional[int] = None,
+) -> np.ndarray:
+    """
+    Decode unscaled latents (already divided by the VAE scaling factor)
+    into a uint8 array of shape [batch, height, width, channels].
+
+    :param tile_size: tile edge in pixels; None reads the config, 0 picks from free memory
+    :param overlap: overlap between tiles in pixels; None reads the config
+    """
+    vae.disable_tiling()
+    if not tiled:
+        image = run_compiled(vae, latents, method="decode", return_dict=False)[0]
+        image = ((image / 2 + 0.5).clamp(0, 1) * 255).round().to(torch.uint8)
+        return image.permute(0, 2, 3, 1).cpu().numpy()
+
+    tile, overlap = _resolve_tiling(vae, tile_size, overlap, latents.dtype)
+    factor = vae_scale_factor(vae)
+    batch, _, height, width = latents.shape
+    tile_h, tile_w = min(tile, height), min(tile, width)
+    y_starts = tile_starts(height, tile, overlap)
+    x_starts = tile_starts(width, tile, overlap)
+    y_weights = blend_weights(height, tile, overlap, multiple=factor)
+    x_weights = [torch.from_numpy(w).to(latents.device) for w in blend_weights(width, tile, overlap, multiple=factor)]
+
+    channels = vae.config.out_channels
+    output = np.empty((batch, height * factor, width * factor, channels), dtype=np.uint8)
+    band: Optional[np.ndarray] = None
+    band_start = 0
+
+    for y, wy in zip(y_starts, y_weights):
+        py = y * factor
+        new_band = np.zeros((batch, tile_h * factor, width * factor, channels), dtype=np.float32)
+        if band is not None:
+            # rows above this tile row are final; carry the overlap forward
+            output[:, band_start:py] = _to_uint8(band[:, : py - band_start])
+            new_band[:, : band_start + band.shape[1] - py] = band[:, py - band_start :]
+        band, band_start = new_band, py
+
+        wy = torch.from_numpy(wy).to(latents.device)
+        for x, wx in zip(x_starts, x_weights):
+            tile_latents = latents[:, :, y : y + tile_h, x : x + tile_w]
+            decoded = run_compiled(vae, tile_latents, method="decode", return_dict=False)[0]
+            decoded = (decoded.float() / 2 + 0.5).clamp(0, 1) * 255
+            decoded = decoded * (wy[:, None] * wx[None, :])
+            px = x * factor
+            band[:, :, px : px + tile_w * factor] += decoded.permute(0, 2, 3, 1).cpu().numpy()
+
+    output[:, band_start:] = _to_uint8(band)
+    return output
+
+
+@torch.inference_mode()
+def vae_encode(
+    vae: AutoencoderKL,
+    image_tensor: torch.Tensor,
+    tiled: bool = False,
+    tile_size: Optional[int] = None,
+    overlap: Optional[int] = None,
+) -> torch.Tensor:
+    """
+    Encode an image tensor in [-1, 1] into (unscaled) latents sampled
+    from the VAE's latent distribution.
+
+    In tiled mode the distribution parameters of each tile are blended
+    across the overlaps before sampling, so seams do not show up as
+    noise discontinuities.
+    """
+    vae.disable_tiling()
+    if not tiled:
+        return vae.encode(image_tensor).latent_dist.sample()
+
+    tile, overlap = _resolve_tiling(vae, tile_size, overlap, image_tensor.dtype)
+    factor = vae_scale_factor(vae)
+    batch, _, px_height, px_width = image_tensor.shape
+    height, width = px_height // factor, px_width // factor
+    tile_h, tile_w = min(tile, height), min(tile, width)
+    y_weights = blend_weights(height, tile, overlap)
+    x_weights = blend_weights(width, tile, overlap)
+
+    moments: Optional[torch.Tensor] = None
+    for y, wy in zip(tile_starts(height, tile, overlap), y_weights):
+        wy = torch.from_numpy(wy).to(image_tensor.device)
+        for x, wx in zip(tile_starts(width, tile, overlap), x_weights):
+            wx = torch.from_numpy(wx).to(image_tensor.device)
+            tile_image = image_tensor[:, :, y * factor : (y + tile_h) * factor, x * factor : (x + tile_w) * factor]
+            tile_moments = vae.quant_conv(vae.encoder(tile_image)).float()
+            if moments is None:
+                moments = torch.zeros(
+                    (batch, tile_moments.shape[1], height, width), dtype=torch.float32, device=image_tensor.device
+                )
+            moments[:, :, y : y + tile_h, x : x + tile_w] += tile_moments * (wy[:, None] * wx[None, :])
+
+    return DiagonalGaussianDistribution(moments.to(dtype=image_tensor.dtype)).sample()
@@ -0,0 +1,69 @@
+# Copyright (c) 2023 the InvokeAI Development Team
+"""
+Helpers for splitting an image or latent plane into overlapping tiles
+and blending the per-tile results back together.
+
+All tiles along an axis have the same size, the first tile starts at 0
+and the last tile ends exactly at the edge of the plane, so the
+overlap between the last two tiles may be larger than requested.
+"""
+from typing import List
+
+import numpy as np
+
+
+def tile_starts(length: int, tile_size: int, overlap: int) -> List[int]:
+    """
+    Return the start offsets of the tiles needed to cover `length`.
+
+    :param length: size of the axis to cover
+    :param tile_size: size of each tile; clamped to `length`
+    :param overlap: minimum overlap between neighbouring tiles
+    """
+    if length <= 0:
+        raise ValueError(f"cannot tile an axis of length {length}")
+    tile_size = min(tile_size, length)
+    overlap = max(0, min(overlap, tile_size - 1))
+    if tile_size == length:
+        return [0]
+    stride = tile_size - overlap
+    starts = list(range(0, length - tile_size, stride))
+    starts.append(length - tile_size)
+    return starts
+
+
+def blend_weights(length: int, tile_size: int, overlap: int, multiple: int = 1) -> List[np.ndarray]:
+    """
+    Return one 1-D weight ramp per tile produced by `tile_starts(length, tile_size, overlap)`.
+
+    The ramps fade linearly across the overlapping regions and are
+    normalised so that, at every position along the axis, the weights of
+    all tiles covering that position sum to exactly one. The outer
+    product of the ramps for two axes is therefore a partition of unity
+    over the plane, and weighted tile results can be accumulated without
+    any further normalisation.
+
+    :param multiple: expand the weights by this factor, e.g. 8 to get
+                     pixel-space weights for tiles laid out in latent space
+    """
+    starts = tile_starts(length, tile_size, overlap)
+    tile_size = min(tile_size, length)
+    overlap = max(0, min(overlap, tile_size - 1))
+    length, tile_size, overlap = length * multiple, tile_size * multiple, overlap * multiple
+    starts = [s * multiple for s in starts]
+
+    ramp = (np.arange(overlap, dtype=np.float32) + 0.5) / overlap if overlap > 0 else None
+    raw = []
+    for i, start in enumerate(starts):
+        w = np.ones(tile_size, dtype=np.float32)
+        if ramp is not None:
+            if i > 0:
+                w[:overlap] = np.minimum(w[:overlap], ramp)
+            if i < len(starts) - 1:
+                w[-overlap:] = np.minimum(w[-overlap:], ramp[::-1])
+        raw.append(w)
+
+    total = np.zeros(length, dtype=np.float32)
+    for start, w in zip(starts, raw):
+        total[start : start + tile_size] += w
+    return [w / total[start : start + tile_size] for start, w in zip(starts, raw)]
@@ -11,6 +11,7 @@ from inspect import isfunction
 from pathlib import Path
 from queue import Queue
 from threading import Thread
+from typing import Callable, Optional
 
 import numpy as np
 import requests
@@ -269,7 +270,12 @@ def ask_user(question: str, answers: list):
 
 
 # -------------------------------------
-def download_with_resume(url: str, dest: Path, access_token: str = None) -> Path:
+def download_with_resume(
+    url: str,
+    dest: Path,
+    access_token: str = None,
+    progress_callback: Optional[Callable[[str, int, int], None]] = None,
+) -> Path:
     """
     Download a model file.
     :param url:  https, http or ftp URL
@@ -277,6 +283,7 @@ def download_with_resume(url: str, dest: Path, access_token: str = None) -> Path
                  from the URL's Content-Disposition header and copy the URL contents into
                  dest/filename
     :param access_token: Access token to access this resource
+    :param progress_callback: Called with the file name, the bytes downloaded and the total bytes as the download progresses
     """
     header = {"Authorization": f"Bearer {access_token}"} if access_token else {}
     open_mode = "wb"
@@ -331,6 +338,8 @@ def download_with_resume(url: str, dest: Path, access_token: str = None) -> Path
             for data in resp.iter_content(chunk_size=1024):
                 size = file.write(data)
                 bar.update(size)
+                if progress_callback:
+                    progress_callback(dest.name, bar.n, content_length)
     except Exception as e:
         logger.error(f"An error occurred while downloading {dest}: {str(e)}")
         return None
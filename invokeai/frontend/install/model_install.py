@@ -676,6 +676,11 @@ def select_and_download_models(opt: Namespace):
     installer = ModelInstall(config, prediction_type_helper=ask_user_for_prediction_type)
     if opt.list_models:
         installer.list_models(opt.list_models)
+    elif opt.list_convert_cache:
+        installer.list_convert_cache()
+    elif opt.prune_convert_cache is not None:
+        # given without a size, prune to the configured size
+        installer.prune_convert_cache(opt.prune_convert_cache if opt.prune_convert_cache >= 0 else None)
     elif opt.add or opt.delete:
         selections = InstallSelections(install_models=opt.add or [], remove_models=opt.delete or [])
         installer.install(selections)
@@ -747,6 +752,20 @@ def main():
         choices=[x.value for x in ModelType],
         help="list installed models",
     )
+    parser.add_argument(
+        "--list-convert-cache",
+        action="store_true",
+        help="list the models converted or mapped in models/.cache",
+    )
+    parser.add_argument(
+        "--prune-convert-cache",
+        nargs="?",
+        type=float,
+        const=-1,
+        default=None,
+        metavar="GB",
+        help="delete the least recently used converted models until models/.cache fits in GB, or in convert_cache_size",
+    )
     parser.add_argument(
         "--config_file",
         "-c",
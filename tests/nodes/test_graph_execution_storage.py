@@ -0,0 +1,86 @@
+from .test_invoker import create_edge
+from invokeai.app.invocations.baseinvocation import InvocationContext
+from invokeai.app.invocations.collections import RangeInvocation
+from invokeai.app.invocations.math import AddInvocation, MultiplyInvocation
+from invokeai.app.services.graph import Graph, GraphExecutionState, IterateInvocation
+from invokeai.app.services.graph_execution_storage import SqliteGraphExecutionStateStorage
+from invokeai.app.services.sqlite import sqlite_memory
+import pytest
+
+
+@pytest.fixture
+def iterated_graph() -> Graph:
+    graph = Graph()
+    graph.add_node(RangeInvocation(id="0", start=0, stop=3, step=1))
+    graph.add_node(IterateInvocation(id="1"))
+    graph.add_node(MultiplyInvocation(id="2", b=10))
+    graph.add_node(AddInvocation(id="3", b=1))
+    graph.add_edge(create_edge("0", "collection", "1", "collection"))
+    graph.add_edge(create_edge("1", "item", "2", "a"))
+    graph.add_edge(create_edge("2", "value", "3", "a"))
+    return graph
+
+
+def run_to_completion(storage: SqliteGraphExecutionStateStorage, state: GraphExecutionState) -> GraphExecutionState:
+    while True:
+        node = state.next()
+        if node is None:
+            return state
+        storage.set(state)
+        state = storage.get(state.id)
+        node = state.execution_graph.get_node(node.id)
+        state.complete(node.id, node.invoke(InvocationContext(None, state.id)))
+        storage.set(state)
+
+
+def count_parts(storage: SqliteGraphExecutionStateStorage) -> int:
+    storage._cursor.execute("SELECT count(*) FROM graph_executions_parts;")
+    return storage._cursor.fetchone()[0]
+
+
+def test_materializes_the_session(iterated_graph):
+    storage = SqliteGraphExecutionStateStorage(filename=sqlite_memory, table_name="graph_executions")
+    state = run_to_completion(storage, GraphExecutionState(graph=iterated_graph))
+
+    stored = storage.get(state.id)
+    assert stored == state
+    assert stored.is_complete()
+    add_results = [r.value for id, r in stored.results.items() if stored.prepared_source_mapping[id] == "3"]
+    assert sorted(add_results) == [1, 11, 21]
+
+
+def test_only_writes_changed_parts(iterated_graph):
+    storage = SqliteGraphExecutionStateStorage(filename=sqlite_memory, table_name="graph_executions")
+    state = run_to_completion(storage, GraphExecutionState(graph=iterated_graph))
+
+    storage._cursor.execute("UPDATE graph_executions_parts SET value = value || ' ' WHERE kind = 'result';")
+    storage._conn.commit()
+    state.set_node_error("3", "error")
+    storage.set(state)
+
+    # the results were already stored, so they weren't rewritten
+    storage._cursor.execute("SELECT count(*) FROM graph_executions_parts WHERE kind = 'result' AND value LIKE '% ';")
+    assert storage._cursor.fetchone()[0] == len(state.results)
+    assert storage.get(state.id).errors == {"3": "error"}
+
+
+def test_reads_sessions_stored_whole(iterated_graph):
+    storage = SqliteGraphExecutionStateStorage(filename=sqlite_memory, table_name="graph_executions")
+    state = GraphExecutionState(graph=iterated_graph)
+    state.next()
+    storage._cursor.execute("INSERT INTO graph_executions (item) VALUES (?);", (state.json(),))
+    storage._conn.commit()
+
+    assert storage.get(state.id) == state
+    state = run_to_completion(storage, storage.get(state.id))
+    assert storage.get(state.id) == state
+    assert count_parts(storage) > 0
+
+
+def test_delete_removes_parts(iterated_graph):
+    storage = SqliteGraphExecutionStateStorage(filename=sqlite_memory, table_name="graph_executions")
+    state = run_to_completion(storage, GraphExecutionState(graph=iterated_graph))
+    storage.delete(state.id)
+
+    assert storage.get(state.id) is None
+    assert count_parts(storage) == 0
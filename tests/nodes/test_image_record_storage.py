@@ -0,0 +1,185 @@
+from pathlib import Path
+from typing import Optional
+
+import pytest
+
+from invokeai.app.models.image import ImageCategory, ResourceOrigin
+from invokeai.app.services.board_image_record_storage import SqliteBoardImageRecordStorage
+from invokeai.app.services.board_record_storage import SqliteBoardRecordStorage
+from invokeai.app.services.image_record_storage import (
+    InvalidCursorException,
+    SqliteImageRecordStorage,
+    encode_cursor,
+)
+from invokeai.app.services.models.image_record import ImageRecordChanges
+
+
+class Stores:
+    def __init__(self, filename: str):
+        self.images = SqliteImageRecordStorage(filename)
+        self.boards = SqliteBoardRecordStorage(filename)
+        self.board_images = SqliteBoardImageRecordStorage(filename)
+
+    def add_image(self, image_name: str, created_at: str, prompt: Optional[str] = None, starred: bool = False):
+        metadata = {"positive_prompt": prompt} if prompt is not None else None
+        self.images.save(
+            image_name, ResourceOrigin.INTERNAL, ImageCategory.GENERAL, None, 64, 64, None, metadata, starred=starred
+        )
+        # images saved in the same millisecond would otherwise sort by name only
+        self.images._conn.execute("UPDATE images SET created_at = ? WHERE image_name = ?;", (created_at, image_name))
+        self.images._conn.commit()
+
+
+@pytest.fixture
+def stores(tmp_path: Path) -> Stores:
+    return Stores(str(tmp_path / "invokeai.db"))
+
+
+def test_delete_many_returns_the_names_deleted(stores: Stores):
+    for i in range(3):
+        stores.add_image(f"image{i}.png", f"2023-09-01 00:00:0{i}.000")
+
+    deleted = stores.images.delete_many(["image0.png", "missing.png", "image2.png"])
+    assert sorted(deleted) == ["image0.png", "image2.png"]
+    assert stores.images.get_many(0, 10).total == 1
+    assert stores.images.delete_many(["missing.png"]) == []
+
+
+def test_update_many_skips_missing_names(stores: Stores):
+    for i in range(3):
+        stores.add_image(f"image{i}.png", f"2023-09-01 00:00:0{i}.000")
+
+    updated = stores.images.update_many(["image1.png", "missing.png"], ImageRecordChanges(starred=True))
+    assert updated == ["image1.png"]
+    starred = [r.image_name for r in stores.images.get_many(0, 10).items if r.starred]
+    assert starred == ["image1.png"]
+    assert stores.images.update_many(["image0.png"], ImageRecordChanges()) == []
+
+
+def test_get_many_returns_boards_and_total(stores: Stores):
+    board = stores.boards.save("board")
+    for i in range(5):
+        stores.add_image(f"image{i}.png", f"2023-09-01 00:00:0{i}.000")
+    stores.board_images.add_image_to_board(board.board_id, "image1.png")
+    stores.board_images.add_image_to_board(board.board_id, "image3.png")
+
+    page = stores.images.get_many(0, 2)
+    assert page.total == 5
+    assert [(r.image_name, r.board_id) for r in page.items] == [("image4.png", None), ("image3.png", board.board_id)]
+
+    on_board = stores.images.get_many(0, 10, board_id=board.board_id)
+    assert on_board.total == 2
+    assert [r.image_name for r in on_board.items] == ["image3.png", "image1.png"]
+    assert [r.image_name for r in stores.images.get_many(0, 10, board_id="none").items] == [
+        "image4.png",
+        "image2.png",
+        "image0.png",
+    ]
+
+    # an empty page past the end still reports the total
+    past_end = stores.images.get_many(10, 2)
+    assert past_end.items == [] and past_end.total == 5
+
+
+def test_cursor_pages_match_offset_pages(stores: Stores):
+    for i in range(7):
+        # ties on created_at are broken by name
+        stores.add_image(f"image{i}.png", f"2023-09-01 00:00:0{i // 2}.000", starred=i == 2)
+
+    offset_pages = [[r.image_name for r in stores.images.get_many(offset, 3).items] for offset in (0, 3, 6)]
+    cursor_pages = []
+    cursor = None
+    while True:
+        page = stores.images.get_many_by_cursor(cursor, 3)
+        cursor_pages.append([r.image_name for r in page.items])
+        cursor = page.next_cursor
+        if cursor is None:
+            break
+    assert cursor_pages == offset_pages
+    assert offset_pages[0][0] == "image2.png"
+
+
+def test_board_cursor_pages_cover_every_board(stores: Stores):
+    board_ids = {stores.boards.save(f"board{i}").board_id for i in range(5)}
+    seen = []
+    cursor = None
+    while True:
+        page = stores.boards.get_many_by_cursor(cursor, 2)
+        seen.extend(b.board_id for b in page.items)
+        cursor = page.next_cursor
+        if cursor is None:
+            break
+    assert len(seen) == 5 and set(seen) == board_ids
+
+
+@pytest.mark.parametrize(
+    "cursor",
+    [
+        "not a cursor",
+        encode_cursor([1, "2023-09-01 00:00:00.000"]),
+        encode_cursor({"starred": 1}),
+        encode_cursor([1, "2023-09-01 00:00:00.000", {"image_name": "a"}]),
+        encode_cursor([[1], "2023-09-01 00:00:00.000", "image0.png"]),
+        encode_cursor([2**64, "2023-09-01 00:00:00.000", "image0.png"]),
+    ],
+)
+def test_invalid_cursors_are_rejected(stores: Stores, cursor: str):
+    stores.add_image("image0.png", "2023-09-01 00:00:00.000")
+    with pytest.raises(InvalidCursorException):
+        stores.images.get_many_by_cursor(cursor, 10)
+
+
+def test_board_cover_images_and_counts(stores: Stores):
+    boards = [stores.boards.save(f"board{i}").board_id for i in range(3)]
+    for i in range(5):
+        stores.add_image(f"image{i}.png", f"2023-09-01 00:00:0{i}.000")
+    for image_name, board_id in [("image0.png", 0), ("image3.png", 0), ("image1.png", 0), ("image2.png", 1)]:
+        stores.board_images.add_image_to_board(boards[board_id], image_name)
+
+    covers = stores.board_images.get_cover_images_and_counts()
+    # boards without images are left out
+    assert covers == {boards[0]: ("image3.png", 3), boards[1]: ("image2.png", 1)}
+    for board_id, (cover, _) in covers.items():
+        assert stores.images.get_most_recent_image_for_board(board_id).image_name == cover
+        assert stores.board_images.get_image_count_for_board(board_id) == covers[board_id][1]
+
+    assert stores.board_images.get_cover_images_and_counts([boards[1], boards[2]]) == {boards[1]: ("image2.png", 1)}
+    assert stores.board_images.get_cover_images_and_counts([]) == {}
+
+
+def test_search_ranks_best_matches_first(stores: Stores):
+    stores.add_image("car.png", "2023-09-01 00:00:01.000", "a red car parked on a long road lined with trees")
+    stores.add_image("fox.png", "2023-09-01 00:00:00.000", "red fox, red fur")
+    stores.add_image("bird.png", "2023-09-01 00:00:02.000", "a blue bird")
+
+    assert [r.image_name for r in stores.images.search("red").items] == ["fox.png", "car.png"]
+    # terms match as prefixes, and all of them must match
+    assert [r.image_name for r in stores.images.search("fo red").items] == ["fox.png"]
+    assert stores.images.search("green").total == 0
+
+    stores.images.delete("fox.png")
+    assert [r.image_name for r in stores.images.search("red").items] == ["car.png"]
+
+
+def test_search_survives_vacuum_and_backfill(stores: Stores):
+    for i in range(6):
+        stores.add_image(f"image{i}.png", f"2023-09-01 00:00:0{i}.000", f"prompt number{i}")
+    # VACUUM may renumber the rowids of the images that are left
+    stores.images.delete_many(["image0.png", "image1.png", "image2.png"])
+    stores.images._conn.execute("VACUUM;")
+    assert [r.image_name for r in stores.images.search("number4").items] == ["image4.png"]
+
+    # images saved before the index existed
+    stores.images._conn.execute("DELETE FROM images_fts;")
+    stores.images._conn.execute("DELETE FROM image_search_keys;")
+    stores.images._conn.commit()
+    stores.images._conn.execute("VACUUM;")
+    assert stores.images.search("prompt").total == 0
+    assert stores.images.backfill_search_index(batch_size=2) == 3
+    assert stores.images.backfill_search_index() == 0
+    assert [r.image_name for r in stores.images.search("number5").items] == ["image5.png"]
+    assert sorted(r.image_name for r in stores.images.search("prompt").items) == [
+        "image3.png",
+        "image4.png",
+        "image5.png",
+    ]
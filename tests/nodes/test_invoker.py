@@ -40,6 +40,7 @@ def mock_services() -> InvocationServices:
     )
     return InvocationServices(
         model_manager=None,  # type: ignore
+        model_jobs=None,  # type: ignore
         events=TestEventService(),
         logger=None,  # type: ignore
         images=None,  # type: ignore
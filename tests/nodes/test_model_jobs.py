@@ -0,0 +1,165 @@
+import logging
+import threading
+from types import SimpleNamespace
+from typing import Any
+
+import pytest
+
+import invokeai.app.services.model_jobs as model_jobs
+from invokeai.app.services.events import EventServiceBase
+from invokeai.app.services.model_jobs import ModelJobCancelled, ModelJobService, ModelJobStatus
+from invokeai.backend.model_management import BaseModelType, ModelType
+from invokeai.backend.model_management.models import InvalidModelException
+
+TIMEOUT = 10
+
+
+class TestEventService(EventServiceBase):
+    def __init__(self):
+        super().__init__()
+        self.events = list()
+
+    def dispatch(self, event_name: str, payload: Any) -> None:
+        self.events.append((payload["event"], payload["data"]["job"]["id"]))
+
+
+class FakeModelManager:
+    """Imports whatever `import_model(location, progress_callback)` returns"""
+
+    def __init__(self):
+        self.import_model = None
+
+    def heuristic_import(self, items_to_import, prediction_type_helper, progress_callback):
+        (location,) = items_to_import
+        return self.import_model(location, progress_callback)
+
+    def convert_model(self, model_name, base_model, model_type, convert_dest_directory=None):
+        pass
+
+    def list_model(self, model_name, base_model, model_type):
+        return dict(model_name=model_name, base_model=base_model, model_type=model_type)
+
+
+def installed(location: str) -> dict:
+    return {
+        location: SimpleNamespace(name=location, base_model=BaseModelType.StableDiffusion1, model_type=ModelType.Main)
+    }
+
+
+@pytest.fixture
+def services():
+    return SimpleNamespace(
+        model_manager=FakeModelManager(), events=TestEventService(), logger=logging.getLogger("test_model_jobs")
+    )
+
+
+def make_service(services: SimpleNamespace, max_jobs: int = 1) -> ModelJobService:
+    service = ModelJobService(max_jobs=max_jobs)
+    service.start(SimpleNamespace(services=services))
+    return service
+
+
+def test_completed_job(services: SimpleNamespace):
+    service = make_service(services)
+    job = service.submit_convert("model", BaseModelType.StableDiffusion1, ModelType.Main)
+    assert service.get_future(job.id).result(TIMEOUT)["model_name"] == "model"
+
+    job = service.get_job(job.id)
+    assert job.status == ModelJobStatus.Completed and job.result["model_name"] == "model"
+    assert job.started_at is not None and job.finished_at is not None
+    assert services.events.events == [("model_job_started", job.id), ("model_job_completed", job.id)]
+    service.stop(None)
+
+
+def test_cancel_queued_job(services: SimpleNamespace):
+    started = threading.Event()
+    release = threading.Event()
+
+    def import_model(location, progress_callback):
+        started.set()
+        release.wait(TIMEOUT)
+        return installed(location)
+
+    services.model_manager.import_model = import_model
+    service = make_service(services, max_jobs=1)
+    first = service.submit_install("first")
+    assert started.wait(TIMEOUT)
+    second = service.submit_install("second")
+    assert service.get_job(second.id).status == ModelJobStatus.Queued
+
+    cancelled = service.cancel_job(second.id)
+    assert cancelled.status == ModelJobStatus.Cancelled and cancelled.finished_at is not None
+    assert service.get_future(second.id).cancelled()
+    assert ("model_job_cancelled", second.id) in services.events.events
+
+    release.set()
+    service.get_future(first.id).result(TIMEOUT)
+    assert service.get_job(first.id).status == ModelJobStatus.Completed
+    assert service.get_job(second.id).status == ModelJobStatus.Cancelled
+    assert service.cancel_job("no such job") is None
+    service.stop(None)
+
+
+def test_cancel_running_job(services: SimpleNamespace):
+    started = threading.Event()
+    cancel_requested = threading.Event()
+
+    def import_model(location, progress_callback):
+        progress_callback("model.safetensors", 0, 100)
+        started.set()
+        cancel_requested.wait(TIMEOUT)
+        # the next progress report stops the download
+        progress_callback("model.safetensors", 50, 100)
+        return installed(location)
+
+    services.model_manager.import_model = import_model
+    service = make_service(services)
+    job = service.submit_install("model")
+    assert started.wait(TIMEOUT)
+    running = service.get_job(job.id)
+    assert running.status == ModelJobStatus.Running and running.message == "Downloading model.safetensors"
+
+    # a running job is only cancelled once it next reports progress
+    assert service.cancel_job(job.id).status == ModelJobStatus.Running
+    cancel_requested.set()
+    with pytest.raises(ModelJobCancelled):
+        service.get_future(job.id).result(TIMEOUT)
+
+    job = service.get_job(job.id)
+    assert job.status == ModelJobStatus.Cancelled and job.message is None and job.result is None
+    assert [event for event, _ in services.events.events] == [
+        "model_job_started",
+        "model_job_progress",
+        "model_job_cancelled",
+    ]
+    service.stop(None)
+
+
+def test_failed_job(services: SimpleNamespace):
+    services.model_manager.import_model = lambda location, progress_callback: dict()
+    service = make_service(services)
+    job = service.submit_install("not a model")
+    with pytest.raises(InvalidModelException):
+        service.get_future(job.id).result(TIMEOUT)
+
+    job = service.get_job(job.id)
+    assert job.status == ModelJobStatus.Failed
+    assert job.error == "InvalidModelException: Unable to import not a model"
+    assert services.events.events[-1] == ("model_job_error", job.id)
+    service.stop(None)
+
+
+def test_finished_jobs_are_forgotten(services: SimpleNamespace, monkeypatch):
+    monkeypatch.setattr(model_jobs, "MAX_FINISHED_JOBS", 2)
+    service = make_service(services)
+    jobs = []
+    for i in range(4):
+        jobs.append(service.submit_convert(f"model{i}", BaseModelType.StableDiffusion1, ModelType.Main))
+        service.get_future(jobs[-1].id).result(TIMEOUT)
+    assert len(service.list_jobs()) == 3
+
+    # finished jobs beyond the limit are forgotten when the next one is submitted, oldest first
+    jobs.append(service.submit_convert("model4", BaseModelType.StableDiffusion1, ModelType.Main))
+    assert [job.id for job in service.list_jobs()] == [job.id for job in jobs[2:]]
+    assert service.get_job(jobs[0].id) is None and service.get_future(jobs[1].id) is None
+    service.stop(None)
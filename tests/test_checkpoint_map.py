@@ -0,0 +1,125 @@
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+import torch
+from diffusers import ConfigMixin, ModelMixin
+from diffusers.configuration_utils import register_to_config
+from safetensors.torch import load_file, save_file
+
+from invokeai.backend.model_management.convert_ckpt_to_diffusers import CheckpointTensorLocator, map_state_dict
+from invokeai.backend.model_management.models.base import COMPUTED_WEIGHTS, DiffusersModel, SubModelType
+
+
+class TinyModel(ModelMixin, ConfigMixin):
+    @register_to_config
+    def __init__(self, dim: int = 4):
+        super().__init__()
+        self.embed = torch.nn.Embedding(8, dim)
+        self.q = torch.nn.Linear(dim, dim, bias=False)
+        self.k = torch.nn.Linear(dim, dim, bias=False)
+        self.v = torch.nn.Linear(dim, dim, bias=False)
+        self.proj = torch.nn.Linear(dim, dim, bias=False)
+        self.text_projection = torch.nn.Linear(dim, dim, bias=False)
+        self.scale = torch.nn.Parameter(torch.ones(dim))
+        self.register_buffer("position_ids", torch.arange(8).expand((1, -1)))
+
+
+@pytest.fixture
+def checkpoint_path(tmp_path: Path) -> Path:
+    path = tmp_path / "model.safetensors"
+    save_file(
+        {
+            "embed": torch.randn(8, 4),
+            # OpenCLIP keeps the query, key and value projections in one tensor
+            "in_proj_weight": torch.randn(12, 4),
+            # attention convs that diffusers runs as linear layers
+            "proj_conv": torch.randn(4, 4, 1, 1),
+            "text_projection": torch.randn(4, 4),
+            "scale": torch.randn(4),
+        },
+        path,
+    )
+    return path
+
+
+def convert(checkpoint: dict) -> dict:
+    """Converts the checkpoint the way the conversion functions do, with views where they can be used."""
+    in_proj = checkpoint["in_proj_weight"]
+    return {
+        "embed.weight": checkpoint["embed"],
+        "q.weight": in_proj[:4, :],
+        "k.weight": in_proj[4:8, :],
+        "v.weight": in_proj[8:, :],
+        "proj.weight": checkpoint["proj_conv"][:, :, 0, 0],
+        "text_projection.weight": checkpoint["text_projection"].T,
+        "scale": checkpoint["scale"] * 2,
+        "position_ids": torch.arange(8).expand((1, -1)),
+    }
+
+
+def test_locate_finds_views_of_checkpoint_tensors(checkpoint_path: Path):
+    checkpoint = load_file(checkpoint_path, device="cpu")
+    locator = CheckpointTensorLocator(checkpoint)
+
+    assert locator.locate(checkpoint["embed"]) == {"key": "embed"}
+    assert locator.locate(checkpoint["in_proj_weight"][4:8, :]) == {
+        "key": "in_proj_weight",
+        "offset": 16,
+        "shape": [4, 4],
+        "stride": [4, 1],
+    }
+    assert locator.locate(checkpoint["text_projection"].T) == {
+        "key": "text_projection",
+        "offset": 0,
+        "shape": [4, 4],
+        "stride": [1, 4],
+    }
+    assert locator.locate(checkpoint["scale"] * 2) is None
+    assert locator.locate(checkpoint["embed"].to(torch.float16)) is None
+    assert locator.locate(torch.empty(0)) is None
+
+
+def test_mapped_model_loads_the_converted_weights(checkpoint_path: Path, tmp_path: Path):
+    checkpoint = load_file(checkpoint_path, device="cpu")
+    converted = convert(checkpoint)
+    weights, computed = map_state_dict(converted, CheckpointTensorLocator(checkpoint))
+    assert set(computed) == {"scale", "position_ids"}
+    assert "offset" not in weights["embed.weight"]
+    assert weights["proj.weight"]["key"] == "proj_conv"
+
+    model_path = tmp_path / "model"
+    TinyModel().save_config(model_path / "unet")
+    save_file(computed, model_path / "unet" / COMPUTED_WEIGHTS)
+    diffusers_model = SimpleNamespace(
+        model_path=str(model_path),
+        child_types={SubModelType.UNet: TinyModel},
+        checkpoint_key_map={"checkpoint": str(checkpoint_path), "models": {"unet": {"weights": weights}}},
+    )
+
+    model = DiffusersModel._load_from_checkpoint(diffusers_model, SubModelType.UNet, None)
+    state_dict = model.state_dict()
+    assert set(state_dict) == set(converted)
+    for name, value in converted.items():
+        assert torch.equal(state_dict[name], value), name
+        assert state_dict[name].device.type == "cpu"
+
+    model = DiffusersModel._load_from_checkpoint(diffusers_model, SubModelType.UNet, torch.float16)
+    assert all(p.dtype == torch.float16 for p in model.parameters())
+
+
+def test_incomplete_map_is_rejected(checkpoint_path: Path, tmp_path: Path):
+    checkpoint = load_file(checkpoint_path, device="cpu")
+    weights, computed = map_state_dict(convert(checkpoint), CheckpointTensorLocator(checkpoint))
+    del weights["v.weight"]
+
+    model_path = tmp_path / "model"
+    TinyModel().save_config(model_path / "unet")
+    save_file(computed, model_path / "unet" / COMPUTED_WEIGHTS)
+    diffusers_model = SimpleNamespace(
+        model_path=str(model_path),
+        child_types={SubModelType.UNet: TinyModel},
+        checkpoint_key_map={"checkpoint": str(checkpoint_path), "models": {"unet": {"weights": weights}}},
+    )
+    with pytest.raises(Exception, match="v.weight"):
+        DiffusersModel._load_from_checkpoint(diffusers_model, SubModelType.UNet, None)
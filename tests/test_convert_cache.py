@@ -0,0 +1,81 @@
+import os
+import time
+from pathlib import Path
+
+import pytest
+
+from invokeai.backend.model_management.convert_cache import GIG, ModelConvertCache, staging_path
+
+
+def convert(cache: ModelConvertCache, checkpoint: Path, size: int) -> Path:
+    cache_path = cache.get_cache_path(checkpoint, base_model="sd-1")
+    with staging_path(cache_path) as staging:
+        staging.mkdir()
+        (staging / "weights").write_bytes(bytes(size))
+    cache.record_use(cache_path, source=checkpoint)
+    return cache_path
+
+
+@pytest.fixture
+def checkpoints(tmp_path: Path) -> list[Path]:
+    paths = [tmp_path / f"model{i}.safetensors" for i in range(3)]
+    for path in paths:
+        path.write_bytes(os.urandom(200000))
+    return paths
+
+
+def test_key_follows_checkpoint_contents(tmp_path: Path, checkpoints: list[Path]):
+    cache = ModelConvertCache(tmp_path / ".cache")
+    cache_path = cache.get_cache_path(checkpoints[0], base_model="sd-1")
+    assert cache_path != cache.get_cache_path(checkpoints[0], base_model="sd-2")
+    assert cache_path != cache.get_cache_path(checkpoints[1], base_model="sd-1")
+
+    moved = checkpoints[0].rename(tmp_path / "moved.safetensors")
+    assert cache.get_cache_path(moved, base_model="sd-1") == cache_path
+
+
+def test_key_follows_every_byte_of_checkpoint(tmp_path: Path, checkpoints: list[Path]):
+    cache = ModelConvertCache(tmp_path / ".cache")
+    cache_path = cache.get_cache_path(checkpoints[0], base_model="sd-1")
+
+    # the same size, with one byte changed that a sampled hash would miss
+    data = bytearray(checkpoints[0].read_bytes())
+    data[123457] ^= 0xFF
+    checkpoints[0].write_bytes(data)
+    changed = cache.get_cache_path(checkpoints[0], base_model="sd-1")
+    assert changed != cache_path
+
+    # hashes are remembered across restarts while the file is unchanged
+    cache = ModelConvertCache(tmp_path / ".cache")
+    stat = checkpoints[0].stat()
+    assert cache._hashes[str(checkpoints[0])]["mtime"] == stat.st_mtime_ns
+    assert cache.get_cache_path(checkpoints[0], base_model="sd-1") == changed
+
+
+def test_least_recently_used_are_evicted(tmp_path: Path, checkpoints: list[Path]):
+    cache = ModelConvertCache(tmp_path / ".cache", max_size=250000 / GIG)
+    first = convert(cache, checkpoints[0], 100000)
+    second = convert(cache, checkpoints[1], 100000)
+    time.sleep(0.01)
+    cache.record_use(first)
+    third = convert(cache, checkpoints[2], 100000)
+
+    assert first.exists() and third.exists()
+    assert not second.exists()
+    assert [e.key for e in cache.list_entries()] == [third.name, first.name]
+
+    # the index survives a restart
+    cache = ModelConvertCache(tmp_path / ".cache", max_size=250000 / GIG)
+    assert [e.key for e in cache.prune(0)] == [first.name, third.name]
+    assert cache.list_entries() == []
+
+
+def test_failed_conversion_leaves_nothing_behind(tmp_path: Path, checkpoints: list[Path]):
+    cache = ModelConvertCache(tmp_path / ".cache")
+    cache_path = cache.get_cache_path(checkpoints[0], base_model="sd-1")
+    with pytest.raises(RuntimeError):
+        with staging_path(cache_path) as staging:
+            staging.mkdir()
+            raise RuntimeError("interrupted")
+
+    assert list((tmp_path / ".cache").iterdir()) == [tmp_path / ".cache" / "index.json"]
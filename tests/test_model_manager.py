@@ -1,3 +1,5 @@
+import os
+import time
 from pathlib import Path
 
 import pytest
@@ -8,6 +10,7 @@ from invokeai.backend import ModelManager, BaseModelType, ModelType, SubModelTyp
 BASIC_MODEL_NAME = ("SDXL base", BaseModelType.StableDiffusionXL, ModelType.Main)
 VAE_OVERRIDE_MODEL_NAME = ("SDXL with VAE", BaseModelType.StableDiffusionXL, ModelType.Main)
 VAE_NULL_OVERRIDE_MODEL_NAME = ("SDXL with empty VAE", BaseModelType.StableDiffusionXL, ModelType.Main)
+MISSING_MODEL_NAME = ("missing", BaseModelType.StableDiffusionXL, ModelType.Vae)
 
 
 @pytest.fixture
@@ -45,3 +48,29 @@ def test_get_model_path_for_null_overridden_vae(model_manager: ModelManager, dat
     )
     vae_model_path, is_override = model_manager._get_model_path(model_config, SubModelType.Vae)
     assert not is_override
+
+
+def test_missing_model_is_looked_up_once(model_manager: ModelManager, monkeypatch):
+    scans = []
+    monkeypatch.setattr(model_manager, "scan_models_directory", lambda **kwargs: scans.append(kwargs))
+    for _ in range(3):
+        assert not model_manager.model_exists(*MISSING_MODEL_NAME, rescan=True)
+    assert len(scans) == 1
+
+
+def test_only_changed_folders_are_rescanned(model_manager: ModelManager, datadir: Path, monkeypatch):
+    # age the folders past the mtime granularity, then take a fresh scan of them
+    an_hour_ago = time.time() - 3600
+    for root, _, _ in os.walk(datadir):
+        os.utime(root, (an_hour_ago, an_hour_ago))
+    model_manager.scan_models_directory()
+
+    scans = []
+    monkeypatch.setattr(model_manager, "scan_models_directory", lambda **kwargs: scans.append(kwargs))
+    model_manager.missing_model_ttl = 0
+    assert not model_manager.model_exists(*MISSING_MODEL_NAME, rescan=True)
+    assert scans == []
+
+    (datadir / "models" / "sdxl" / "vae" / "pasted").mkdir()
+    assert not model_manager.model_exists(*MISSING_MODEL_NAME, rescan=True)
+    assert scans == [dict(base_model=BaseModelType.StableDiffusionXL, model_type=ModelType.Vae, autoimport=False)]
@@ -0,0 +1,85 @@
+import pytest
+import torch
+
+from invokeai.backend.model_management.quantization import (
+    MIN_QUANTIZED_NUMEL,
+    dequantize_weights,
+    fp8_available,
+    quantize_weights,
+)
+
+
+def make_model(dtype: torch.dtype = torch.float32) -> torch.nn.Module:
+    torch.manual_seed(0)
+    model = torch.nn.Sequential(
+        torch.nn.Linear(128, 64),
+        torch.nn.LayerNorm(64),
+        torch.nn.Conv2d(16, 32, 3),
+        torch.nn.Linear(8, 8),
+    )
+    with torch.no_grad():
+        # an outlier channel, which per-channel scales keep from costing the other channels precision
+        model[0].weight[3] *= 1000
+    return model.to(dtype)
+
+
+def test_int8_round_trip():
+    model = make_model()
+    original = {name: param.detach().clone() for name, param in model.named_parameters()}
+
+    state = quantize_weights(model, "int8")
+    assert set(state) == {"0.weight", "2.weight"}
+    assert all(original[name].numel() >= MIN_QUANTIZED_NUMEL for name in state)
+    assert model[0].weight.dtype == torch.int8 and model[2].weight.dtype == torch.int8
+    # biases, norms and small weights are left alone
+    assert model[0].bias.dtype == torch.float32 and model[3].weight.dtype == torch.float32
+
+    scale, dtype = state["0.weight"]
+    assert scale.shape == (64, 1) and dtype == torch.float32
+    assert state["2.weight"][0].shape == (32, 1, 1, 1)
+
+    dequantize_weights(model, state)
+    for name, param in model.named_parameters():
+        assert param.dtype == torch.float32
+        if name not in state:
+            assert torch.equal(param, original[name])
+            continue
+        scale = state[name][0]
+        # rounding to the nearest step of each channel's scale
+        assert ((param - original[name]).abs() <= scale * 0.501).all()
+
+    # the outlier only coarsens its own channel
+    error = (model[0].weight - original["0.weight"]).abs().amax(dim=1)
+    assert error[3] > 100 * error[torch.arange(64) != 3].max()
+
+
+def test_round_trip_restores_half_precision():
+    model = make_model(torch.float16)
+    original = model[0].weight.detach().clone()
+
+    state = quantize_weights(model, "int8")
+    assert state["0.weight"][1] == torch.float16
+    dequantize_weights(model, state)
+    assert model[0].weight.dtype == torch.float16
+    relative = ((model[0].weight - original).abs().float().amax(dim=1) / original.abs().float().amax(dim=1)).max()
+    assert relative < 0.01
+
+
+@pytest.mark.skipif(not fp8_available(), reason="fp8 requires torch 2.1")
+def test_fp8_round_trip():
+    model = make_model()
+    original = {name: param.detach().clone() for name, param in model.named_parameters()}
+
+    state = quantize_weights(model, "fp8")
+    assert set(state) == {"0.weight", "2.weight"}
+    assert model[0].weight.dtype == torch.float8_e4m3fn
+    # one scale per tensor
+    assert state["0.weight"][0].numel() == 1
+
+    dequantize_weights(model, state)
+    for name in state:
+        restored = model.get_parameter(name)
+        assert restored.dtype == torch.float32
+        scale = state[name][0]
+        # 3 mantissa bits, and subnormals below 2**-6 of the scale
+        assert ((restored - original[name]).abs() <= original[name].abs() / 16 + scale * 2**-6).all()
@@ -0,0 +1,53 @@
+from pathlib import Path
+
+import torch
+
+from invokeai.backend.model_management.convert_cache import GIG
+from invokeai.backend.model_management.spill_cache import ModelSpillCache
+
+
+def make_model() -> torch.nn.Module:
+    model = torch.nn.Sequential(torch.nn.Linear(64, 64), torch.nn.LayerNorm(64))
+    return model.half()
+
+
+def test_spilled_model_is_restored(tmp_path: Path):
+    cache = ModelSpillCache(tmp_path, max_size=1.0)
+    model = make_model()
+    expected = {name: t.clone() for name, t in model.state_dict().items()}
+
+    assert cache.spill(["model:unet"], model)
+    assert all(t.numel() == 0 for t in model.state_dict().values())
+
+    restored = cache.restore("model:unet")
+    assert restored is model
+    for name, t in restored.state_dict().items():
+        assert torch.equal(t, expected[name])
+    assert cache.restore("model:unet") is None
+
+    # evicting the unchanged model again reuses its file
+    spilled = list(tmp_path.iterdir())
+    mtime = spilled[0].stat().st_mtime_ns
+    assert cache.spill(["model:unet"], model)
+    assert list(tmp_path.iterdir()) == spilled and spilled[0].stat().st_mtime_ns == mtime
+
+
+def test_least_recently_spilled_are_evicted(tmp_path: Path):
+    models = [make_model() for _ in range(3)]
+    cache = ModelSpillCache(tmp_path, max_size=20000 / GIG)
+    for i, model in enumerate(models):
+        assert cache.spill([f"model{i}:vae"], model)
+
+    assert cache.restore("model0:vae") is None
+    assert cache.restore("model2:vae") is models[2]
+    assert len(list(tmp_path.iterdir())) == 2
+
+    # spilled files don't outlive the process that wrote them, but other files in the directory are left alone
+    others = [tmp_path / "notes.txt", tmp_path / "model.safetensors", tmp_path / ("0" * 32 + ".ckpt")]
+    for path in others:
+        path.write_text("keep me")
+    (tmp_path / "models").mkdir()
+    (tmp_path / "models" / ("0" * 32 + ".safetensors")).write_text("keep me")
+    ModelSpillCache(tmp_path, max_size=1.0)
+    assert sorted(tmp_path.iterdir()) == sorted(others + [tmp_path / "models"])
+    assert (tmp_path / "models" / ("0" * 32 + ".safetensors")).exists()
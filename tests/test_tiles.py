@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+
+from invokeai.backend.util.tiles import blend_weights, tile_starts
+
+
+@pytest.mark.parametrize(
+    "length,tile_size,overlap",
+    [(100, 32, 8), (64, 64, 8), (65, 64, 8), (10, 64, 4), (128, 64, 0), (129, 64, 16)],
+)
+def test_tiles_cover_axis(length, tile_size, overlap):
+    starts = tile_starts(length, tile_size, overlap)
+    size = min(tile_size, length)
+    assert starts[0] == 0
+    assert starts[-1] + size == length
+    assert all(b - a <= size - overlap for a, b in zip(starts, starts[1:]) if size < length)
+
+
+@pytest.mark.parametrize(
+    "length,tile_size,overlap,multiple",
+    [(100, 32, 8, 1), (100, 32, 8, 8), (129, 64, 16, 8), (128, 64, 0, 1), (10, 64, 4, 8)],
+)
+def test_blend_weights_are_partition_of_unity(length, tile_size, overlap, multiple):
+    starts = tile_starts(length, tile_size, overlap)
+    weights = blend_weights(length, tile_size, overlap, multiple=multiple)
+    assert len(weights) == len(starts)
+    total = np.zeros(length * multiple, dtype=np.float32)
+    for start, w in zip(starts, weights):
+        assert len(w) == min(tile_size, length) * multiple
+        total[start * multiple : start * multiple + len(w)] += w
+    assert np.allclose(total, 1.0)
+
+
+def test_tile_starts_rejects_empty_axis():
+    with pytest.raises(ValueError):
+        tile_starts(0, 64, 8)